@@ -1,15 +1,162 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import os
 import sys
 import base64
+import itertools
+import json
+import struct
+import tarfile
+import time
+import zlib
 
 # Import our Python-JPype bridge to the Kotlin library
 from cache_api import CacheLibraryAPI
+import metrics
+import tracing
 
 app = Flask(__name__)
 
 # Initialize the cache API with JPype-Kotlin integration
-cache_api = CacheLibraryAPI()
+cache_api = CacheLibraryAPI(
+    file_cache_bytes=int(os.environ.get('FILE_CACHE_BYTES', 64 * 1024 * 1024)),
+    file_cache_ttl=float(os.environ['FILE_CACHE_TTL']) if os.environ.get('FILE_CACHE_TTL') else None
+)
+metrics.REGISTRY.add_collector(metrics.cache_collector(cache_api))
+# Opt-in: TRACE_SLOW_MS logs slower requests with their phases, TRACE_FILE appends traces as OTLP/JSON
+tracing.configure_from_environ()
+
+OCTET_STREAM = 'application/octet-stream'
+NDJSON = 'application/x-ndjson'
+
+# Frame header of the binary batch format: status, index id, archive id, file id, payload length
+BATCH_FRAME = struct.Struct('>BiiiI')
+
+# Record header of the export records format: path length, data length (path and data follow)
+EXPORT_RECORD = struct.Struct('>HI')
+EXPORT_FORMATS = {'tar': 'application/x-tar', 'records': OCTET_STREAM, 'ndjson': NDJSON}
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Sent with /data responses; the default lets shared caches store files but revalidate them with If-None-Match
+CACHE_CONTROL = os.environ.get('DATA_CACHE_CONTROL', 'public, no-cache')
+
+@app.before_request
+def start_timer():
+    request.environ['cache_api.start'] = time.perf_counter()
+    if tracing.enabled():
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        request.environ['cache_api.trace'] = tracing.start_trace(
+            f"{request.method} {route}", **{"http.method": request.method, "http.target": request.full_path.rstrip('?')})
+
+@app.after_request
+def record_request(response):
+    """Count the request per route; streamed bodies add their bytes once they are sent"""
+    start = request.environ.get('cache_api.start')
+    if start is None:
+        return response
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    index_id = (request.view_args or {}).get('index_id')
+    if response.is_streamed:
+        response.response = count_streamed(route, response.response)
+        bytes_out = None
+    else:
+        bytes_out = response.content_length
+    metrics.observe_request(request.method, route, response.status_code, time.perf_counter() - start,
+                            index_id if isinstance(index_id, int) else None, request.content_length, bytes_out)
+    request.environ['cache_api.trace_attributes'] = {"http.status_code": response.status_code,
+                                                     "http.response_content_length": bytes_out}
+    return response
+
+@app.teardown_request
+def finish_request_trace(error):
+    """Finish the trace here, since after_request is skipped when a view raises"""
+    trace = request.environ.pop('cache_api.trace', None)
+    if trace is None:
+        return
+    if error is not None:
+        trace.root.error = f"{type(error).__name__}: {error}"
+    tracing.finish_trace(trace, **request.environ.get('cache_api.trace_attributes', {"http.status_code": 500}))
+
+def count_streamed(route, chunks):
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        metrics.RESPONSE_BYTES.inc(route, amount=sent)
+
+def wants_raw_response():
+    """Whether the client asked for application/octet-stream instead of base64 JSON"""
+    if request.args.get('raw', '').lower() in ('1', 'true', 'yes'):
+        return True
+    best = request.accept_mimetypes.best_match(['application/json', OCTET_STREAM])
+    return best == OCTET_STREAM
+
+def file_etag(index_id, archive_id, file_id, xtea, version, raw):
+    """Strong ETag of a /data representation, version being the archive's (crc, revision, generation).
+
+    The generation is a FileCache.version, so tags handed out before the file cache was cleared, by
+    an earlier run or by another process never match.
+    """
+    crc, revision, generation = version
+    tag = f"{index_id}.{archive_id}.{file_id}.{crc & 0xffffffff:08x}.{revision}.{generation}"
+    if xtea:
+        # A wrong key decrypts to different bytes, so the key is part of the representation
+        tag += f".{zlib.crc32(struct.pack(f'>{len(xtea)}i', *xtea)):08x}"
+    return tag if raw else tag + ".json"
+
+def cache_headers(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    response.vary.add('Accept')
+    return response
+
+def file_data_response(index_id, archive_id, file_id, xtea):
+    """Serve a file as base64 JSON or octet-stream, answering If-None-Match without reading it"""
+    with tracing.span("parse"):
+        raw = wants_raw_response()
+        if_none_match = request.if_none_match
+    if if_none_match:
+        with tracing.span("revalidate"):
+            version = cache_api.archive_version(index_id, archive_id)
+        if version is not None:
+            etag = file_etag(index_id, archive_id, file_id, xtea, version, raw)
+            if if_none_match.contains_weak(etag):
+                return cache_headers(Response(status=304), etag)
+    
+    with tracing.span("read_file"):
+        result = cache_api.read_file(index_id, archive_id, file_id, xtea)
+    if result["status"] != "success":
+        return raw_file_response(result) if raw else jsonify(result)
+    
+    if raw:
+        with tracing.span("serialize"):
+            response = raw_file_response(result)
+    else:
+        with tracing.span("encode"):
+            body = CacheLibraryAPI.json_file_result(result)
+        with tracing.span("serialize"):
+            response = jsonify(body)
+    if result.get("crc") is not None:
+        version = (result["crc"], result["revision"], result["generation"])
+        cache_headers(response, file_etag(index_id, archive_id, file_id, xtea, version, raw))
+    return response
+
+def raw_file_response(result):
+    """Build an octet-stream response from a CacheLibraryAPI.read_file result"""
+    if result["status"] != "success":
+        return jsonify(result), 404
+    headers = {
+        "X-Index-Id": str(result["index_id"]),
+        "X-Archive-Id": str(result["archive_id"]),
+        "X-File-Id": str(result["file_id"]),
+        "Content-Length": str(len(result["data"]))
+    }
+    if result.get("crc") is not None:
+        headers["X-Crc"] = str(result["crc"])
+    if result.get("revision") is not None:
+        headers["X-Revision"] = str(result["revision"])
+    return Response(result["data"], mimetype=OCTET_STREAM, headers=headers)
 
 @app.route('/initialize', methods=['POST'])
 def initialize_cache():
@@ -28,7 +175,11 @@ def initialize_cache():
     if not os.path.exists(path):
         return jsonify({"status": "error", "message": "Path does not exist"}), 400
     
-    result = cache_api.initialize_cache(path)
+    result = cache_api.initialize_cache(path, use_mmap_reader=bool(data.get('mmap_reader', False)),
+                                        lazy=bool(data.get('lazy', False)))
+    warm = data.get('warm')
+    if result["status"] == "success" and warm:
+        result["warm_up"] = start_warm_up(warm)
     return jsonify(result)
 
 @app.route('/data/<int:index_id>/<int:archive_id>/<int:file_id>', methods=['GET'])
@@ -43,8 +194,7 @@ def get_file_data(index_id, archive_id, file_id):
         except ValueError:
             return jsonify({"status": "error", "message": "Invalid XTEA format, must be comma-separated integers"}), 400
     
-    result = cache_api.get_file_data(index_id, archive_id, file_id, xtea_array)
-    return jsonify(result)
+    return file_data_response(index_id, archive_id, file_id, xtea_array)
 
 @app.route('/data/<int:index_id>/<int:archive_id>', methods=['GET'])
 def get_archive_data(index_id, archive_id):
@@ -58,8 +208,48 @@ def get_archive_data(index_id, archive_id):
         except ValueError:
             return jsonify({"status": "error", "message": "Invalid XTEA format, must be comma-separated integers"}), 400
     
-    result = cache_api.get_file_data(index_id, archive_id, 0, xtea_array)
-    return jsonify(result)
+    return file_data_response(index_id, archive_id, 0, xtea_array)
+
+@app.route('/data/batch', methods=['POST'])
+def get_batch_data():
+    """Get many files in one request, streamed back in request order"""
+    data = request.json or {}
+    items = data.get('requests')
+    if not isinstance(items, list):
+        return jsonify({"status": "error", "message": "A list of requests is required"}), 400
+    
+    requests = []
+    for item in items:
+        try:
+            xtea = item.get('xtea')
+            if isinstance(xtea, str):
+                xtea = [int(x) for x in xtea.split(',')] if xtea else None
+            elif xtea is not None:
+                xtea = [int(x) for x in xtea]
+            requests.append((int(item['index']), int(item['archive']), int(item.get('file', 0)), xtea))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return jsonify({"status": "error", "message": f"Invalid batch request: {item}"}), 400
+    
+    output_format = data.get('format')
+    if output_format is None:
+        output_format = 'binary' if wants_raw_response() else 'ndjson'
+    
+    results = cache_api.iter_many(requests)
+    if output_format == 'binary':
+        def generate_frames():
+            for result in results:
+                ok = result["status"] == "success"
+                payload = result["data"] if ok else result["message"].encode('utf-8')
+                yield BATCH_FRAME.pack(0 if ok else 1, result["index_id"], result["archive_id"], result["file_id"], len(payload))
+                yield payload
+        return Response(generate_frames(), mimetype=OCTET_STREAM)
+    
+    def generate_lines():
+        for result in results:
+            if result["status"] == "success":
+                result["data"] = base64.b64encode(result["data"]).decode('utf-8')
+            yield json.dumps(result) + '\n'
+    return Response(generate_lines(), mimetype=NDJSON)
 
 @app.route('/data/<int:index_id>/<string:archive_name>', methods=['GET'])
 def get_archive_data_by_name(index_id, archive_name):
@@ -73,18 +263,120 @@ def get_archive_data_by_name(index_id, archive_name):
         except ValueError:
             return jsonify({"status": "error", "message": "Invalid XTEA format, must be comma-separated integers"}), 400
     
-    # For named archives, we need to find the archive ID first
-    # This is a simplified implementation - in a real implementation, 
-    # we would need to search for the archive by name
-    result = {
-        "status": "error", 
-        "message": "Getting data by archive name not yet implemented"
+    archive_id = cache_api.archive_id(index_id, archive_name)
+    if archive_id is None:
+        return jsonify({"status": "error", "message": f"Archive {archive_name} not found in index {index_id}"}), 404
+    
+    return file_data_response(index_id, archive_id, 0, xtea_array)
+
+def put_raw_data(index_id, archive_id, file_id):
+    """Write an application/octet-stream request body, with xtea passed as a query argument"""
+    data = request.get_data()
+    if not data:
+        return jsonify({"status": "error", "message": "Data is required"}), 400
+    
+    xtea = request.args.get('xtea')
+    xtea_array = None
+    if xtea:
+        try:
+            # Parse xtea as comma-separated integers
+            xtea_array = [int(x) for x in xtea.split(',')]
+        except ValueError:
+            return jsonify({"status": "error", "message": "Invalid XTEA format, must be comma-separated integers"}), 400
+    
+    result = cache_api.put_file_bytes(index_id, archive_id, file_id, data, xtea_array)
+    return jsonify(result)
+
+@app.route('/raw/<int:index_id>/<int:archive_id>', methods=['GET'])
+def get_raw_archive(index_id, archive_id):
+    """Get an archive container as stored, without decompression or decryption"""
+    result = cache_api.get_raw_archive(index_id, archive_id)
+    if result["status"] != "success":
+        return jsonify(result), 404
+    headers = {
+        "X-Index-Id": str(index_id),
+        "X-Archive-Id": str(archive_id),
+        "Content-Length": str(len(result["data"]))
     }
-    return jsonify(result), 501
+    return Response(result["data"], mimetype=OCTET_STREAM, headers=headers)
+
+def export_chunks(index_id, results, output_format):
+    """Encode export_index results as tar, length-prefixed records or NDJSON, in chunks of about 64 KiB.
+
+    Files are named <index>/<archive>/<file>. Archives that failed are listed in
+    <index>/errors.json at the end of tar and records exports.
+    """
+    buffer = bytearray()
+    errors = []
+    mtime = int(time.time())
+    
+    def encode(path, data):
+        if output_format == 'tar':
+            info = tarfile.TarInfo(path)
+            info.size = len(data)
+            info.mtime = mtime
+            info.mode = 0o644
+            buffer.extend(info.tobuf(format=tarfile.USTAR_FORMAT))
+            buffer.extend(data)
+            buffer.extend(bytes(-len(data) % tarfile.BLOCKSIZE))
+        else:
+            encoded_path = path.encode('utf-8')
+            buffer.extend(EXPORT_RECORD.pack(len(encoded_path), len(data)))
+            buffer.extend(encoded_path)
+            buffer.extend(data)
+    
+    for result in results:
+        if output_format == 'ndjson':
+            if result["status"] == "success":
+                result["data"] = base64.b64encode(result["data"]).decode('utf-8')
+            result["index_id"] = index_id
+            buffer.extend((json.dumps(result) + '\n').encode('utf-8'))
+        elif result["status"] == "success":
+            encode(f"{index_id}/{result['archive_id']}/{result['file_id']}", result["data"])
+        else:
+            errors.append({"archive_id": result["archive_id"], "message": result["message"]})
+        if len(buffer) >= EXPORT_CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    
+    if errors:
+        encode(f"{index_id}/errors.json", json.dumps(errors).encode('utf-8'))
+    if output_format == 'tar':
+        buffer.extend(bytes(2 * tarfile.BLOCKSIZE))
+    if buffer:
+        yield bytes(buffer)
+
+@app.route('/export/<int:index_id>', methods=['GET', 'POST'])
+def export_index(index_id):
+    """Stream every file of an index as a tar archive, length-prefixed records or NDJSON"""
+    data = (request.get_json(silent=True) or {}) if request.method == 'POST' else {}
+    output_format = data.get('format') or request.args.get('format', 'tar')
+    if output_format not in EXPORT_FORMATS:
+        return jsonify({"status": "error", "message": f"Unknown export format {output_format}, use one of {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        workers = int(data.get('workers') or request.args.get('workers', 4))
+        # Keys of encrypted archives, e.g. {"xteas": {"1234": [1, 2, 3, 4]}}
+        xteas = {int(archive_id): [int(key) for key in keys] for archive_id, keys in (data.get('xteas') or {}).items()}
+    except (TypeError, ValueError, AttributeError):
+        return jsonify({"status": "error", "message": "Invalid workers or xteas"}), 400
+    if not 1 <= workers <= 32:
+        return jsonify({"status": "error", "message": "workers must be between 1 and 32"}), 400
+    
+    results = cache_api.export_index(index_id, workers=workers, xteas=xteas)
+    first = next(results, None)
+    if first is not None and first["status"] != "success" and first["archive_id"] is None:
+        return jsonify({"status": "error", "message": first["message"]}), 404
+    if first is not None:
+        results = itertools.chain([first], results)
+    headers = {"Content-Disposition": f"attachment; filename=index{index_id}.{output_format}"}
+    return Response(export_chunks(index_id, results, output_format), mimetype=EXPORT_FORMATS[output_format], headers=headers)
 
 @app.route('/put/<int:index_id>/<int:archive_id>/<int:file_id>', methods=['POST'])
 def put_file_data(index_id, archive_id, file_id):
     """Put file data into the cache"""
+    if request.mimetype == OCTET_STREAM:
+        return put_raw_data(index_id, archive_id, file_id)
+    
     data = request.json.get('data')
     xtea = request.json.get('xtea')
     
@@ -105,6 +397,9 @@ def put_file_data(index_id, archive_id, file_id):
 @app.route('/put/<int:index_id>/<int:archive_id>', methods=['POST'])
 def put_archive_data(index_id, archive_id):
     """Put archive data into the cache"""
+    if request.mimetype == OCTET_STREAM:
+        return put_raw_data(index_id, archive_id, 0)
+    
     data = request.json.get('data')
     xtea = request.json.get('xtea')
     
@@ -124,9 +419,18 @@ def put_archive_data(index_id, archive_id):
 
 @app.route('/put/<int:index_id>/<string:archive_name>', methods=['POST'])
 def put_archive_data_by_name(index_id, archive_name):
-    """Put archive data by name into the cache"""
-    data = request.json.get('data')
-    xtea = request.json.get('xtea')
+    """Put archive data by name into the cache, adding the archive if it does not exist"""
+    if request.mimetype == OCTET_STREAM:
+        data = request.get_data()
+        xtea = request.args.get('xtea')
+    else:
+        data = request.json.get('data')
+        xtea = request.json.get('xtea')
+        if data:
+            try:
+                data = base64.b64decode(data)
+            except ValueError:
+                return jsonify({"status": "error", "message": "Invalid base64 data"}), 400
     
     if not data:
         return jsonify({"status": "error", "message": "Data is required"}), 400
@@ -139,14 +443,8 @@ def put_archive_data_by_name(index_id, archive_name):
         except ValueError:
             return jsonify({"status": "error", "message": "Invalid XTEA format, must be comma-separated integers"}), 400
     
-    # For named archives, we need to find or create the archive ID first
-    # This is a simplified implementation - in a real implementation, 
-    # we would need to search for or create the archive by name
-    result = {
-        "status": "error", 
-        "message": "Putting data by archive name not yet implemented"
-    }
-    return jsonify(result), 501
+    result = cache_api.put_file_bytes_by_name(index_id, archive_name, 0, data, xtea_array)
+    return jsonify(result)
 
 @app.route('/remove/<int:index_id>/<int:archive_id>/<int:file_id>', methods=['DELETE'])
 def remove_file(index_id, archive_id, file_id):
@@ -163,14 +461,8 @@ def remove_archive(index_id, archive_id):
 @app.route('/remove/<int:index_id>/<string:archive_name>', methods=['DELETE'])
 def remove_archive_by_name(index_id, archive_name):
     """Remove an archive by name from the cache"""
-    # For named archives, we need to find the archive ID first
-    # This is a simplified implementation - in a real implementation, 
-    # we would need to search for the archive by name
-    result = {
-        "status": "error", 
-        "message": "Removing archives by name not yet implemented"
-    }
-    return jsonify(result), 501
+    result = cache_api.remove_archive_by_name(index_id, archive_name)
+    return jsonify(result)
 
 @app.route('/update/<int:index_id>', methods=['POST'])
 def update_index(index_id):
@@ -185,16 +477,184 @@ def add_archive(index_id):
     result = cache_api.add_archive(index_id, archive_name)
     return jsonify(result)
 
+@app.route('/txn', methods=['POST'])
+def begin_transaction():
+    """Start a write transaction"""
+    data = request.get_json(silent=True) or {}
+    auto_flush_bytes = data.get('auto_flush_bytes')
+    auto_flush_seconds = data.get('auto_flush_seconds')
+    try:
+        auto_flush_bytes = int(auto_flush_bytes) if auto_flush_bytes is not None else None
+        auto_flush_seconds = float(auto_flush_seconds) if auto_flush_seconds is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "auto_flush_bytes must be an integer and auto_flush_seconds a number"}), 400
+    result = cache_api.begin_transaction(auto_flush_bytes, auto_flush_seconds)
+    return jsonify(result)
+
+@app.route('/txn/<transaction_id>', methods=['GET'])
+def get_transaction(transaction_id):
+    """Get the state of a write transaction"""
+    result = cache_api.transaction_info(transaction_id)
+    return jsonify(result)
+
+def stage_put(transaction_id, index_id, archive_id, file_id):
+    """Stage a put from a JSON (base64) or application/octet-stream request body"""
+    if request.mimetype == OCTET_STREAM:
+        data = request.get_data()
+        xtea = request.args.get('xtea')
+    else:
+        data = request.json.get('data')
+        xtea = request.json.get('xtea')
+        if data:
+            try:
+                data = base64.b64decode(data)
+            except ValueError:
+                return jsonify({"status": "error", "message": "Invalid base64 data"}), 400
+    
+    if not data:
+        return jsonify({"status": "error", "message": "Data is required"}), 400
+    
+    xtea_array = None
+    if xtea:
+        try:
+            # Parse xtea as comma-separated integers
+            xtea_array = [int(x) for x in xtea.split(',')]
+        except ValueError:
+            return jsonify({"status": "error", "message": "Invalid XTEA format, must be comma-separated integers"}), 400
+    
+    result = cache_api.stage_put(transaction_id, index_id, archive_id, file_id, data, xtea_array)
+    return jsonify(result)
+
+@app.route('/txn/<transaction_id>/put/<int:index_id>/<int:archive_id>/<int:file_id>', methods=['POST'])
+def stage_put_file(transaction_id, index_id, archive_id, file_id):
+    """Stage file data to be written on commit"""
+    return stage_put(transaction_id, index_id, archive_id, file_id)
+
+@app.route('/txn/<transaction_id>/put/<int:index_id>/<int:archive_id>', methods=['POST'])
+def stage_put_archive(transaction_id, index_id, archive_id):
+    """Stage archive data to be written on commit"""
+    return stage_put(transaction_id, index_id, archive_id, 0)
+
+@app.route('/txn/<transaction_id>/remove/<int:index_id>/<int:archive_id>/<int:file_id>', methods=['DELETE'])
+def stage_remove_file(transaction_id, index_id, archive_id, file_id):
+    """Stage removal of a file"""
+    result = cache_api.stage_remove(transaction_id, index_id, archive_id, file_id)
+    return jsonify(result)
+
+@app.route('/txn/<transaction_id>/remove/<int:index_id>/<int:archive_id>', methods=['DELETE'])
+def stage_remove_archive(transaction_id, index_id, archive_id):
+    """Stage removal of an archive"""
+    result = cache_api.stage_remove(transaction_id, index_id, archive_id)
+    return jsonify(result)
+
+@app.route('/txn/<transaction_id>/commit', methods=['POST'])
+def commit_transaction(transaction_id):
+    """Apply the staged writes and update each touched index once"""
+    result = cache_api.commit_transaction(transaction_id)
+    return jsonify(result)
+
+@app.route('/txn/<transaction_id>/abort', methods=['POST'])
+def abort_transaction(transaction_id):
+    """Discard the staged writes"""
+    result = cache_api.abort_transaction(transaction_id)
+    return jsonify(result)
+
+def start_warm_up(options):
+    """Start a warm-up job from {"indices": [...], "archives": {"<index>": [...]}, "hot_set": true}"""
+    try:
+        indices = [int(index_id) for index_id in options.get('indices') or []]
+        archives = {int(index_id): [int(archive_id) for archive_id in ids] for index_id, ids in (options.get('archives') or {}).items()}
+    except (TypeError, ValueError, AttributeError):
+        return {"status": "error", "message": "Invalid warm-up request"}
+    return cache_api.start_warm_up(indices, archives, bool(options.get('hot_set', False)))
+
+@app.route('/warm', methods=['POST'])
+def warm_up():
+    """Read and decode archives in the background, ahead of requests"""
+    result = start_warm_up(request.get_json(silent=True) or {})
+    return jsonify(result), 202 if result["status"] == "success" else 400
+
+@app.route('/warm/<job_id>', methods=['GET'])
+def warm_up_status(job_id):
+    """Get the progress of a warm-up job"""
+    result = cache_api.job_status(job_id)
+    return jsonify(result), 200 if result["status"] == "success" else 404
+
+@app.route('/warm/<job_id>/cancel', methods=['POST'])
+def cancel_warm_up(job_id):
+    """Stop a warm-up job"""
+    result = cache_api.cancel_job(job_id)
+    return jsonify(result), 200 if result["status"] == "success" else 404
+
+@app.route('/hot_set', methods=['POST'])
+def save_hot_set():
+    """Save the most read archives next to the cache, to be warmed with {"hot_set": true}"""
+    data = request.get_json(silent=True) or {}
+    limit = data.get('limit')
+    try:
+        limit = int(limit) if limit is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "limit must be an integer"}), 400
+    if limit is not None and limit < 0:
+        return jsonify({"status": "error", "message": "limit must not be negative"}), 400
+    result = cache_api.save_hot_set(limit)
+    return jsonify(result)
+
+@app.route('/import/<int:index_id>', methods=['POST'])
+def import_tree(index_id):
+    """Import a directory of <archive_id>/<file_id> files into an index in the background"""
+    data = request.get_json(silent=True) or {}
+    path = data.get('path')
+    if not path:
+        return jsonify({"status": "error", "message": "Path is required"}), 400
+    try:
+        workers = int(data.get('workers', 4))
+        chunk_size = int(data.get('chunk_size', 64))
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "workers and chunk_size must be integers"}), 400
+    if not 1 <= workers <= 32 or chunk_size < 1:
+        return jsonify({"status": "error", "message": "workers must be between 1 and 32 and chunk_size positive"}), 400
+    result = cache_api.start_import(index_id, path, workers, chunk_size)
+    return jsonify(result), 202 if result["status"] == "success" else 400
+
+@app.route('/import/<job_id>', methods=['GET'])
+def import_status(job_id):
+    """Get the progress of an import job"""
+    result = cache_api.job_status(job_id)
+    return jsonify(result), 200 if result["status"] == "success" else 404
+
+@app.route('/import/<job_id>/cancel', methods=['POST'])
+def cancel_import(job_id):
+    """Stop an import job after its current chunk"""
+    result = cache_api.cancel_job(job_id)
+    return jsonify(result), 200 if result["status"] == "success" else 404
+
 @app.route('/rebuild', methods=['POST'])
 def rebuild_cache():
-    """Rebuild/defragment the cache"""
-    data = request.json
+    """Rebuild/defragment the cache in the background, or right away with {"wait": true}"""
+    data = request.get_json(silent=True) or {}
     output_path = data.get('output_path')
     if not output_path:
         return jsonify({"status": "error", "message": "Output path is required"}), 400
+    incremental = bool(data.get('incremental', False))
     
-    result = cache_api.rebuild_cache(output_path)
-    return jsonify(result)
+    if data.get('wait', False):
+        result = cache_api.rebuild_cache(output_path, incremental)
+        return jsonify(result)
+    result = cache_api.start_rebuild(output_path, incremental)
+    return jsonify(result), 202 if result["status"] == "success" else 400
+
+@app.route('/rebuild/<job_id>', methods=['GET'])
+def rebuild_status(job_id):
+    """Get the progress of a rebuild job"""
+    result = cache_api.job_status(job_id)
+    return jsonify(result), 200 if result["status"] == "success" else 404
+
+@app.route('/rebuild/<job_id>/cancel', methods=['POST'])
+def cancel_rebuild(job_id):
+    """Stop a rebuild job"""
+    result = cache_api.cancel_job(job_id)
+    return jsonify(result), 200 if result["status"] == "success" else 404
 
 @app.route('/', methods=['GET'])
 def api_info():
@@ -203,16 +663,40 @@ def api_info():
         "message": "RuneScape Cache Library API",
         "endpoints": {
             "health": "/health (GET)",
+            "ready": "/ready (GET)",
+            "stats": "/stats (GET)",
+            "metrics": "/metrics (GET)",
             "initialize": "/initialize (POST)",
             "get_file_data": "/data/<index_id>/<archive_id>/<file_id> (GET)",
             "get_archive_data": "/data/<index_id>/<archive_id> (GET)",
+            "get_archive_data_by_name": "/data/<index_id>/<archive_name> (GET)",
+            "get_batch_data": "/data/batch (POST)",
+            "get_raw_archive": "/raw/<index_id>/<archive_id> (GET)",
+            "export_index": "/export/<index_id>?format=tar|records|ndjson (GET, POST with xteas)",
             "put_file_data": "/put/<index_id>/<archive_id>/<file_id> (POST)",
             "put_archive_data": "/put/<index_id>/<archive_id> (POST)",
+            "put_archive_data_by_name": "/put/<index_id>/<archive_name> (POST)",
             "remove_file": "/remove/<index_id>/<archive_id>/<file_id> (DELETE)",
             "remove_archive": "/remove/<index_id>/<archive_id> (DELETE)",
+            "remove_archive_by_name": "/remove/<index_id>/<archive_name> (DELETE)",
             "update_index": "/update/<index_id> (POST)",
             "add_archive": "/add_archive/<index_id> (POST)",
+            "begin_transaction": "/txn (POST)",
+            "get_transaction": "/txn/<transaction_id> (GET)",
+            "stage_put": "/txn/<transaction_id>/put/<index_id>/<archive_id>[/<file_id>] (POST)",
+            "stage_remove": "/txn/<transaction_id>/remove/<index_id>/<archive_id>[/<file_id>] (DELETE)",
+            "commit_transaction": "/txn/<transaction_id>/commit (POST)",
+            "abort_transaction": "/txn/<transaction_id>/abort (POST)",
+            "warm_up": "/warm (POST)",
+            "warm_up_status": "/warm/<job_id> (GET)",
+            "cancel_warm_up": "/warm/<job_id>/cancel (POST)",
+            "save_hot_set": "/hot_set (POST)",
+            "import_tree": "/import/<index_id> (POST)",
+            "import_status": "/import/<job_id> (GET)",
+            "cancel_import": "/import/<job_id>/cancel (POST)",
             "rebuild_cache": "/rebuild (POST)",
+            "rebuild_status": "/rebuild/<job_id> (GET)",
+            "cancel_rebuild": "/rebuild/<job_id>/cancel (POST)",
             "shutdown": "/shutdown (POST)"
         },
         "description": "API for interacting with RuneScape cache files"
@@ -223,6 +707,22 @@ def health_check():
     """Health check endpoint"""
     return jsonify({"status": "healthy", "message": "Cache API is running"})
 
+@app.route('/ready', methods=['GET'])
+def readiness():
+    """Readiness check listing the indices whose reference tables are loaded"""
+    result = cache_api.readiness()
+    return jsonify(result), 200 if result["ready"] else 503
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Runtime statistics of the cache API"""
+    return jsonify(cache_api.cache_stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics of this process"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/shutdown', methods=['POST'])
 def shutdown():
     """Shutdown the API and close the cache library"""
@@ -230,4 +730,23 @@ def shutdown():
     return jsonify(result)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="RuneScape Cache Library API")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--production', action='store_true',
+                        help="Serve with a pooled multi-threaded server instead of the debug server")
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('CACHE_API_THREADS', 16)),
+                        help="Worker threads in production mode")
+    parser.add_argument('--keep-alive', type=float, default=float(os.environ.get('CACHE_API_KEEP_ALIVE', 5)),
+                        help="Seconds an idle connection is kept open in production mode")
+    args = parser.parse_args()
+    
+    if args.production:
+        from serving import serve
+        from cache_api import attach_jvm_thread
+        serve(app, args.host, args.port, args.threads, thread_initializer=attach_jvm_thread,
+              keep_alive_timeout=args.keep_alive)
+    else:
+        app.run(host=args.host, port=args.port, debug=True)
@@ -0,0 +1,626 @@
+"""
+ASGI Cache API
+An asyncio variant of the Flask API in api.py with the same routes. Handlers never call into the
+JVM on the event loop: CacheLibraryAPI calls run on a bounded thread pool with per-request timeouts,
+and large responses are streamed in chunks so slow clients apply backpressure.
+
+Run with an ASGI server, e.g.: uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import base64
+import contextvars
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+
+from api import (cache_api, export_chunks, file_etag, start_warm_up, BATCH_FRAME, CACHE_CONTROL, EXPORT_FORMATS, NDJSON,
+                 OCTET_STREAM)
+from cache_api import CacheLibraryAPI, attach_jvm_thread
+import metrics
+import tracing
+
+
+class HTTPError(Exception):
+    """Raised by handlers to answer with a JSON error"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Request:
+    """The parts of an ASGI HTTP request the handlers need"""
+
+    def __init__(self, scope, receive, max_body_size: int):
+        self.scope = scope
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.query = {key: values[-1] for key, values in parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+        self.headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope.get("headers", [])}
+        self._receive = receive
+        self._max_body_size = max_body_size
+        self._body = None
+        # Set by dispatch for metrics
+        self.route = None
+        self.index_id = None
+
+    @property
+    def mimetype(self) -> str:
+        return self.headers.get("content-type", "").split(";")[0].strip().lower()
+
+    async def body(self) -> bytes:
+        if self._body is None:
+            chunks = []
+            size = 0
+            more_body = True
+            while more_body:
+                message = await self._receive()
+                if message["type"] == "http.disconnect":
+                    raise HTTPError(400, "Client disconnected")
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if size > self._max_body_size:
+                    raise HTTPError(413, "Request body too large")
+                chunks.append(chunk)
+                more_body = message.get("more_body", False)
+            self._body = b"".join(chunks)
+        return self._body
+
+    async def json(self) -> dict:
+        body = await self.body()
+        if not body:
+            return {}
+        try:
+            return json.loads(body)
+        except ValueError:
+            raise HTTPError(400, "Invalid JSON body")
+
+    def xtea(self, value):
+        """Parse a comma-separated XTEA key string"""
+        if not value:
+            return None
+        try:
+            return [int(x) for x in value.split(',')]
+        except ValueError:
+            raise HTTPError(400, "Invalid XTEA format, must be comma-separated integers")
+
+    def wants_raw(self) -> bool:
+        if self.query.get("raw", "").lower() in ("1", "true", "yes"):
+            return True
+        accept = parse_accept_header(self.headers.get("accept"), MIMEAccept)
+        return accept.best_match(["application/json", OCTET_STREAM]) == OCTET_STREAM
+
+
+class Response:
+    """A response whose body is bytes or an async iterator of bytes"""
+
+    def __init__(self, body=b"", status: int = 200, content_type: str = "application/json", headers=None):
+        self.body = body
+        self.status = status
+        self.headers = [("content-type", content_type)] + list((headers or {}).items())
+
+
+def json_response(body: dict, status: int = 200) -> Response:
+    return Response(json.dumps(body).encode("utf-8"), status)
+
+
+class CacheASGIApp:
+    """ASGI application exposing CacheLibraryAPI"""
+
+    def __init__(self, api, max_workers: int = 16, max_pending: int = 256, request_timeout: float = 30.0,
+                 chunk_size: int = 64 * 1024, max_body_size: int = 256 * 1024 * 1024):
+        self.api = api
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.request_timeout = request_timeout
+        self.chunk_size = chunk_size
+        self.max_body_size = max_body_size
+        self.executor = None
+        self._pending = None
+        self.routes = []
+        self._add_routes()
+
+    def route(self, method: str, pattern: str, handler):
+        regex = re.sub(r"<int:(\w+)>", r"(?P<\1>\\d+)", pattern)
+        regex = re.sub(r"<string:(\w+)>", r"(?P<\1>[^/]+)", regex)
+        converters = {name: int for name in re.findall(r"<int:(\w+)>", pattern)}
+        self.routes.append((method, pattern, re.compile(f"^{regex}$"), converters, handler))
+
+    def _add_routes(self):
+        self.route("POST", "/initialize", self.initialize_cache)
+        self.route("GET", "/data/<int:index_id>/<int:archive_id>/<int:file_id>", self.get_file_data)
+        self.route("GET", "/data/<int:index_id>/<int:archive_id>", self.get_file_data)
+        self.route("POST", "/data/batch", self.get_batch_data)
+        self.route("GET", "/data/<int:index_id>/<string:archive_name>", self.get_archive_data_by_name)
+        self.route("GET", "/raw/<int:index_id>/<int:archive_id>", self.get_raw_archive)
+        self.route("GET", "/export/<int:index_id>", self.export_index)
+        self.route("POST", "/export/<int:index_id>", self.export_index)
+        self.route("POST", "/put/<int:index_id>/<int:archive_id>/<int:file_id>", self.put_file_data)
+        self.route("POST", "/put/<int:index_id>/<int:archive_id>", self.put_file_data)
+        self.route("POST", "/put/<int:index_id>/<string:archive_name>", self.put_archive_data_by_name)
+        self.route("DELETE", "/remove/<int:index_id>/<int:archive_id>/<int:file_id>", self.remove_file)
+        self.route("DELETE", "/remove/<int:index_id>/<int:archive_id>", self.remove_archive)
+        self.route("DELETE", "/remove/<int:index_id>/<string:archive_name>", self.remove_archive_by_name)
+        self.route("POST", "/update/<int:index_id>", self.update_index)
+        self.route("POST", "/add_archive/<int:index_id>", self.add_archive)
+        self.route("POST", "/txn", self.begin_transaction)
+        self.route("GET", "/txn/<string:transaction_id>", self.get_transaction)
+        self.route("POST", "/txn/<string:transaction_id>/put/<int:index_id>/<int:archive_id>/<int:file_id>", self.stage_put)
+        self.route("POST", "/txn/<string:transaction_id>/put/<int:index_id>/<int:archive_id>", self.stage_put)
+        self.route("DELETE", "/txn/<string:transaction_id>/remove/<int:index_id>/<int:archive_id>/<int:file_id>", self.stage_remove)
+        self.route("DELETE", "/txn/<string:transaction_id>/remove/<int:index_id>/<int:archive_id>", self.stage_remove)
+        self.route("POST", "/txn/<string:transaction_id>/commit", self.commit_transaction)
+        self.route("POST", "/txn/<string:transaction_id>/abort", self.abort_transaction)
+        self.route("POST", "/warm", self.warm_up)
+        self.route("GET", "/warm/<string:job_id>", self.warm_up_status)
+        self.route("POST", "/warm/<string:job_id>/cancel", self.cancel_warm_up)
+        self.route("POST", "/import/<int:index_id>", self.import_tree)
+        self.route("GET", "/import/<string:job_id>", self.warm_up_status)
+        self.route("POST", "/import/<string:job_id>/cancel", self.cancel_warm_up)
+        self.route("POST", "/hot_set", self.save_hot_set)
+        self.route("POST", "/rebuild", self.rebuild_cache)
+        self.route("GET", "/rebuild/<string:job_id>", self.warm_up_status)
+        self.route("POST", "/rebuild/<string:job_id>/cancel", self.cancel_warm_up)
+        self.route("GET", "/", self.api_info)
+        self.route("GET", "/health", self.health_check)
+        self.route("GET", "/ready", self.readiness)
+        self.route("GET", "/stats", self.stats)
+        self.route("GET", "/metrics", self.metrics)
+        self.route("POST", "/shutdown", self.shutdown)
+
+    async def call(self, function, *args, timeout=None):
+        """Run a blocking CacheLibraryAPI call on the executor, bounded in concurrency and time"""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="cache-asgi",
+                                               initializer=attach_jvm_thread)
+        if self._pending is None:
+            self._pending = asyncio.Semaphore(self.max_pending)
+        if self._pending.locked():
+            raise HTTPError(503, "Too many pending requests")
+        await self._pending.acquire()
+        try:
+            # Copying the context lets spans recorded by the call join the request's trace
+            context = contextvars.copy_context()
+            future = asyncio.get_running_loop().run_in_executor(self.executor, context.run, function, *args)
+        except BaseException:
+            self._pending.release()
+            raise
+        # A call that timed out keeps its thread and maybe the cache lock, so it keeps its slot until it returns
+        future.add_done_callback(self._call_done)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout or self.request_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(504, "Request timed out")
+
+    def _call_done(self, future):
+        self._pending.release()
+        if not future.cancelled():
+            # Nobody awaits a call that timed out, its error would be logged as never retrieved
+            future.exception()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        start = time.perf_counter()
+        request = Request(scope, receive, self.max_body_size)
+        trace = None
+        if tracing.enabled():
+            target = request.path + (f"?{scope['query_string'].decode('latin-1')}" if scope.get("query_string") else "")
+            trace = tracing.start_trace(request.method, **{"http.method": request.method, "http.target": target})
+        try:
+            response = await self.dispatch(request)
+        except HTTPError as e:
+            response = json_response({"status": "error", "message": e.message}, e.status)
+        except Exception as e:
+            # Still answered, counted and traced like any other request
+            metrics.count_error("asgi", e)
+            if trace is not None:
+                trace.root.error = f"{type(e).__name__}: {e}"
+            response = json_response({"status": "error", "message": f"Internal server error: {str(e)}"}, 500)
+        bytes_out = await self.send_response(response, send)
+        route = request.route or "unmatched"
+        bytes_in = len(request._body) if request._body is not None else None
+        metrics.observe_request(request.method, route, response.status, time.perf_counter() - start,
+                                request.index_id, bytes_in, bytes_out)
+        if trace is not None:
+            trace.root.name = f"{request.method} {route}"
+            tracing.finish_trace(trace, **{"http.status_code": response.status, "http.response_content_length": bytes_out})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.executor is not None:
+                    self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def dispatch(self, request: Request) -> Response:
+        path_matched = False
+        for method, pattern, regex, converters, handler in self.routes:
+            match = regex.match(request.path)
+            if match is None:
+                continue
+            path_matched = True
+            if method != request.method:
+                continue
+            kwargs = {name: converters.get(name, str)(value) for name, value in match.groupdict().items()}
+            request.route = pattern
+            request.index_id = kwargs.get("index_id")
+            return await handler(request, **kwargs)
+        if path_matched:
+            raise HTTPError(405, "Method not allowed")
+        raise HTTPError(404, "Not found")
+
+    async def send_response(self, response: Response, send) -> int:
+        """Send response and return the number of body bytes sent"""
+        headers = [(name.encode("latin-1"), str(value).encode("latin-1")) for name, value in response.headers]
+        body = response.body
+        if isinstance(body, (bytes, bytearray, memoryview)):
+            headers.append((b"content-length", str(len(body)).encode("latin-1")))
+            await send({"type": "http.response.start", "status": response.status, "headers": headers})
+            view = memoryview(body)
+            # Chunked sends let the server pause us while a slow client drains its socket
+            for offset in range(0, max(len(view), 1), self.chunk_size):
+                chunk = bytes(view[offset:offset + self.chunk_size])
+                await send({"type": "http.response.body", "body": chunk, "more_body": offset + self.chunk_size < len(view)})
+            return len(view)
+        await send({"type": "http.response.start", "status": response.status, "headers": headers})
+        sent = 0
+        async for chunk in body:
+            sent += len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+        return sent
+
+    async def initialize_cache(self, request):
+        data = await request.json()
+        path = data.get('path')
+        if not path:
+            raise HTTPError(400, "Path is required")
+        try:
+            await self.call(self.api.start_jvm)
+        except HTTPError:
+            raise
+        except Exception as e:
+            raise HTTPError(500, f"Failed to start JVM: {str(e)}")
+        if not os.path.exists(path):
+            raise HTTPError(400, "Path does not exist")
+        result = await self.call(self.api.initialize_cache, path, bool(data.get('mmap_reader', False)),
+                                 bool(data.get('lazy', False)), timeout=600)
+        if result["status"] == "success" and data.get('warm'):
+            result["warm_up"] = start_warm_up(data['warm'])
+        return json_response(result)
+
+    async def get_file_data(self, request, index_id, archive_id, file_id=0):
+        with tracing.span("parse"):
+            xtea = request.xtea(request.query.get('xtea'))
+            raw = request.wants_raw()
+            if_none_match = parse_etags(request.headers.get("if-none-match"))
+        if if_none_match:
+            with tracing.span("revalidate"):
+                version = await self.call(self.api.archive_version, index_id, archive_id)
+            if version is not None:
+                etag = file_etag(index_id, archive_id, file_id, xtea, version, raw)
+                if if_none_match.contains_weak(etag):
+                    return Response(status=304, headers=self.cache_headers(etag))
+        with tracing.span("read_file"):
+            result = await self.call(self.api.read_file, index_id, archive_id, file_id, xtea)
+        if result["status"] != "success":
+            return json_response(result, 404 if raw else 200)
+        headers = {}
+        if result.get("crc") is not None:
+            version = (result["crc"], result["revision"], result["generation"])
+            headers.update(self.cache_headers(file_etag(index_id, archive_id, file_id, xtea, version, raw)))
+        if not raw:
+            with tracing.span("encode"):
+                body = CacheLibraryAPI.json_file_result(result)
+            with tracing.span("serialize"):
+                body = json.dumps(body).encode("utf-8")
+            return Response(body, headers=headers)
+        headers.update({"x-index-id": index_id, "x-archive-id": archive_id, "x-file-id": file_id})
+        if result.get("crc") is not None:
+            headers["x-crc"] = result["crc"]
+        if result.get("revision") is not None:
+            headers["x-revision"] = result["revision"]
+        return Response(result["data"], content_type=OCTET_STREAM, headers=headers)
+
+    @staticmethod
+    def cache_headers(etag: str) -> dict:
+        return {"etag": quote_etag(etag), "cache-control": CACHE_CONTROL, "vary": "Accept"}
+
+    async def get_archive_data_by_name(self, request, index_id, archive_name):
+        archive_id = await self.call(self.api.archive_id, index_id, archive_name)
+        if archive_id is None:
+            raise HTTPError(404, f"Archive {archive_name} not found in index {index_id}")
+        return await self.get_file_data(request, index_id, archive_id)
+
+    async def get_batch_data(self, request):
+        data = await request.json()
+        items = data.get('requests')
+        if not isinstance(items, list):
+            raise HTTPError(400, "A list of requests is required")
+        requests = []
+        for item in items:
+            try:
+                xtea = item.get('xtea')
+                if isinstance(xtea, str):
+                    xtea = request.xtea(xtea)
+                elif xtea is not None:
+                    xtea = [int(x) for x in xtea]
+                requests.append((int(item['index']), int(item['archive']), int(item.get('file', 0)), xtea))
+            except (KeyError, TypeError, ValueError, AttributeError):
+                raise HTTPError(400, f"Invalid batch request: {item}")
+        output_format = data.get('format') or ('binary' if request.wants_raw() else 'ndjson')
+        results = self.api.iter_many(requests)
+        # As in export_index, a timed out next() still runs and the generator is closed after it
+        step_lock = threading.Lock()
+
+        def step():
+            with step_lock:
+                return next(results, None)
+
+        def close():
+            with step_lock:
+                results.close()
+
+        async def generate():
+            stopped = False
+            while not stopped:
+                try:
+                    result = await self.call(step)
+                except HTTPError as e:
+                    asyncio.get_running_loop().run_in_executor(self.executor, close)
+                    # The remaining requests go unanswered, a last error frame without ids says why
+                    stopped = True
+                    result = {"status": "error", "message": f"Batch stopped: {e.message}",
+                              "index_id": None, "archive_id": None, "file_id": None}
+                if result is None:
+                    return
+                if output_format == 'binary':
+                    ok = result["status"] == "success"
+                    payload = result["data"] if ok else result["message"].encode('utf-8')
+                    ids = (-1, -1, -1) if stopped else (result["index_id"], result["archive_id"], result["file_id"])
+                    yield BATCH_FRAME.pack(0 if ok else 1, *ids, len(payload)) + payload
+                else:
+                    if result["status"] == "success":
+                        result["data"] = base64.b64encode(result["data"]).decode('utf-8')
+                    yield (json.dumps(result) + '\n').encode('utf-8')
+
+        return Response(generate(), content_type=OCTET_STREAM if output_format == 'binary' else NDJSON)
+
+    async def get_raw_archive(self, request, index_id, archive_id):
+        result = await self.call(self.api.get_raw_archive, index_id, archive_id)
+        if result["status"] != "success":
+            return json_response(result, 404)
+        headers = {"x-index-id": index_id, "x-archive-id": archive_id}
+        return Response(result["data"], content_type=OCTET_STREAM, headers=headers)
+
+    async def export_index(self, request, index_id):
+        body = await request.json() if request.method == "POST" else {}
+        output_format = body.get('format') or request.query.get('format', 'tar')
+        if output_format not in EXPORT_FORMATS:
+            raise HTTPError(400, f"Unknown export format {output_format}, use one of {', '.join(EXPORT_FORMATS)}")
+        try:
+            workers = int(body.get('workers') or request.query.get('workers', 4))
+            xteas = {int(archive_id): [int(key) for key in keys] for archive_id, keys in (body.get('xteas') or {}).items()}
+        except (TypeError, ValueError, AttributeError):
+            raise HTTPError(400, "Invalid workers or xteas")
+        if not 1 <= workers <= 32:
+            raise HTTPError(400, "workers must be between 1 and 32")
+        results = self.api.export_index(index_id, workers=workers, xteas=xteas)
+        first = await self.call(next, results, None)
+        if first is not None and first["status"] != "success" and first["archive_id"] is None:
+            raise HTTPError(404, first["message"])
+        if first is not None:
+            results = itertools.chain([first], results)
+        chunks = export_chunks(index_id, results, output_format)
+        # A next() that timed out is still running, the generator can only be closed once it returns
+        step_lock = threading.Lock()
+
+        def step():
+            with step_lock:
+                return next(chunks, None)
+
+        def close():
+            with step_lock:
+                chunks.close()
+
+        async def generate():
+            while True:
+                try:
+                    chunk = await self.call(step)
+                except HTTPError as e:
+                    asyncio.get_running_loop().run_in_executor(self.executor, close)
+                    # End with a well-formed trailer that lists the export as failed instead of cutting it off
+                    stopped = {"status": "error", "archive_id": None, "file_id": None,
+                               "message": f"Export stopped: {e.message}"}
+                    for chunk in export_chunks(index_id, iter([stopped]), output_format):
+                        yield chunk
+                    return
+                if chunk is None:
+                    return
+                yield chunk
+
+        return Response(generate(), content_type=EXPORT_FORMATS[output_format],
+                        headers={"content-disposition": f"attachment; filename=index{index_id}.{output_format}"})
+
+    async def put_file_data(self, request, index_id, archive_id, file_id=0):
+        if request.mimetype == OCTET_STREAM:
+            data = await request.body()
+            if not data:
+                raise HTTPError(400, "Data is required")
+            xtea = request.xtea(request.query.get('xtea'))
+            return json_response(await self.call(self.api.put_file_bytes, index_id, archive_id, file_id, data, xtea))
+        body = await request.json()
+        data = body.get('data')
+        if not data:
+            raise HTTPError(400, "Data is required")
+        xtea = request.xtea(body.get('xtea'))
+        return json_response(await self.call(self.api.put_file_data, index_id, archive_id, file_id, data, xtea))
+
+    async def put_archive_data_by_name(self, request, index_id, archive_name):
+        if request.mimetype == OCTET_STREAM:
+            data = await request.body()
+            xtea = request.xtea(request.query.get('xtea'))
+        else:
+            body = await request.json()
+            xtea = request.xtea(body.get('xtea'))
+            try:
+                data = base64.b64decode(body.get('data') or b'')
+            except ValueError:
+                raise HTTPError(400, "Invalid base64 data")
+        if not data:
+            raise HTTPError(400, "Data is required")
+        return json_response(await self.call(self.api.put_file_bytes_by_name, index_id, archive_name, 0, data, xtea))
+
+    async def remove_file(self, request, index_id, archive_id, file_id):
+        return json_response(await self.call(self.api.remove_file, index_id, archive_id, file_id))
+
+    async def remove_archive(self, request, index_id, archive_id):
+        return json_response(await self.call(self.api.remove_archive, index_id, archive_id))
+
+    async def remove_archive_by_name(self, request, index_id, archive_name):
+        return json_response(await self.call(self.api.remove_archive_by_name, index_id, archive_name))
+
+    async def update_index(self, request, index_id):
+        return json_response(await self.call(self.api.update_index, index_id, timeout=600))
+
+    async def add_archive(self, request, index_id):
+        body = await request.json()
+        return json_response(await self.call(self.api.add_archive, index_id, body.get('name')))
+
+    async def begin_transaction(self, request):
+        body = await request.json()
+        auto_flush_bytes = body.get('auto_flush_bytes')
+        auto_flush_seconds = body.get('auto_flush_seconds')
+        try:
+            auto_flush_bytes = int(auto_flush_bytes) if auto_flush_bytes is not None else None
+            auto_flush_seconds = float(auto_flush_seconds) if auto_flush_seconds is not None else None
+        except (TypeError, ValueError):
+            raise HTTPError(400, "auto_flush_bytes must be an integer and auto_flush_seconds a number")
+        return json_response(self.api.begin_transaction(auto_flush_bytes, auto_flush_seconds))
+
+    async def get_transaction(self, request, transaction_id):
+        return json_response(self.api.transaction_info(transaction_id))
+
+    async def stage_put(self, request, transaction_id, index_id, archive_id, file_id=0):
+        if request.mimetype == OCTET_STREAM:
+            data = await request.body()
+            xtea = request.xtea(request.query.get('xtea'))
+        else:
+            body = await request.json()
+            xtea = request.xtea(body.get('xtea'))
+            try:
+                data = base64.b64decode(body.get('data') or b'')
+            except ValueError:
+                raise HTTPError(400, "Invalid base64 data")
+        if not data:
+            raise HTTPError(400, "Data is required")
+        # Staging may flush the transaction once it reaches its auto-flush size
+        return json_response(await self.call(self.api.stage_put, transaction_id, index_id, archive_id, file_id, data, xtea, timeout=600))
+
+    async def stage_remove(self, request, transaction_id, index_id, archive_id, file_id=None):
+        return json_response(await self.call(self.api.stage_remove, transaction_id, index_id, archive_id, file_id, timeout=600))
+
+    async def commit_transaction(self, request, transaction_id):
+        return json_response(await self.call(self.api.commit_transaction, transaction_id, timeout=3600))
+
+    async def abort_transaction(self, request, transaction_id):
+        return json_response(self.api.abort_transaction(transaction_id))
+
+    async def warm_up(self, request):
+        result = start_warm_up(await request.json())
+        return json_response(result, 202 if result["status"] == "success" else 400)
+
+    async def warm_up_status(self, request, job_id):
+        result = self.api.job_status(job_id)
+        return json_response(result, 200 if result["status"] == "success" else 404)
+
+    async def cancel_warm_up(self, request, job_id):
+        result = self.api.cancel_job(job_id)
+        return json_response(result, 200 if result["status"] == "success" else 404)
+
+    async def import_tree(self, request, index_id):
+        body = await request.json()
+        if not body.get('path'):
+            raise HTTPError(400, "Path is required")
+        try:
+            workers = int(body.get('workers', 4))
+            chunk_size = int(body.get('chunk_size', 64))
+        except (TypeError, ValueError):
+            raise HTTPError(400, "workers and chunk_size must be integers")
+        if not 1 <= workers <= 32 or chunk_size < 1:
+            raise HTTPError(400, "workers must be between 1 and 32 and chunk_size positive")
+        result = self.api.start_import(index_id, body['path'], workers, chunk_size)
+        return json_response(result, 202 if result["status"] == "success" else 400)
+
+    async def save_hot_set(self, request):
+        body = await request.json()
+        limit = body.get('limit')
+        try:
+            limit = int(limit) if limit is not None else None
+        except (TypeError, ValueError):
+            raise HTTPError(400, "limit must be an integer")
+        if limit is not None and limit < 0:
+            raise HTTPError(400, "limit must not be negative")
+        return json_response(await self.call(self.api.save_hot_set, limit))
+
+    async def rebuild_cache(self, request):
+        body = await request.json()
+        output_path = body.get('output_path')
+        if not output_path:
+            raise HTTPError(400, "Output path is required")
+        incremental = bool(body.get('incremental', False))
+        if body.get('wait', False):
+            return json_response(await self.call(self.api.rebuild_cache, output_path, incremental, timeout=3600))
+        result = self.api.start_rebuild(output_path, incremental)
+        return json_response(result, 202 if result["status"] == "success" else 400)
+
+    async def api_info(self, request):
+        return json_response({
+            "message": "RuneScape Cache Library API (ASGI)",
+            "endpoints": [f"{pattern} ({method})" for method, pattern, _, _, _ in self.routes],
+            "description": "API for interacting with RuneScape cache files"
+        })
+
+    async def health_check(self, request):
+        return json_response({"status": "healthy", "message": "Cache API is running"})
+
+    async def readiness(self, request):
+        result = await self.call(self.api.readiness)
+        return json_response(result, 200 if result["ready"] else 503)
+
+    async def stats(self, request):
+        return json_response(self.api.cache_stats())
+
+    async def metrics(self, request):
+        # Collectors read JVM management beans, so rendering runs on the executor
+        body = await self.call(metrics.REGISTRY.render)
+        return Response(body.encode("utf-8"), content_type=metrics.CONTENT_TYPE)
+
+    async def shutdown(self, request):
+        return json_response(await self.call(self.api.close))
+
+
+app = CacheASGIApp(
+    cache_api,
+    max_workers=int(os.environ.get('ASGI_MAX_WORKERS', 16)),
+    max_pending=int(os.environ.get('ASGI_MAX_PENDING', 256)),
+    request_timeout=float(os.environ.get('ASGI_REQUEST_TIMEOUT', 30))
+)
@@ -0,0 +1,287 @@
+"""
+CacheLibraryAPI Benchmarks
+Generates a synthetic cache (see synthetic_cache.py) and measures the throughput and latency
+percentiles of CacheLibraryAPI operations against it:
+
+    initialize      initialize_cache on the generated cache
+    read_cold       get_file_data of one file per archive right after initializing
+    read_warm       get_file_data with the decoded file cache emptied before every call
+    read_hot        get_file_data of a small set of files served from the decoded file cache
+    put             put_file_data into existing archives, on a copy of the cache
+    update          update_index after every --update-every puts
+    rebuild         rebuild_cache of the generated cache into a new directory
+
+Results are written as JSON with --json, so runs can be compared with --compare.
+
+Usage: python benchmarks/bench_cache_api.py [--cache /tmp/bench-cache] [--indices 4] ... [--json out.json]
+"""
+
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cache_api import CacheLibraryAPI
+from percentiles import latency_summary
+from synthetic_cache import COMPRESSION_NAMES, file_requests, generate_cache, load_manifest
+
+
+SCENARIOS = ["initialize", "read_cold", "read_warm", "read_hot", "put", "update", "rebuild"]
+
+
+def summarize(latencies: List[float], seconds: float, nbytes: int = 0, errors: int = 0) -> dict:
+    """Throughput and latency percentiles (in milliseconds) of one scenario"""
+    result = {
+        "operations": len(latencies),
+        "errors": errors,
+        "seconds": seconds,
+        "ops_per_second": len(latencies) / seconds if seconds else 0.0,
+        "latency_ms": latency_summary(latencies)
+    }
+    if nbytes:
+        result["bytes"] = nbytes
+        result["bytes_per_second"] = nbytes / seconds if seconds else 0.0
+    return result
+
+
+def timed(calls: Sequence[tuple], function: Callable, before: Optional[Callable] = None,
+          size: Optional[Callable[[dict], int]] = None) -> dict:
+    """Run function(*args) for every args in calls and summarize; before() runs untimed ahead of each call"""
+    latencies = []
+    errors = 0
+    nbytes = 0
+    total = 0.0
+    for args in calls:
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        total += elapsed
+        latencies.append(elapsed)
+        if result.get("status") == "error":
+            errors += 1
+        elif size is not None:
+            nbytes += size(result)
+    return summarize(latencies, total, nbytes, errors)
+
+
+def data_size(result: dict) -> int:
+    return len(result["data"]) * 3 // 4
+
+
+def bench_initialize(api: CacheLibraryAPI, path: str, repeat: int, mmap_reader: bool, lazy: bool) -> dict:
+    def initialize():
+        if api.cache_library is not None:
+            api.cache_library.close()
+            api.cache_library = None
+        return api.initialize_cache(path, mmap_reader, lazy)
+    return timed([()] * repeat, initialize)
+
+
+def bench_reads(api: CacheLibraryAPI, path: str, manifest: dict, operations: int, hot_files: int,
+                mmap_reader: bool, lazy: bool, rng: random.Random) -> Dict[str, dict]:
+    requests = file_requests(manifest)
+    results = {}
+
+    # The first read of every archive after initializing decompresses it
+    api.cache_library.close()
+    api.cache_library = None
+    api.initialize_cache(path, mmap_reader, lazy)
+    first_per_archive = {}
+    for request in requests:
+        first_per_archive.setdefault(request[:2], request)
+    cold = list(first_per_archive.values())
+    rng.shuffle(cold)
+    results["read_cold"] = timed(cold[:operations], api.get_file_data, size=data_size)
+
+    warm = [rng.choice(requests) for _ in range(operations)]
+    results["read_warm"] = timed(warm, api.get_file_data, before=api.file_cache.clear, size=data_size)
+
+    hot_set = rng.sample(requests, min(hot_files, len(requests)))
+    for request in hot_set:
+        api.get_file_data(*request)
+    hot = [rng.choice(hot_set) for _ in range(operations)]
+    results["read_hot"] = timed(hot, api.get_file_data, size=data_size)
+    return results
+
+
+def bench_writes(api: CacheLibraryAPI, manifest: dict, operations: int, update_every: int, min_size: int,
+                 max_size: int, rng: random.Random) -> Dict[str, dict]:
+    # Map archives are left out, their keys would have to be passed back on every write
+    requests = [request for request in file_requests(manifest) if request[3] is None]
+    puts = []
+    for _ in range(operations):
+        index_id, archive_id, file_id, _ = rng.choice(requests)
+        data = base64.b64encode(rng.randbytes(rng.randint(min_size, max_size))).decode("ascii")
+        puts.append((index_id, archive_id, file_id, data))
+
+    put_latencies = []
+    update_latencies = []
+    put_errors = 0
+    update_errors = 0
+    nbytes = 0
+    touched = set()
+    for i, (index_id, archive_id, file_id, data) in enumerate(puts, 1):
+        start = time.perf_counter()
+        result = api.put_file_data(index_id, archive_id, file_id, data)
+        put_latencies.append(time.perf_counter() - start)
+        put_errors += result.get("status") == "error"
+        nbytes += len(data) * 3 // 4
+        touched.add(index_id)
+        if i % update_every == 0 or i == len(puts):
+            for touched_index in sorted(touched):
+                start = time.perf_counter()
+                result = api.update_index(touched_index)
+                update_latencies.append(time.perf_counter() - start)
+                update_errors += result.get("status") == "error"
+            touched.clear()
+    return {
+        "put": summarize(put_latencies, sum(put_latencies), nbytes, put_errors),
+        "update": summarize(update_latencies, sum(update_latencies), errors=update_errors)
+    }
+
+
+def bench_rebuild(api: CacheLibraryAPI, path: str, repeat: int) -> dict:
+    size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)
+               if name.startswith("main_file_cache."))
+    latencies = []
+    errors = 0
+    for _ in range(repeat):
+        output = tempfile.mkdtemp(prefix="bench-rebuild-")
+        try:
+            start = time.perf_counter()
+            result = api.rebuild_cache(output)
+            latencies.append(time.perf_counter() - start)
+            errors += result.get("status") == "error"
+        finally:
+            shutil.rmtree(output, ignore_errors=True)
+    return summarize(latencies, sum(latencies), size * repeat, errors)
+
+
+def run(args) -> dict:
+    rng = random.Random(args.seed)
+    cache_path = args.cache or tempfile.mkdtemp(prefix="bench-cache-")
+    spec = {
+        "indices": args.indices, "archives": args.archives, "files": args.files, "min_size": args.min_size,
+        "max_size": args.max_size, "compression": args.compression, "map_archives": args.map_archives,
+        "entropy": args.entropy, "seed": args.seed
+    }
+    if args.cache and os.path.exists(os.path.join(args.cache, "manifest.json")) and not args.regenerate:
+        manifest = load_manifest(cache_path)
+    else:
+        start = time.perf_counter()
+        manifest = generate_cache(cache_path, args.indices, args.archives, args.files, args.min_size, args.max_size,
+                                  [COMPRESSION_NAMES[name] for name in args.compression.split(",")],
+                                  args.map_archives, args.entropy, args.seed)
+        print(f"Generated {cache_path} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    scenarios = args.scenarios.split(",") if args.scenarios else SCENARIOS
+    api = CacheLibraryAPI(file_cache_bytes=args.file_cache_bytes)
+    api.start_jvm(args.jar)
+    results = {}
+    try:
+        results["initialize"] = bench_initialize(api, cache_path, args.repeat, args.mmap_reader, args.lazy)
+        if any(scenario.startswith("read_") for scenario in scenarios):
+            results.update(bench_reads(api, cache_path, manifest, args.operations, args.hot_files,
+                                       args.mmap_reader, args.lazy, rng))
+        if "rebuild" in scenarios:
+            results["rebuild"] = bench_rebuild(api, cache_path, args.repeat)
+        if "put" in scenarios or "update" in scenarios:
+            # Writes go to a copy, so the generated cache can be reused by the next run
+            copy = tempfile.mkdtemp(prefix="bench-writes-")
+            try:
+                shutil.copytree(cache_path, copy, dirs_exist_ok=True)
+                api.cache_library.close()
+                api.cache_library = None
+                api.initialize_cache(copy)
+                results.update(bench_writes(api, manifest, args.operations, args.update_every, args.min_size,
+                                            args.max_size, rng))
+            finally:
+                shutil.rmtree(copy, ignore_errors=True)
+    finally:
+        api.close()
+        if not args.cache:
+            shutil.rmtree(cache_path, ignore_errors=True)
+
+    return {
+        "benchmark": "cache_api",
+        "created": time.time(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count()},
+        "spec": spec,
+        "options": {"operations": args.operations, "repeat": args.repeat, "hot_files": args.hot_files,
+                    "update_every": args.update_every, "mmap_reader": args.mmap_reader, "lazy": args.lazy,
+                    "file_cache_bytes": args.file_cache_bytes},
+        "results": {scenario: result for scenario, result in results.items() if scenario in scenarios}
+    }
+
+
+def print_table(results: Dict[str, dict], baseline: Optional[Dict[str, dict]] = None):
+    header = f"{'scenario':<12} {'ops':>7} {'ops/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'MB/s':>8}"
+    if baseline:
+        header += f" {'vs base':>8}"
+    print(header)
+    print("-" * len(header))
+    for scenario, result in results.items():
+        latency = result["latency_ms"]
+        line = (f"{scenario:<12} {result['operations']:>7} {result['ops_per_second']:>10.1f} {latency['p50']:>9.3f} "
+                f"{latency['p99']:>9.3f} {latency['max']:>9.3f} {result.get('bytes_per_second', 0) / 1e6:>8.1f}")
+        previous = (baseline or {}).get(scenario)
+        if previous and previous["ops_per_second"]:
+            line += f" {result['ops_per_second'] / previous['ops_per_second']:>7.2f}x"
+        if result["errors"]:
+            line += f"  ({result['errors']} errors)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cache", help="Directory of the synthetic cache; reused if it already has a manifest "
+                                        "(default: a temporary directory)")
+    parser.add_argument("--regenerate", action="store_true", help="Regenerate the cache even if --cache has one")
+    parser.add_argument("--indices", type=int, default=4)
+    parser.add_argument("--archives", type=int, default=200, help="Archives per index")
+    parser.add_argument("--files", type=int, default=8, help="Average files per archive")
+    parser.add_argument("--min-size", type=int, default=64)
+    parser.add_argument("--max-size", type=int, default=4096)
+    parser.add_argument("--compression", default="gzip,bzip2,lzma,none")
+    parser.add_argument("--map-archives", type=int, default=64)
+    parser.add_argument("--entropy", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scenarios", help=f"Comma separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--operations", type=int, default=2000, help="Calls per read and put scenario")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of initialize and rebuild")
+    parser.add_argument("--hot-files", type=int, default=100)
+    parser.add_argument("--update-every", type=int, default=100, help="Puts between update_index calls")
+    parser.add_argument("--file-cache-bytes", type=int, default=64 * 1024 * 1024)
+    parser.add_argument("--mmap-reader", action="store_true", help="Serve reads from the memory-mapped reader")
+    parser.add_argument("--lazy", action="store_true", help="Initialize with lazily loaded indices")
+    parser.add_argument("--jar", default="build/libs/rs-cache-library-all.jar")
+    parser.add_argument("--json", help="Write the results to this file as JSON")
+    parser.add_argument("--compare", help="Results JSON of an earlier run to compare throughput against")
+    args = parser.parse_args()
+
+    report = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_table(report["results"], baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+JPype Byte Transfer Micro-benchmark
+Compares the previous byte array conversions of the JPype bridge (bytes(array) and
+JArray(JByte)(bytes)) with the buffer-protocol / direct ByteBuffer transfers used by cache_api.
+
+Usage: python benchmarks/bench_jpype_bridge.py [--sizes 1024,65536,...] [--json results.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import jpype
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from cache_api import bytes_to_java, java_to_bytes
+
+
+DEFAULT_SIZES = [1024, 16 * 1024, 256 * 1024, 1024 * 1024, 8 * 1024 * 1024]
+
+
+def measure(function, argument, min_time: float = 0.5) -> float:
+    """Return the mean seconds per call of function(argument)"""
+    function(argument)
+    iterations = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        function(argument)
+        iterations += 1
+        elapsed = time.perf_counter() - start
+    return elapsed / iterations
+
+
+def run(sizes, min_time: float):
+    results = []
+    for size in sizes:
+        payload = os.urandom(size)
+        java_array = bytes_to_java(payload)
+        assert java_to_bytes(java_array) == payload
+        row = {
+            "size": size,
+            "java_to_python_bytes_ctor": measure(bytes, java_array, min_time),
+            "java_to_python_buffer": measure(java_to_bytes, java_array, min_time),
+            "python_to_java_jarray_ctor": measure(jpype.JArray(jpype.JByte), payload, min_time),
+            "python_to_java_direct_buffer": measure(bytes_to_java, payload, min_time)
+        }
+        results.append(row)
+    return results
+
+
+def print_table(results):
+    header = f"{'size':>10} {'J->P bytes()':>14} {'J->P buffer':>14} {'P->J JArray':>14} {'P->J nio':>14}"
+    print(header)
+    print("-" * len(header))
+    for row in results:
+        print(f"{row['size']:>10} "
+              f"{row['java_to_python_bytes_ctor'] * 1e6:>12.1f}us "
+              f"{row['java_to_python_buffer'] * 1e6:>12.1f}us "
+              f"{row['python_to_java_jarray_ctor'] * 1e6:>12.1f}us "
+              f"{row['python_to_java_direct_buffer'] * 1e6:>12.1f}us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="Comma separated payload sizes in bytes")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Seconds to run each measurement for")
+    parser.add_argument("--json", help="Write the results to this file as JSON")
+    args = parser.parse_args()
+
+    if not jpype.isJVMStarted():
+        jpype.startJVM(convertStrings=False)
+
+    results = run([int(size) for size in args.sizes.split(",")], args.min_time)
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "jpype_bridge", "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
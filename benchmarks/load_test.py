@@ -0,0 +1,385 @@
+"""
+HTTP Load Test
+Replays a configurable request mix against the HTTP API and sweeps client concurrency, reporting
+throughput, p50/p95/p99/p999 latency and error rates per request kind for every level.
+
+Request kinds (weights are set with --mix, e.g. hot=60,cold=25,name=10,put=5):
+
+    hot     GET /data/<index>/<archive>/<file> of a small set of files
+    cold    GET /data/<index>/<archive>/<file> of any file, including encrypted map archives
+    name    GET /data/<index>/<archive_name>
+    put     POST /put/<index>/<archive>/<file> with base64 JSON
+    update  POST /update/<index>, sent after every --update-every puts
+
+By default a synthetic cache is generated (see synthetic_cache.py), api.py is started on it with
+the production server and initialized. --webapp additionally starts webapp/app.py in front of it
+and sends the requests through the proxy; --target measures an already running server instead.
+
+Usage: python benchmarks/load_test.py [--cache /tmp/bench-cache] [--concurrency 1,4,16,64] [--duration 10]
+       [--mix hot=60,cold=25,name=10,put=5] [--webapp] [--json results.json]
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from percentiles import latency_summary
+from synthetic_cache import COMPRESSION_NAMES, file_requests, generate_cache, load_manifest
+
+
+REPOSITORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+KINDS = ["hot", "cold", "name", "put", "update"]
+DEFAULT_MIX = "hot=60,cold=25,name=10,put=5"
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in KINDS or kind == "update":
+            raise ValueError(f"Unknown request kind {kind!r}, expected one of hot, cold, name, put")
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+class Workload:
+    """Picks the next request of the mix; shared by all client threads"""
+
+    def __init__(self, manifest: dict, mix: Dict[str, float], hot_files: int, update_every: int,
+                 min_size: int, max_size: int, seed: int):
+        rng = random.Random(seed)
+        self.requests = file_requests(manifest)
+        self.hot = rng.sample(self.requests, min(hot_files, len(self.requests)))
+        # Writes stay out of the encrypted map archives, their keys would have to be sent back
+        self.writable = [request for request in self.requests if request[3] is None]
+        self.names = [(int(index_id), archive["name"]) for index_id, archives in manifest["indices"].items()
+                      if str(manifest.get("map_index")) != index_id for archive in archives.values()]
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.update_every = update_every
+        # A few payloads are encoded up front so the client does not measure its own base64
+        self.payloads = [base64.b64encode(rng.randbytes(rng.randint(min_size, max_size))).decode("ascii")
+                         for _ in range(64)]
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    def next(self, rng: random.Random) -> List[Tuple[str, str, str, Optional[dict]]]:
+        """The (kind, method, path, json body) requests to send next: one, or a put followed by an update"""
+        kind = rng.choices(self.kinds, self.weights)[0]
+        if kind == "name":
+            index_id, name = rng.choice(self.names)
+            return [(kind, "GET", f"/data/{index_id}/{name}", None)]
+        if kind == "put":
+            index_id, archive_id, file_id, _ = rng.choice(self.writable)
+            batch = [(kind, "POST", f"/put/{index_id}/{archive_id}/{file_id}", {"data": rng.choice(self.payloads)})]
+            with self._lock:
+                self._puts += 1
+                update = self._puts % self.update_every == 0
+            if update:
+                batch.append(("update", "POST", f"/update/{index_id}", None))
+            return batch
+        index_id, archive_id, file_id, xtea = rng.choice(self.hot if kind == "hot" else self.requests)
+        path = f"/data/{index_id}/{archive_id}/{file_id}"
+        if xtea is not None:
+            path += "?xtea=" + ",".join(str(key) for key in xtea)
+        return [(kind, "GET", path, None)]
+
+
+class Recorder:
+    """Latencies and errors per request kind of one concurrency level"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.error_samples: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, seconds: float, error: Optional[str]):
+        with self._lock:
+            self.latencies.setdefault(kind, []).append(seconds)
+            if error is not None:
+                self.errors[kind] = self.errors.get(kind, 0) + 1
+                self.error_samples.setdefault(kind, error)
+
+    def summary(self, seconds: float) -> dict:
+        routes = {}
+        for kind, latencies in sorted(self.latencies.items(), key=lambda item: KINDS.index(item[0])):
+            errors = self.errors.get(kind, 0)
+            routes[kind] = {
+                "requests": len(latencies),
+                "errors": errors,
+                "error_rate": errors / len(latencies),
+                "throughput": len(latencies) / seconds,
+                "latency_ms": latency_summary(latencies)
+            }
+            if kind in self.error_samples:
+                routes[kind]["error_sample"] = self.error_samples[kind]
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        errors = sum(self.errors.values())
+        return {
+            "seconds": seconds,
+            "requests": total,
+            "errors": errors,
+            "error_rate": errors / total if total else 0.0,
+            "throughput": total / seconds,
+            "latency_ms": latency_summary([value for latencies in self.latencies.values() for value in latencies]),
+            "routes": routes
+        }
+
+
+def send(session: requests.Session, base_url: str, method: str, path: str, body: Optional[dict],
+         timeout: float) -> Optional[str]:
+    """Send one request and return an error description, or None if it succeeded"""
+    try:
+        response = session.request(method, base_url + path, json=body, timeout=timeout)
+        content = response.content
+    except requests.RequestException as e:
+        return type(e).__name__
+    if response.status_code >= 400:
+        return f"HTTP {response.status_code}"
+    # The JSON API reports failed reads with a 200 and an error status
+    if response.headers.get("Content-Type", "").startswith("application/json") and b'"error"' in content:
+        result = json.loads(content)
+        if result.get("status") == "error":
+            return result.get("message", "error")
+    return None
+
+
+def run_level(base_url: str, workload: Workload, concurrency: int, duration: float, warmup: float,
+              timeout: float, seed: int) -> dict:
+    recorder = Recorder()
+    start = time.perf_counter()
+    measure_from = start + warmup
+    stop = measure_from + duration
+
+    def client(number: int):
+        rng = random.Random(seed * 1000003 + number)
+        with requests.Session() as session:
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount("http://", adapter)
+            while True:
+                now = time.perf_counter()
+                if now >= stop:
+                    return
+                for kind, method, path, body in workload.next(rng):
+                    began = time.perf_counter()
+                    error = send(session, base_url, method, path, body, timeout)
+                    if began >= measure_from:
+                        recorder.record(kind, time.perf_counter() - began, error)
+
+    threads = [threading.Thread(target=client, args=(number,), daemon=True) for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result = recorder.summary(duration)
+    result["concurrency"] = concurrency
+    return result
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Server:
+    """A child process serving HTTP, stopped when the context exits"""
+
+    def __init__(self, command: List[str], url: str, health_path: str, cwd: str = REPOSITORY,
+                 env: Optional[dict] = None, log_path: Optional[str] = None):
+        self.command = command
+        self.url = url
+        self.health_path = health_path
+        self.cwd = cwd
+        self.env = dict(os.environ, **(env or {}))
+        self.log_path = log_path
+        self.process = None
+        self._log = None
+
+    def __enter__(self):
+        self._log = open(self.log_path, "ab") if self.log_path else subprocess.DEVNULL
+        self.process = subprocess.Popen(self.command, cwd=self.cwd, env=self.env, stdout=self._log, stderr=self._log)
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{' '.join(self.command)} exited with status {self.process.returncode}")
+            try:
+                if requests.get(self.url + self.health_path, timeout=1).status_code == 200:
+                    return self
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        self.__exit__(None, None, None)
+        raise RuntimeError(f"{self.url} did not become healthy")
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self._log not in (None, subprocess.DEVNULL):
+            self._log.close()
+        return False
+
+
+def scrape_counters(metrics_url: str, names: Sequence[str]) -> Dict[str, float]:
+    """Sum of the values of each counter over all its labels, from a Prometheus text endpoint"""
+    totals = dict.fromkeys(names, 0.0)
+    for line in requests.get(metrics_url, timeout=30).text.splitlines():
+        name = line.split("{", 1)[0].split(" ", 1)[0]
+        if name in totals:
+            totals[name] += float(line.rsplit(" ", 1)[1])
+    return totals
+
+
+def sweep(base_url: str, workload: Workload, args, metrics_url: Optional[str] = None) -> List[dict]:
+    """Run every concurrency level; with metrics_url, also count the connections api.py accepted per level"""
+    levels = []
+    names = ("cache_api_connections_total", "cache_api_requests_total")
+    for concurrency in [int(level) for level in args.concurrency.split(",")]:
+        before = scrape_counters(metrics_url, names) if metrics_url else None
+        result = run_level(base_url, workload, concurrency, args.duration, args.warmup, args.timeout, args.seed)
+        if before is not None:
+            after = scrape_counters(metrics_url, names)
+            connections, served = (after[name] - before[name] for name in names)
+            # The debug server does not count connections
+            if connections:
+                result["api_connections"] = {"connections": int(connections), "requests": int(served),
+                                             "requests_per_connection": served / connections}
+        print_level(result)
+        levels.append(result)
+    return levels
+
+
+def print_level(result: dict):
+    print(f"concurrency {result['concurrency']}: {result['throughput']:.1f} req/s, "
+          f"{result['error_rate'] * 100:.2f}% errors")
+    print(f"  {'kind':<8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'p999 ms':>9} {'errors':>8}")
+    for kind, route in result["routes"].items():
+        latency = route["latency_ms"]
+        print(f"  {kind:<8} {route['throughput']:>9.1f} {latency['p50']:>9.2f} {latency['p95']:>9.2f} "
+              f"{latency['p99']:>9.2f} {latency['p999']:>9.2f} {route['error_rate'] * 100:>7.2f}%")
+        if "error_sample" in route:
+            print(f"           e.g. {route['error_sample']}")
+    if "api_connections" in result:
+        reuse = result["api_connections"]
+        print(f"  api.py accepted {reuse['connections']} connections for {reuse['requests']} requests")
+
+
+def run(args) -> dict:
+    mix = parse_mix(args.mix)
+    if args.webapp and "name" in mix:
+        # The proxy has no by-name route
+        print("webapp/app.py has no by-name route, leaving name requests out of the mix", file=sys.stderr)
+        del mix["name"]
+
+    cache_path = args.cache or tempfile.mkdtemp(prefix="load-cache-")
+    if os.path.exists(os.path.join(cache_path, "manifest.json")) and not args.regenerate:
+        manifest = load_manifest(cache_path)
+    else:
+        manifest = generate_cache(cache_path, args.indices, args.archives, args.files, args.min_size, args.max_size,
+                                  [COMPRESSION_NAMES[name] for name in args.compression.split(",")],
+                                  args.map_archives, args.entropy, args.seed)
+    workload = Workload(manifest, mix, args.hot_files, args.update_every, args.min_size, args.max_size, args.seed)
+
+    report = {
+        "benchmark": "load_test",
+        "created": time.time(),
+        "options": {"mix": mix, "concurrency": args.concurrency, "duration": args.duration, "warmup": args.warmup,
+                    "update_every": args.update_every, "hot_files": args.hot_files, "webapp": args.webapp,
+                    "target": args.target, "mmap_reader": args.mmap_reader, "threads": args.threads}
+    }
+    if args.target:
+        report["levels"] = sweep(args.target.rstrip("/") + args.prefix, workload, args)
+        return report
+
+    # Puts change the cache, so the servers work on a copy and the generated cache can be reused
+    work_path = tempfile.mkdtemp(prefix="load-work-")
+    try:
+        shutil.copytree(cache_path, work_path, dirs_exist_ok=True)
+        api_port = free_port()
+        api_url = f"http://127.0.0.1:{api_port}"
+        api_command = [sys.executable, "api.py", "--host", "127.0.0.1", "--port", str(api_port)]
+        if not args.debug_server:
+            api_command += ["--production", "--threads", str(args.threads)]
+        with Server(api_command, api_url, "/health", log_path=args.server_log):
+            result = requests.post(api_url + "/initialize", json={"path": work_path, "mmap_reader": args.mmap_reader},
+                                   timeout=600).json()
+            if result.get("status") != "success":
+                raise RuntimeError(f"Failed to initialize the cache: {result.get('message')}")
+            if not args.webapp:
+                report["levels"] = sweep(api_url, workload, args, metrics_url=api_url + "/metrics")
+                return report
+            webapp_port = free_port()
+            webapp_url = f"http://127.0.0.1:{webapp_port}"
+            webapp_command = [sys.executable, "-m", "flask", "--app", "app", "run", "--host", "127.0.0.1",
+                              "--port", str(webapp_port)]
+            with Server(webapp_command, webapp_url, "/api/health", cwd=os.path.join(REPOSITORY, "webapp"),
+                        env={"CACHE_API_URL": api_url}, log_path=args.server_log):
+                report["levels"] = sweep(webapp_url + "/api", workload, args, metrics_url=api_url + "/metrics")
+                return report
+    finally:
+        shutil.rmtree(work_path, ignore_errors=True)
+        if not args.cache:
+            shutil.rmtree(cache_path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="Base URL of a running server to measure instead of starting api.py")
+    parser.add_argument("--prefix", default="", help="Path prefix of the routes on --target, e.g. /api for the webapp")
+    parser.add_argument("--webapp", action="store_true", help="Start webapp/app.py in front of api.py and measure it")
+    parser.add_argument("--cache", help="Directory of the synthetic cache; generated if it has no manifest "
+                                        "(default: a temporary directory)")
+    parser.add_argument("--regenerate", action="store_true")
+    parser.add_argument("--indices", type=int, default=4)
+    parser.add_argument("--archives", type=int, default=200)
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--min-size", type=int, default=64)
+    parser.add_argument("--max-size", type=int, default=4096)
+    parser.add_argument("--compression", default="gzip,bzip2,lzma,none")
+    parser.add_argument("--map-archives", type=int, default=64)
+    parser.add_argument("--entropy", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weights of the request kinds hot, cold, name and put")
+    parser.add_argument("--hot-files", type=int, default=100)
+    parser.add_argument("--update-every", type=int, default=50, help="Puts between /update requests")
+    parser.add_argument("--concurrency", default="1,4,16,64", help="Comma separated client thread counts to sweep")
+    parser.add_argument("--duration", type=float, default=10.0, help="Measured seconds per concurrency level")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Unmeasured seconds before each level")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Request timeout in seconds")
+    parser.add_argument("--threads", type=int, default=16, help="Worker threads of the production server")
+    parser.add_argument("--debug-server", action="store_true", help="Run api.py with Flask's development server")
+    parser.add_argument("--mmap-reader", action="store_true", help="Initialize the cache with the mmap reader")
+    parser.add_argument("--server-log", help="Append the servers' output to this file")
+    parser.add_argument("--json", help="Write the results to this file as JSON")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+Latency Percentiles
+Shared by the benchmarks to summarize latency samples the same way.
+"""
+
+import math
+from typing import Sequence
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    """Nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def latency_summary(latencies: Sequence[float]) -> dict:
+    """Mean, p50, p90, p95, p99, p999 and max of latencies in seconds, in milliseconds"""
+    values = sorted(latencies)
+    return {
+        "mean": sum(values) / len(values) * 1000 if values else 0.0,
+        "p50": percentile(values, 0.50) * 1000,
+        "p90": percentile(values, 0.90) * 1000,
+        "p95": percentile(values, 0.95) * 1000,
+        "p99": percentile(values, 0.99) * 1000,
+        "p999": percentile(values, 0.999) * 1000,
+        "max": values[-1] * 1000 if values else 0.0
+    }
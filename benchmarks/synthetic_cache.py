@@ -0,0 +1,190 @@
+"""
+Synthetic Cache Generator
+Writes a reproducible dat2/idx cache for benchmarks: a configurable number of indices, archives
+per index, files per archive and payload sizes, with archives spread over the compression types
+and optionally an index of XTEA-encrypted map archives. The same seed always produces the same
+cache.
+
+Usage: python benchmarks/synthetic_cache.py /tmp/bench-cache [--indices 4] [--archives 200] ...
+"""
+
+import argparse
+import json
+import os
+import random
+import struct
+import sys
+from typing import Dict, List, Optional, Sequence
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from cache_format import (CACHE_FILE_NAME, COMPRESSION_BZIP2, COMPRESSION_GZIP, COMPRESSION_LZMA, COMPRESSION_NONE,
+                          FLAG_NAME, INDEX_SIZE, SECTOR_DATA_SIZE_BIG, SECTOR_DATA_SIZE_SMALL, SECTOR_SIZE, ArchiveEntry,
+                          ReferenceTable, crc32, encode_archive, encode_container, java_string_hash)
+
+
+COMPRESSION_NAMES = {"none": COMPRESSION_NONE, "bzip2": COMPRESSION_BZIP2, "gzip": COMPRESSION_GZIP, "lzma": COMPRESSION_LZMA}
+
+# Keys of encrypted archives are written next to the cache in the format POST /export accepts
+XTEAS_FILE_NAME = "xteas.json"
+MANIFEST_FILE_NAME = "manifest.json"
+
+
+class CacheWriter:
+    """Appends archive containers to main_file_cache.dat2 as sector chains and indexes them in idx files"""
+
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._main = open(os.path.join(path, f"{CACHE_FILE_NAME}.dat2"), "wb")
+        # Sector 0 is never used
+        self._main.write(bytes(SECTOR_SIZE))
+        self._sectors = 1
+        self._indices: Dict[int, bytearray] = {}
+
+    def write(self, index_id: int, archive_id: int, container: bytes):
+        entries = self._indices.setdefault(index_id, bytearray())
+        end = (archive_id + 1) * INDEX_SIZE
+        if len(entries) < end:
+            entries.extend(bytes(end - len(entries)))
+        entries[archive_id * INDEX_SIZE:end] = len(container).to_bytes(3, "big") + self._sectors.to_bytes(3, "big")
+
+        big = archive_id > 0xFFFF
+        chunk_size = SECTOR_DATA_SIZE_BIG if big else SECTOR_DATA_SIZE_SMALL
+        header_id = struct.pack(">i", archive_id) if big else struct.pack(">H", archive_id)
+        for chunk, offset in enumerate(range(0, max(len(container), 1), chunk_size)):
+            data = container[offset:offset + chunk_size]
+            next_sector = self._sectors + 1 if offset + chunk_size < len(container) else 0
+            sector = header_id + struct.pack(">H", chunk) + next_sector.to_bytes(3, "big") + bytes([index_id]) + data
+            self._main.write(sector.ljust(SECTOR_SIZE, b"\0"))
+            self._sectors += 1
+
+    def close(self):
+        self._main.close()
+        for index_id, entries in self._indices.items():
+            with open(os.path.join(self.path, f"{CACHE_FILE_NAME}.idx{index_id}"), "wb") as f:
+                f.write(entries)
+
+
+def payload(rng: random.Random, size: int, entropy: float) -> bytes:
+    """size bytes of which about entropy is random and the rest repeats, so compression has work to do"""
+    random_size = int(size * entropy)
+    pattern = rng.randbytes(16)
+    return rng.randbytes(random_size) + (pattern * (size // 16 + 1))[:size - random_size]
+
+
+def generate_cache(path: str, indices: int = 4, archives: int = 200, files: int = 8, min_size: int = 64,
+                   max_size: int = 4096, compressions: Sequence[int] = (COMPRESSION_GZIP, COMPRESSION_BZIP2,
+                                                                       COMPRESSION_LZMA, COMPRESSION_NONE),
+                   map_archives: int = 0, entropy: float = 0.5, seed: int = 0) -> dict:
+    """Write the cache to path and return its manifest.
+
+    Indices 0..indices-1 hold archives named "archive<id>" with file counts varying around files.
+    With map_archives, one more index holds a "m<x>_<y>" terrain archive and a "l<x>_<y>" landscape
+    archive per map square, the landscapes encrypted with random XTEA keys. The manifest lists every
+    archive's name and file sizes; it is written to manifest.json and the keys to xteas.json.
+    """
+    rng = random.Random(seed)
+    writer = CacheWriter(path)
+    manifest = {"seed": seed, "indices": {}, "xteas": {}}
+    tables = {}
+    try:
+        for index_id in range(indices):
+            contents = {}
+            for archive_id in range(archives):
+                file_count = max(1, rng.randint(files // 2, files + files // 2)) if files > 1 else 1
+                contents[archive_id] = (f"archive{archive_id}", {file_id: payload(rng, rng.randint(min_size, max_size), entropy)
+                                                                 for file_id in range(file_count)}, None)
+            tables[index_id] = _write_index(writer, rng, index_id, contents, compressions, manifest)
+
+        if map_archives:
+            map_index = indices
+            contents = {}
+            for i in range(map_archives):
+                x, y = 40 + i // 16, 40 + i % 16
+                keys = [rng.randint(-2 ** 31, 2 ** 31 - 1) for _ in range(4)]
+                landscape = {0: payload(rng, rng.randint(min_size, max_size), entropy)}
+                terrain = {0: payload(rng, rng.randint(min_size, max_size), entropy)}
+                contents[2 * i] = (f"m{x}_{y}", terrain, None)
+                contents[2 * i + 1] = (f"l{x}_{y}", landscape, keys)
+            tables[map_index] = _write_index(writer, rng, map_index, contents, [COMPRESSION_GZIP], manifest)
+            manifest["map_index"] = map_index
+
+        for index_id, table in tables.items():
+            writer.write(255, index_id, encode_container(table.encode(), COMPRESSION_GZIP))
+    finally:
+        writer.close()
+
+    with open(os.path.join(path, MANIFEST_FILE_NAME), "w") as f:
+        json.dump(manifest, f)
+    with open(os.path.join(path, XTEAS_FILE_NAME), "w") as f:
+        json.dump({"xteas": manifest["xteas"]}, f)
+    return manifest
+
+
+def _write_index(writer: CacheWriter, rng: random.Random, index_id: int, contents: dict, compressions: Sequence[int],
+                 manifest: dict) -> ReferenceTable:
+    table = ReferenceTable(index_id)
+    table.version = 6
+    table.revision = 1
+    table.mask = FLAG_NAME
+    archives = {}
+    for archive_id, (name, files, keys) in sorted(contents.items()):
+        container = encode_container(encode_archive(files), rng.choice(list(compressions)), xtea=keys)
+        entry = ArchiveEntry(archive_id)
+        entry.name_hash = java_string_hash(name)
+        entry.crc = crc32(container)
+        entry.revision = 1
+        entry.file_ids = sorted(files)
+        table.archives[archive_id] = entry
+        # The revision trailer follows the CRC'd part of the container
+        writer.write(index_id, archive_id, container + struct.pack(">H", entry.revision))
+        archives[str(archive_id)] = {"name": name, "files": {str(file_id): len(data) for file_id, data in files.items()}}
+        if keys is not None:
+            manifest["xteas"][str(archive_id)] = keys
+    manifest["indices"][str(index_id)] = archives
+    return table
+
+
+def load_manifest(path: str) -> dict:
+    with open(os.path.join(path, MANIFEST_FILE_NAME)) as f:
+        return json.load(f)
+
+
+def file_requests(manifest: dict) -> List[tuple]:
+    """Every (index_id, archive_id, file_id, xtea) of a manifest, with the keys of encrypted map archives"""
+    xteas = manifest["xteas"]
+    requests = []
+    for index_id, archives in manifest["indices"].items():
+        map_index = str(manifest.get("map_index")) == index_id
+        for archive_id, archive in archives.items():
+            xtea: Optional[List[int]] = xteas.get(archive_id) if map_index else None
+            for file_id in archive["files"]:
+                requests.append((int(index_id), int(archive_id), int(file_id), xtea))
+    return requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="Directory to write the cache to")
+    parser.add_argument("--indices", type=int, default=4)
+    parser.add_argument("--archives", type=int, default=200, help="Archives per index")
+    parser.add_argument("--files", type=int, default=8, help="Average files per archive")
+    parser.add_argument("--min-size", type=int, default=64, help="Smallest file payload in bytes")
+    parser.add_argument("--max-size", type=int, default=4096, help="Largest file payload in bytes")
+    parser.add_argument("--compression", default="gzip,bzip2,lzma,none",
+                        help=f"Comma separated compression types to spread archives over ({', '.join(COMPRESSION_NAMES)})")
+    parser.add_argument("--map-archives", type=int, default=0, help="Map squares with an XTEA-encrypted landscape archive")
+    parser.add_argument("--entropy", type=float, default=0.5, help="Fraction of each payload that is random")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    manifest = generate_cache(args.path, args.indices, args.archives, args.files, args.min_size, args.max_size,
+                              [COMPRESSION_NAMES[name] for name in args.compression.split(",")],
+                              args.map_archives, args.entropy, args.seed)
+    total = sum(len(archive["files"]) for archives in manifest["indices"].values() for archive in archives.values())
+    print(f"Wrote {len(manifest['indices'])} indices with {total} files to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,18 +5,135 @@ This module provides a Python interface to the Kotlin-based RuneScape cache libr
 
 import jpype
 import jpype.imports
+import jpype.nio
 from jpype.types import *
 import os
 import base64
+import functools
 import json
-from typing import Optional, List
+import logging
+import struct
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from cache_reader import CacheReader, compare_caches
+from cache_format import (CACHE_FILE_NAME, COMPRESSION_GZIP, CacheFormatError, ReferenceTable, container_size, crc32,
+                          decode_container, encode_archive, encode_container, java_string_hash, reference_table_revision,
+                          split_archive)
+from file_cache import FileCache
+from hot_set import HotSet
+from jobs import JobCancelled, JobManager
+from metrics import count_error, jvm_call
+from name_index import NameIndex
+from rwlock import ReadWriteLock
+from sector_map import SECTOR_MAP_FILE_NAME, SectorMap
+from table_snapshot import SNAPSHOT_FILE_NAME, TableSnapshot, write_snapshot
+from tracing import span
+from transactions import GroupCommitter, StagedWrite, TransactionError, TransactionManager
+
+
+# Written to the output directory of a rebuild, so the next incremental rebuild knows what it holds
+REBUILD_MANIFEST_FILE_NAME = "rebuild.json"
+
+
+def java_to_bytes(array) -> bytes:
+    """Copy a Java byte[] into Python bytes with a single bulk copy through the buffer protocol"""
+    return memoryview(array).tobytes()
+
+
+def bytes_to_java(data):
+    """Create a Java byte[] from a bytes-like object without per-element conversion.
+
+    The Python buffer is exposed to the JVM as a direct ByteBuffer and copied into the
+    array with one ByteBuffer.get call.
+    """
+    view = memoryview(data)
+    array = jpype.JArray(jpype.JByte)(view.nbytes)
+    if view.nbytes == 0:
+        return array
+    if view.readonly:
+        # Older JPype releases can only wrap writable buffers
+        view = memoryview(bytearray(view))
+    jpype.nio.convertToDirectBuffer(view).get(array)
+    return array
+
+
+def attach_jvm_thread():
+    """Attach the calling thread to the JVM as a daemon, so pooled threads never block JVM shutdown"""
+    if jpype.isJVMStarted() and not jpype.isThreadAttachedToJVM():
+        jpype.java.lang.Thread.attachAsDaemon()
+
+
+def progress_listener(job, start: float = 0.0, span: float = 1.0, cancellable: bool = True):
+    """A Java ProgressListener that reports into job, scaled to [start, start + span].
+
+    Cancelling the job makes notify raise, which aborts the Java operation reporting progress,
+    unless cancellable is False (for operations that must not stop half way, like Index.update).
+    """
+    def notify(progress, message):
+        try:
+            job.update(start + float(progress) * span, str(message) if message is not None else None)
+        except JobCancelled:
+            if cancellable:
+                raise
+    return jpype.JProxy("com.displee.cache.ProgressListener", dict={"notify": notify})
+
+
+def reads(method):
+    """Run a CacheLibraryAPI method under the shared read lock"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        attach_jvm_thread()
+        with span("read_lock"):
+            self.lock.acquire_read()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.lock.release_read()
+    return wrapper
+
+
+def writes(method):
+    """Run a CacheLibraryAPI method under the exclusive write lock"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        attach_jvm_thread()
+        with span("write_lock"):
+            self.lock.acquire_write()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.lock.release_write()
+    return wrapper
 
 
 class CacheLibraryAPI:
-    """Python wrapper for the RuneScape Cache Library"""
+    """Python wrapper for the RuneScape Cache Library.
+
+    Reads run in parallel under a shared lock; mutations of the CacheLibrary are exclusive.
+    """
     
-    def __init__(self):
+    def __init__(self, file_cache_bytes: int = 64 * 1024 * 1024, file_cache_ttl: Optional[float] = None):
         self.cache_library = None
+        self.reader = None
+        self.path = None
+        # Free sectors that writes reuse, None until it is loaded or scanned
+        self.sector_map: Optional[SectorMap] = None
+        # Processes that never write to the cache can skip keeping a sector map
+        self.track_free_sectors = True
+        self.file_cache = FileCache(file_cache_bytes, file_cache_ttl)
+        self.lock = ReadWriteLock()
+        self.names = NameIndex(self._load_name_hashes)
+        self.hot_set = HotSet()
+        self.jobs = JobManager(thread_initializer=attach_jvm_thread)
+        self.transactions = TransactionManager()
+        self.committer = GroupCommitter(self._update_indices)
+        # Called after changes were written to disk by a transaction flush
+        self.commit_listeners = []
+        # Bumped under the write lock whenever what is on disk may have changed
+        self.commits = 0
         self._jvm_started = False
     
     def start_jvm(self, jar_path: str = "build/libs/rs-cache-library-all.jar"):
@@ -44,8 +161,16 @@ class CacheLibraryAPI:
                 jpype.startJVM(classpath=[jar_path, "libs/*"], convertStrings=False)
             self._jvm_started = True
     
-    def initialize_cache(self, path: str):
-        """Initialize the cache library with the given path"""
+    @writes
+    def initialize_cache(self, path: str, use_mmap_reader: bool = False, lazy: bool = False):
+        """Initialize the cache library with the given path.
+
+        With use_mmap_reader, reads are served by a memory-mapped CacheReader instead of the JVM.
+        The reader only sees data that has been written to disk with update_index. As the reader
+        decodes reference tables itself, from the snapshot when it is current, the JVM then loads
+        an index's table only when the index is written to, like with lazy.
+        With lazy, the reference table of an index is only read the first time the index is used.
+        """
         try:
             # Import the Kotlin classes
             from com.displee.cache import CacheLibrary
@@ -54,53 +179,526 @@ class CacheLibraryAPI:
             if not os.path.exists(path):
                 return {"status": "error", "message": f"Cache path does not exist: {path}"}
             
+            reader = None
+            reader_error = None
+            if use_mmap_reader:
+                try:
+                    reader = CacheReader(path, self._open_table_snapshot(path))
+                except FileNotFoundError as e:
+                    reader_error = str(e)
+            
             # Create the cache library instance
-            self.cache_library = CacheLibrary.create(path)
-            return {"status": "success", "message": f"Cache initialized at {path}"}
+            try:
+                self.cache_library = CacheLibrary.create(path, False, None, lazy or reader is not None)
+            except Exception:
+                if reader is not None:
+                    reader.close()
+                raise
+            self.path = path
+            self.file_cache.clear()
+            self.names.clear()
+            self.hot_set.clear()
+            self.transactions.clear()
+            self.commits += 1
+            if self.reader is not None:
+                self.reader.close()
+            self.reader = reader
+            self._open_sector_map()
+
+            if reader_error is not None:
+                return {"status": "success", "message": f"Cache initialized at {path} without mmap reader: {reader_error}"}
+            if reader is not None:
+                # Decoding every table to refresh the snapshot for the next start happens off the request path
+                self.jobs.submit("snapshot", self._refresh_table_snapshot, self.reader,
+                                 description="Refresh the reference table snapshot")
+            return {"status": "success", "message": f"Cache initialized at {path}" + (" (lazy)" if lazy else "")}
         except Exception as e:
+            count_error("initialize_cache", e)
             return {"status": "error", "message": f"Failed to initialize cache: {str(e)}"}
     
-    def get_file_data(self, index_id: int, archive_id: int, file_id: int = 0, xtea: Optional[List[int]] = None):
-        """Get file data from the cache"""
+    def sector_map_path(self) -> str:
+        return os.path.join(self.path, SECTOR_MAP_FILE_NAME)
+    
+    def _open_sector_map(self):
+        """Use the free sector map saved next to the cache, or scan the cache for one in the background.
+
+        Until the map is ready, writes append to main_file_cache.dat2 as usual. 317 caches are left alone.
+        """
+        self.sector_map = None
+        self.cache_library.setSectorAllocator(None)
+        if not self.track_free_sectors or self.cache_library.is317():
+            return
+        sector_map = SectorMap.load(self.sector_map_path(), self.path)
+        if sector_map is not None:
+            self._attach_sector_map(sector_map)
+        else:
+            self.jobs.submit("sector_map", self._scan_sector_map, self.cache_library,
+                             description=f"Scan {self.path} for free sectors")
+    
+    def _scan_sector_map(self, job, cache_library):
+        # Scanned without the lock, as a write waiting for it would hold back every read meanwhile.
+        # The map only matches the files if nothing was written during the scan, else it is repeated
+        while True:
+            with self.lock.read():
+                if self.cache_library is not cache_library:
+                    return {"attached": False}
+                commits = self.commits
+            reader = CacheReader(self.path)
+            try:
+                sector_map = SectorMap.scan(reader, job)
+            finally:
+                reader.close()
+            with self.lock.write():
+                if self.cache_library is not cache_library:
+                    return {"attached": False}
+                if self.commits == commits:
+                    self._attach_sector_map(sector_map)
+                    sector_map.save(self.sector_map_path(), self.path)
+                    return {"attached": True, **sector_map.stats()}
+            job.update(0.0, "The cache changed during the scan, scanning again")
+    
+    def _attach_sector_map(self, sector_map: SectorMap):
+        def written(index_id, archive_id, positions):
+            sector_map.written(int(index_id), int(archive_id), memoryview(positions).tolist())
+        
+        allocator = jpype.JProxy("com.displee.cache.SectorAllocator",
+                                 dict={"allocate": lambda count: sector_map.allocate(int(count)), "written": written,
+                                       "release": lambda position, count: sector_map.release(int(position), int(count))})
+        self.cache_library.setSectorAllocator(allocator)
+        self.sector_map = sector_map
+    
+    def table_snapshot_path(self) -> str:
+        return os.path.join(self.path, SNAPSHOT_FILE_NAME)
+    
+    def _open_table_snapshot(self, cache_path: str) -> Optional[TableSnapshot]:
+        path = os.path.join(cache_path, SNAPSHOT_FILE_NAME)
+        if not os.path.exists(path):
+            return None
+        try:
+            return TableSnapshot(path)
+        except (OSError, ValueError, CacheFormatError, struct.error) as e:
+            logging.getLogger(__name__).warning("Ignoring unreadable reference table snapshot %s: %s", path, e)
+            return None
+    
+    def _refresh_table_snapshot(self, job, reader):
+        """Rewrite the snapshot if a reference table changed since it was written"""
+        if not reader.snapshot_stale():
+            return {"written": False}
+        tables = reader.snapshot_tables()
+        size = write_snapshot(self.table_snapshot_path(), tables)
+        return {"written": True, "indices": len(tables), "bytes": size}
+    
+    @reads
+    def read_file(self, index_id: int, archive_id: int, file_id: int = 0, xtea: Optional[List[int]] = None):
+        """Get the raw bytes of a file, together with its archive's CRC and revision"""
         try:
             if self.cache_library is None:
                 return {"status": "error", "message": "Cache not initialized"}
             
-            # Convert xtea to Java int array if provided
-            xtea_array = None
-            if xtea is not None:
-                xtea_array = jpype.JArray(jpype.JInt)(xtea)
+            self.hot_set.record(index_id, archive_id)
+            key = FileCache.key(index_id, archive_id, file_id, xtea)
+            # Writes bump the archive's generation, so (crc, revision, generation) identifies the data; the
+            # generation is a FileCache.version, which also changes when the cache is cleared
+            with span("file_cache") as lookup:
+                token = self.file_cache.token(index_id, archive_id)
+                cached = self.file_cache.get(key)
+                lookup.set_attribute("hit", cached is not None)
+            if cached is not None:
+                data, crc, revision = cached
+                return {
+                    "status": "success",
+                    "data": data,
+                    "index_id": index_id,
+                    "archive_id": archive_id,
+                    "file_id": file_id,
+                    "crc": crc,
+                    "revision": revision,
+                    "generation": self.file_cache.version(token)
+                }
             
-            # Get data from cache
-            data = self.cache_library.data(index_id, archive_id, file_id, xtea_array)
+            crc = None
+            revision = None
+            if self.reader is not None and self.reader.exists(index_id):
+                # Served from the memory-mapped files, without crossing into the JVM
+                with span("mmap_read"):
+                    data = self.reader.data(index_id, archive_id, file_id, xtea)
+                table = self.reader.reference_table(index_id)
+                entry = table.archives.get(archive_id) if table is not None else None
+                if entry is not None:
+                    crc = entry.crc
+                    revision = entry.revision
+            else:
+                # Convert xtea to Java int array if provided
+                xtea_array = None
+                if xtea is not None:
+                    xtea_array = jpype.JArray(jpype.JInt)(xtea)
+                
+                # Get data from cache
+                with jvm_call("data"), span("jvm_read"):
+                    data = self.cache_library.data(index_id, archive_id, file_id, xtea_array)
+                if data is not None:
+                    archive = self.cache_library.index(index_id).archive(archive_id, True)
+                    crc = int(archive.crc)
+                    revision = int(archive.revision)
+                    with span("copy", bytes=len(data)):
+                        data = java_to_bytes(data)
             
             if data is None:
                 return {"status": "error", "message": f"No data found for index {index_id}, archive {archive_id}, file {file_id}"}
             
-            # Convert byte array to base64 for JSON serialization
-            data_b64 = base64.b64encode(bytes(data)).decode('utf-8')
-            
+            self.file_cache.put(key, data, crc, revision, token)
             return {
                 "status": "success",
-                "data": data_b64,
+                "data": data,
                 "index_id": index_id,
                 "archive_id": archive_id,
-                "file_id": file_id
+                "file_id": file_id,
+                "crc": crc,
+                "revision": revision,
+                "generation": self.file_cache.version(token)
             }
         except Exception as e:
+            count_error("read_file", e)
             return {"status": "error", "message": f"Failed to get file data: {str(e)}"}
     
-    def put_file_data(self, index_id: int, archive_id: int, file_id: int, data: str, xtea: Optional[List[int]] = None):
-        """Put file data into the cache"""
+    def _raw_container(self, index_id: int, archive_id: int) -> Optional[bytes]:
+        if self.reader is not None and self.reader.exists(index_id):
+            data = self.reader.read_container(index_id, archive_id)
+            return bytes(data) if data is not None else None
+        if index_id == 255:
+            index = self.cache_library.getIndex255()
+        elif self.cache_library.exists(index_id):
+            index = self.cache_library.index(index_id)
+        else:
+            return None
+        sector = index.readArchiveSector(archive_id) if index is not None else None
+        return java_to_bytes(sector.data) if sector is not None else None
+    
+    @reads
+    def get_raw_archive(self, index_id: int, archive_id: int):
+        """Get an archive's container exactly as stored in the sectors, without decompressing it.
+
+        Index 255 returns the reference table container of index archive_id. Writes that have
+        not been committed with update_index are not visible here.
+        """
         try:
             if self.cache_library is None:
                 return {"status": "error", "message": "Cache not initialized"}
             
+            data = self._raw_container(index_id, archive_id)
+            if data is None:
+                return {"status": "error", "message": f"No container found for index {index_id}, archive {archive_id}"}
+            
+            return {
+                "status": "success",
+                "data": data,
+                "index_id": index_id,
+                "archive_id": archive_id
+            }
+        except Exception as e:
+            count_error("get_raw_archive", e)
+            return {"status": "error", "message": f"Failed to get raw archive: {str(e)}"}
+    
+    @reads
+    def index_checksums(self) -> List[Tuple[int, int]]:
+        """(crc, revision) of the stored reference table of every index id up to the highest one.
+
+        Missing indices are (0, 0). The CRC covers the container without its revision trailer.
+        """
+        if self.cache_library is None:
+            raise RuntimeError("Cache not initialized")
+        return self._index_checksums()
+    
+    def _index_checksums(self) -> List[Tuple[int, int]]:
+        if self.reader is not None:
+            index_ids = self.reader.index_ids()
+        else:
+            index_ids = [int(index_id) for index_id in self.cache_library.indexIds()]
+        checksums = []
+        for index_id in range(max(index_ids) + 1 if index_ids else 0):
+            container = self._raw_container(255, index_id) if index_id in index_ids else None
+            if container is None:
+                checksums.append((0, 0))
+                continue
+            container = container[:container_size(container)]
+            checksums.append((crc32(container), reference_table_revision(decode_container(container))))
+        return checksums
+    
+    @reads
+    def archive_version(self, index_id: int, archive_id: int) -> Optional[Tuple[int, int, str]]:
+        """(crc, revision, generation) of an archive, read from its reference table entry only.
+
+        Matches the crc, revision and generation that read_file returns for the archive's files.
+        """
+        if self.cache_library is None:
+            return None
+        generation = self.file_cache.version(self.file_cache.token(index_id, archive_id))
+        if self.reader is not None and self.reader.exists(index_id):
+            table = self.reader.reference_table(index_id)
+            entry = table.archives.get(archive_id) if table is not None else None
+            if entry is None:
+                return None
+            return entry.crc, entry.revision, generation
+        if not self.cache_library.exists(index_id):
+            return None
+        archive = self.cache_library.index(index_id).archive(archive_id, True)
+        if archive is None:
+            return None
+        return int(archive.crc), int(archive.revision), generation
+    
+    def get_file_data(self, index_id: int, archive_id: int, file_id: int = 0, xtea: Optional[List[int]] = None):
+        """Get file data from the cache"""
+        return self.json_file_result(self.read_file(index_id, archive_id, file_id, xtea))
+    
+    @staticmethod
+    def json_file_result(result):
+        """Turn a read_file result into the JSON form of get_file_data"""
+        if result["status"] != "success":
+            return result
+        
+        # Convert byte array to base64 for JSON serialization
+        data_b64 = base64.b64encode(result["data"]).decode('utf-8')
+        
+        return {
+            "status": "success",
+            "data": data_b64,
+            "index_id": result["index_id"],
+            "archive_id": result["archive_id"],
+            "file_id": result["file_id"]
+        }
+    
+    def _load_name_hashes(self, index_id: int):
+        index = self.cache_library.index(index_id)
+        # Two bulk array copies instead of a JPype call per archive
+        archive_ids = memoryview(index.archiveIds()).tolist()
+        name_hashes = memoryview(index.archiveNameHashes()).tolist()
+        return zip(name_hashes, archive_ids)
+    
+    def name_hash(self, index_id: int, name: str) -> int:
+        """Hash an archive name the way the index does"""
+        if self.cache_library.is317():
+            return int(self.cache_library.index(index_id).toHash(name))
+        return java_string_hash(name)
+    
+    @reads
+    def archive_id(self, index_id: int, name: str) -> Optional[int]:
+        """Look up the id of the archive named name, or None if the index has no such archive"""
+        if self.cache_library is None or not self.cache_library.exists(index_id):
+            return None
+        return self.names.archive_id(index_id, self.name_hash(index_id, name))
+    
+    @reads
+    def _read_archive_files(self, index_id: int, archive_id: int, file_ids: List[int], xtea: Optional[List[int]]):
+        """Read several files of one archive, decoding it once. Returns (files, crc, revision)"""
+        if self.reader is not None and self.reader.exists(index_id):
+            files = self.reader.archive_files(index_id, archive_id, xtea)
+            table = self.reader.reference_table(index_id)
+            entry = table.archives.get(archive_id) if table is not None else None
+            if files is None or entry is None:
+                return None, None, None
+            return {file_id: files.get(file_id) for file_id in file_ids}, entry.crc, entry.revision
+        
+        xtea_array = None
+        if xtea is not None:
+            xtea_array = jpype.JArray(jpype.JInt)(xtea)
+        
+        # One JVM call for all files of the archive
+        with jvm_call("data"):
+            data = self.cache_library.data(index_id, archive_id, jpype.JArray(jpype.JInt)(file_ids), xtea_array)
+        archive = self.cache_library.index(index_id).archive(archive_id, True)
+        if archive is None:
+            return None, None, None
+        files = {file_id: (java_to_bytes(data[i]) if data[i] is not None else None) for i, file_id in enumerate(file_ids)}
+        return files, int(archive.crc), int(archive.revision)
+    
+    def iter_many(self, requests: Sequence[Tuple[int, int, int, Optional[List[int]]]]) -> Iterator[dict]:
+        """Read many (index_id, archive_id, file_id, xtea) tuples, yielding results in request order.
+
+        Requests are grouped per archive so each archive is read and decompressed once; a group
+        is decoded when its first request is reached and released after its last one.
+        """
+        groups: Dict[tuple, List[int]] = {}
+        remaining: Dict[tuple, int] = {}
+        for index_id, archive_id, file_id, xtea in requests:
+            key = (index_id, archive_id, tuple(xtea) if xtea is not None else None)
+            if key not in groups:
+                self.hot_set.record(index_id, archive_id)
+            groups.setdefault(key, []).append(file_id)
+            remaining[key] = remaining.get(key, 0) + 1
+        
+        decoded: Dict[tuple, dict] = {}
+        for index_id, archive_id, file_id, xtea in requests:
+            key = (index_id, archive_id, tuple(xtea) if xtea is not None else None)
+            cached = self.file_cache.get(FileCache.key(index_id, archive_id, file_id, xtea)) if key not in decoded else None
+            if cached is not None:
+                data, crc, revision = cached
+                yield {"status": "success", "data": data, "crc": crc, "revision": revision,
+                       "index_id": index_id, "archive_id": archive_id, "file_id": file_id}
+                remaining[key] -= 1
+                continue
+            if key not in decoded:
+                try:
+                    if self.cache_library is None:
+                        decoded[key] = {"status": "error", "message": "Cache not initialized"}
+                    else:
+                        token = self.file_cache.token(index_id, archive_id)
+                        files, crc, revision = self._read_archive_files(index_id, archive_id, sorted(set(groups[key])), xtea)
+                        decoded[key] = {"status": "success", "files": files, "crc": crc, "revision": revision}
+                        for cached_file_id, cached_data in (files or {}).items():
+                            if cached_data is not None:
+                                self.file_cache.put(FileCache.key(index_id, archive_id, cached_file_id, xtea), cached_data, crc, revision, token)
+                except Exception as e:
+                    count_error("get_files", e)
+                    decoded[key] = {"status": "error", "message": f"Failed to get file data: {str(e)}"}
+            group = decoded[key]
+            
+            data = group["files"].get(file_id) if group["status"] == "success" and group["files"] is not None else None
+            if group["status"] != "success":
+                result = {"status": "error", "message": group["message"]}
+            elif data is None:
+                result = {"status": "error", "message": f"No data found for index {index_id}, archive {archive_id}, file {file_id}"}
+            else:
+                result = {"status": "success", "data": data, "crc": group["crc"], "revision": group["revision"]}
+            result.update({"index_id": index_id, "archive_id": archive_id, "file_id": file_id})
+            yield result
+            
+            remaining[key] -= 1
+            if remaining[key] == 0:
+                del decoded[key]
+    
+    def get_many(self, requests: Sequence[Tuple[int, int, int, Optional[List[int]]]]) -> List[dict]:
+        """Read many (index_id, archive_id, file_id, xtea) tuples, see iter_many"""
+        return list(self.iter_many(requests))
+    
+    def export_index(self, index_id: int, workers: int = 4, window: Optional[int] = None,
+                     xteas: Optional[Dict[int, List[int]]] = None) -> Iterator[dict]:
+        """Yield every file of an index as {"status", "archive_id", "file_id", "data"}, by archive id.
+
+        Archives are read and decompressed on a pool of workers with at most window (default
+        4 * workers) archives in flight, so memory stays bounded however large the index is.
+        An archive that cannot be decoded yields one error result with file_id None. The lock
+        is only held while reading each archive, never between results.
+
+        Files are exported as committed to disk: puts that update_index has not written yet
+        export the archive's previous contents. Each archive's file ids and container are read
+        under one lock, so an update committed during the export never mixes the two; archives
+        it removed are skipped.
+        """
+        if self.cache_library is None:
+            yield {"status": "error", "message": "Cache not initialized", "archive_id": None, "file_id": None}
+            return
+        try:
+            table = self._export_table(index_id)
+        except Exception as e:
+            count_error("export_index", e)
+            yield {"status": "error", "message": f"Failed to read index {index_id}: {str(e)}", "archive_id": None, "file_id": None}
+            return
+        if table is None:
+            yield {"status": "error", "message": f"Index {index_id} not found", "archive_id": None, "file_id": None}
+            return
+        
+        archive_ids = iter(sorted(table[1]))
+        # The table read at a commit count, replaced by the worker that first sees a newer commit
+        tables = [table]
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cache-export", initializer=attach_jvm_thread)
+        pending = deque()
+        
+        def submit():
+            archive_id = next(archive_ids, None)
+            if archive_id is not None:
+                xtea = xteas.get(archive_id) if xteas else None
+                pending.append((archive_id, executor.submit(self._export_archive, index_id, archive_id, tables, xtea)))
+        
+        try:
+            for _ in range(window or 4 * workers):
+                submit()
+            while pending:
+                archive_id, future = pending.popleft()
+                submit()
+                try:
+                    files = future.result()
+                except Exception as e:
+                    count_error("export_index", e)
+                    yield {"status": "error", "message": f"Failed to export archive {archive_id}: {str(e)}",
+                           "archive_id": archive_id, "file_id": None}
+                    continue
+                for file_id, data in files.items():
+                    yield {"status": "success", "archive_id": archive_id, "file_id": file_id, "data": data}
+        finally:
+            for _, future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+    
+    @reads
+    def _export_table(self, index_id: int) -> Optional[Tuple[int, Dict[int, Optional[List[int]]]]]:
+        return self._committed_table(index_id)
+    
+    def _committed_table(self, index_id: int) -> Optional[Tuple[int, Dict[int, Optional[List[int]]]]]:
+        """(commits, archive_id -> file ids) of an index as on disk; file ids are None when the JVM has to decode the archive"""
+        commits = self.commits
+        if self.reader is not None and self.reader.exists(index_id):
+            table = self.reader.reference_table(index_id)
+        elif not self.cache_library.exists(index_id):
+            return None
+        elif self.cache_library.is317():
+            return commits, {archive_id: None for archive_id in memoryview(self.cache_library.index(index_id).archiveIds()).tolist()}
+        else:
+            container = self._raw_container(255, index_id)
+            table = ReferenceTable.decode(index_id, decode_container(container)) if container is not None else None
+        if table is None:
+            return None
+        return commits, {archive_id: entry.file_ids for archive_id, entry in table.archives.items()}
+    
+    def _export_archive(self, index_id: int, archive_id: int, tables: list, xtea: Optional[List[int]]) -> Dict[int, bytes]:
+        found, file_ids, container = self._read_export_archive(index_id, archive_id, tables)
+        if not found:
+            return {}
+        if file_ids is None:
+            return self._decode_archive(index_id, archive_id, xtea)
+        if container is None:
+            raise CacheFormatError(f"No container found for archive {archive_id}")
+        # Decompression runs outside the lock and releases the GIL, so workers decode in parallel
+        return split_archive(decode_container(container, xtea), file_ids)
+    
+    @reads
+    def _read_export_archive(self, index_id: int, archive_id: int, tables: list) -> Tuple[bool, Optional[List[int]], Optional[bytes]]:
+        """Whether the archive is in the committed table, with its file ids and container read under the same lock"""
+        table = tables[0]
+        if table is None or table[0] != self.commits:
+            table = tables[0] = self._committed_table(index_id)
+        if table is None or archive_id not in table[1]:
+            return False, None, None
+        file_ids = table[1][archive_id]
+        if file_ids is None:
+            return True, None, None
+        return True, file_ids, self._raw_container(index_id, archive_id)
+    
+    @reads
+    def _decode_archive(self, index_id: int, archive_id: int, xtea: Optional[List[int]]) -> Dict[int, bytes]:
+        archive = self.cache_library.index(index_id).archive(archive_id, jpype.JArray(jpype.JInt)(xtea) if xtea is not None else None)
+        if archive is None:
+            raise CacheFormatError(f"Archive {archive_id} could not be read")
+        return {int(file.id): java_to_bytes(file.data) for file in archive.files() if file.data is not None}
+    
+    def put_file_data(self, index_id: int, archive_id: int, file_id: int, data: str, xtea: Optional[List[int]] = None):
+        """Put base64 encoded file data into the cache"""
+        try:
             # Decode base64 data
             data_bytes = base64.b64decode(data)
+        except Exception as e:
+            count_error("put_file_data", e)
+            return {"status": "error", "message": f"Failed to put file data: {str(e)}"}
+        return self.put_file_bytes(index_id, archive_id, file_id, data_bytes, xtea)
+    
+    @writes
+    def put_file_bytes(self, index_id: int, archive_id: int, file_id: int, data: bytes, xtea: Optional[List[int]] = None):
+        """Put raw file data into the cache"""
+        try:
+            if self.cache_library is None:
+                return {"status": "error", "message": "Cache not initialized"}
             
             # Convert to Java byte array
-            java_data = jpype.JArray(jpype.JByte)(data_bytes)
+            java_data = bytes_to_java(data)
             
             # Convert xtea to Java int array if provided
             xtea_array = None
@@ -108,15 +706,19 @@ class CacheLibraryAPI:
                 xtea_array = jpype.JArray(jpype.JInt)(xtea)
             
             # Put data into cache
-            self.cache_library.put(index_id, archive_id, file_id, java_data, xtea_array)
+            with jvm_call("put"):
+                self.cache_library.put(index_id, archive_id, file_id, java_data, xtea_array)
+            self.file_cache.invalidate_file(index_id, archive_id, file_id)
             
             return {
                 "status": "success",
                 "message": f"Data written to index {index_id}, archive {archive_id}, file {file_id}"
             }
         except Exception as e:
+            count_error("put_file_bytes", e)
             return {"status": "error", "message": f"Failed to put file data: {str(e)}"}
     
+    @writes
     def remove_file(self, index_id: int, archive_id: int, file_id: int):
         """Remove a file from the cache"""
         try:
@@ -125,15 +727,18 @@ class CacheLibraryAPI:
             
             # Remove file from cache
             result = self.cache_library.remove(index_id, archive_id, file_id)
+            self.file_cache.invalidate_file(index_id, archive_id, file_id)
             
             return {
                 "status": "success",
                 "message": f"File {file_id} removed from archive {archive_id} in index {index_id}",
-                "result": result
+                "result": result is not None
             }
         except Exception as e:
+            count_error("remove_file", e)
             return {"status": "error", "message": f"Failed to remove file: {str(e)}"}
     
+    @writes
     def remove_archive(self, index_id: int, archive_id: int):
         """Remove an archive from the cache"""
         try:
@@ -142,36 +747,101 @@ class CacheLibraryAPI:
             
             # Remove archive from cache
             result = self.cache_library.remove(index_id, archive_id)
+            self.file_cache.invalidate_archive(index_id, archive_id)
+            self.names.remove(index_id, archive_id)
             
             return {
                 "status": "success",
                 "message": f"Archive {archive_id} removed from index {index_id}",
-                "result": result
+                "result": result is not None
             }
         except Exception as e:
+            count_error("remove_archive", e)
+            return {"status": "error", "message": f"Failed to remove archive: {str(e)}"}
+    
+    @writes
+    def put_file_bytes_by_name(self, index_id: int, archive_name: str, file_id: int, data: bytes,
+                               xtea: Optional[List[int]] = None):
+        """Put raw file data into the archive named archive_name, adding the archive if needed"""
+        try:
+            if self.cache_library is None:
+                return {"status": "error", "message": "Cache not initialized"}
+            
+            archive_id = self.archive_id(index_id, archive_name)
+            if archive_id is None:
+                xtea_array = jpype.JArray(jpype.JInt)(xtea) if xtea is not None else None
+                archive = self.cache_library.index(index_id).add(archive_name, xtea_array)
+                archive_id = int(archive.id)
+                self.names.add(index_id, int(archive.hashName), archive_id)
+            
+            result = self.put_file_bytes(index_id, archive_id, file_id, data, xtea)
+            result["archive_id"] = archive_id
+            return result
+        except Exception as e:
+            count_error("put_file_bytes_by_name", e)
+            return {"status": "error", "message": f"Failed to put file data: {str(e)}"}
+    
+    @writes
+    def remove_archive_by_name(self, index_id: int, archive_name: str):
+        """Remove the archive named archive_name from the cache"""
+        try:
+            if self.cache_library is None:
+                return {"status": "error", "message": "Cache not initialized"}
+            
+            archive_id = self.archive_id(index_id, archive_name)
+            if archive_id is None:
+                return {"status": "error", "message": f"Archive {archive_name} not found in index {index_id}"}
+            
+            result = self.remove_archive(index_id, archive_id)
+            result["archive_id"] = archive_id
+            return result
+        except Exception as e:
+            count_error("remove_archive_by_name", e)
             return {"status": "error", "message": f"Failed to remove archive: {str(e)}"}
     
     def update_index(self, index_id: int):
-        """Update/write changes to an index"""
+        """Update/write changes to an index.
+
+        Concurrent updates are batched, so a caller whose changes were already written by
+        another caller's update does not rewrite the index again.
+        """
         try:
             if self.cache_library is None:
                 return {"status": "error", "message": "Cache not initialized"}
             
-            # Get index and update
+            # Get index
+            attach_jvm_thread()
             index = self.cache_library.index(index_id)
             if index is None:
                 return {"status": "error", "message": f"Index {index_id} not found"}
             
-            result = index.update()
+            self.committer.commit([index_id])
             
             return {
                 "status": "success",
                 "message": f"Index {index_id} updated successfully",
-                "result": result
+                "result": True
             }
         except Exception as e:
+            count_error("update_index", e)
             return {"status": "error", "message": f"Failed to update index: {str(e)}"}
     
+    @writes
+    def _update_indices(self, index_ids, listener=None):
+        """Write the flagged archives and reference tables of index_ids, see GroupCommitter"""
+        for index_id in sorted(index_ids):
+            index = self.cache_library.index(index_id)
+            flagged = [int(archive.id) for archive in index.flaggedArchives()]
+            with jvm_call("update"):
+                index.update(listener)
+            self.commits += 1
+            if self.sector_map is not None:
+                # Archives removed since the last update are gone from the written reference table
+                self.sector_map.retain(index_id, memoryview(index.archiveIds()).tolist())
+            for archive_id in flagged:
+                self.file_cache.invalidate_archive(index_id, archive_id)
+    
+    @writes
     def add_archive(self, index_id: int, archive_name: Optional[str] = None):
         """Add a new archive to an index"""
         try:
@@ -188,6 +858,9 @@ class CacheLibraryAPI:
                 new_archive = index.add(archive_name)
             else:
                 new_archive = index.add()
+            if new_archive is not None:
+                self.file_cache.invalidate_archive(index_id, int(new_archive.id))
+                self.names.add(index_id, int(new_archive.hashName), int(new_archive.id))
             
             return {
                 "status": "success",
@@ -195,44 +868,611 @@ class CacheLibraryAPI:
                 "archive_id": new_archive.id if new_archive else None
             }
         except Exception as e:
+            count_error("add_archive", e)
             return {"status": "error", "message": f"Failed to add archive: {str(e)}"}
     
-    def rebuild_cache(self, output_path: str):
-        """Rebuild/defragment the cache"""
+    def begin_transaction(self, auto_flush_bytes: Optional[int] = None, auto_flush_seconds: Optional[float] = None):
+        """Start a transaction that stages puts and removes until it is committed.
+
+        The staged writes are flushed early once they hold auto_flush_bytes of data, or
+        auto_flush_seconds after the first write staged since the last flush. Flushed writes
+        are on disk and are not undone by abort_transaction.
+        """
+        if self.cache_library is None:
+            return {"status": "error", "message": "Cache not initialized"}
+        transaction = self.transactions.begin(auto_flush_bytes, auto_flush_seconds)
+        return {"status": "success", "message": f"Transaction {transaction.id} started", "transaction_id": transaction.id}
+    
+    def stage_put(self, transaction_id: str, index_id: int, archive_id: int, file_id: int, data: bytes,
+                  xtea: Optional[List[int]] = None):
+        """Stage raw file data to be written when the transaction is committed"""
+        return self._stage(transaction_id, StagedWrite(index_id, archive_id, file_id, bytes(data), xtea))
+    
+    def stage_remove(self, transaction_id: str, index_id: int, archive_id: int, file_id: Optional[int] = None):
+        """Stage removal of a file, or of the whole archive when file_id is None"""
+        return self._stage(transaction_id, StagedWrite(index_id, archive_id, file_id))
+    
+    def _stage(self, transaction_id: str, write: StagedWrite):
+        try:
+            transaction = self.transactions.get(transaction_id)
+            if transaction.stage(write, functools.partial(self._auto_flush, transaction)):
+                self._flush(transaction)
+            return {"status": "success", **transaction.info()}
+        except TransactionError as e:
+            return {"status": "error", "message": str(e)}
+        except Exception as e:
+            count_error("stage_write", e)
+            return {"status": "error", "message": f"Failed to stage write: {str(e)}"}
+    
+    def commit_transaction(self, transaction_id: str):
+        """Apply all staged writes and update every touched index once"""
+        try:
+            transaction = self.transactions.get(transaction_id)
+            self._flush(transaction)
+            self.transactions.finish(transaction, "committed")
+            return {"status": "success", "message": f"Transaction {transaction_id} committed", **transaction.info()}
+        except TransactionError as e:
+            return {"status": "error", "message": str(e)}
+        except Exception as e:
+            count_error("commit_transaction", e)
+            return {"status": "error", "message": f"Failed to commit transaction: {str(e)}"}
+    
+    def abort_transaction(self, transaction_id: str):
+        """Discard the writes staged since the last flush"""
+        try:
+            transaction = self.transactions.get(transaction_id)
+            discarded = len(transaction.drain())
+            self.transactions.finish(transaction, "aborted")
+            return {
+                "status": "success",
+                "message": f"Transaction {transaction_id} aborted, {discarded} staged writes discarded",
+                **transaction.info()
+            }
+        except TransactionError as e:
+            return {"status": "error", "message": str(e)}
+    
+    def transaction_info(self, transaction_id: str):
+        try:
+            return {"status": "success", **self.transactions.get(transaction_id).info()}
+        except TransactionError as e:
+            return {"status": "error", "message": str(e)}
+    
+    def _auto_flush(self, transaction):
+        try:
+            self._flush(transaction)
+        except Exception:
+            logging.getLogger(__name__).exception("Auto-flush of transaction %s failed", transaction.id)
+    
+    def _flush(self, transaction):
+        """Apply the staged writes of transaction and commit the indices they touched"""
+        with transaction.flush_lock:
+            writes = transaction.drain()
+            if not writes:
+                return
+            try:
+                index_ids = self._apply_writes(writes)
+                self.committer.commit(index_ids)
+            except Exception:
+                # Part of the batch may have been applied, so the transaction cannot continue
+                self.transactions.finish(transaction, "failed")
+                raise
+            transaction.flushes += 1
+            transaction.flushed_writes += len(writes)
+        for listener in self.commit_listeners:
+            listener()
+    
+    @writes
+    def _apply_writes(self, writes):
+        if self.cache_library is None:
+            raise RuntimeError("Cache not initialized")
+        index_ids = set()
+        for write in writes:
+            if write.data is not None:
+                xtea_array = jpype.JArray(jpype.JInt)(write.xtea) if write.xtea is not None else None
+                with jvm_call("put"):
+                    self.cache_library.put(write.index_id, write.archive_id, write.file_id, bytes_to_java(write.data), xtea_array)
+                self.file_cache.invalidate_file(write.index_id, write.archive_id, write.file_id)
+            elif write.file_id is None:
+                self.cache_library.remove(write.index_id, write.archive_id)
+                self.file_cache.invalidate_archive(write.index_id, write.archive_id)
+                self.names.remove(write.index_id, write.archive_id)
+            else:
+                self.cache_library.remove(write.index_id, write.archive_id, write.file_id)
+                self.file_cache.invalidate_file(write.index_id, write.archive_id, write.file_id)
+            index_ids.add(write.index_id)
+        return index_ids
+    
+    def start_import(self, index_id: int, path: str, workers: int = 4, chunk_size: int = 64):
+        """Start a background job running import_tree"""
         try:
             if self.cache_library is None:
                 return {"status": "error", "message": "Cache not initialized"}
+            if not os.path.isdir(path):
+                return {"status": "error", "message": f"{path} is not a directory"}
             
-            # Import Java File class
-            from java.io import File
+            job = self.jobs.submit("import", self._run_import, index_id, path, workers, chunk_size,
+                                   description=f"Import {path} into index {index_id}")
+            return {"status": "success", "message": f"Import job {job.id} started", "job_id": job.id}
+        except Exception as e:
+            count_error("start_import", e)
+            return {"status": "error", "message": f"Failed to start import: {str(e)}"}
+    
+    def _run_import(self, job, index_id: int, path: str, workers: int, chunk_size: int):
+        result = self.import_tree(index_id, path, workers, chunk_size, job)
+        if result["status"] != "success":
+            raise RuntimeError(result["message"])
+        return {key: value for key, value in result.items() if key not in ("status", "message")}
+    
+    def import_tree(self, index_id: int, path: str, workers: int = 4, chunk_size: int = 64, job=None):
+        """Import a directory tree of <archive_id>/<file_id> files into an index and commit it once.
+
+        Archives are handled chunk_size at a time: their files are read from disk and the new
+        containers are merged with the existing files and compressed on a pool of workers, so the
+        write lock is only held to hand the files and containers to the library. Index.update then
+        writes the precompressed containers instead of compressing each archive itself.
+
+        A cancelled or failed import leaves the archives of earlier chunks modified but not written;
+        use update_index to write them or reload to discard them.
+        """
+        try:
+            if self.cache_library is None:
+                return {"status": "error", "message": "Cache not initialized"}
+            if not self._index_exists(index_id):
+                return {"status": "error", "message": f"Index {index_id} not found"}
+            plan = self._import_plan(path)
+            if not plan:
+                return {"status": "error", "message": f"No <archive_id>/<file_id> files found in {path}"}
             
-            # Create output directory
-            output_file = File(output_path)
+            start = time.perf_counter()
+            total = sum(len(files) for _, files in plan)
+            stats = {"archives": 0, "files": 0, "bytes": 0, "precompressed": 0}
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cache-import",
+                                    initializer=attach_jvm_thread) as executor:
+                for offset in range(0, len(plan), chunk_size):
+                    chunk = plan[offset:offset + chunk_size]
+                    archive_ids = [archive_id for archive_id, _ in chunk]
+                    files = list(executor.map(self._read_import_files, [paths for _, paths in chunk]))
+                    bases = self._import_bases(index_id, archive_ids)
+                    containers = list(executor.map(self._compress_import, [bases[archive_id][1] for archive_id in archive_ids],
+                                                   [bases[archive_id][2] for archive_id in archive_ids], files))
+                    stats["precompressed"] += self._import_archives(index_id, archive_ids, files, bases, containers)
+                    stats["archives"] += len(chunk)
+                    stats["files"] += sum(len(archive_files) for archive_files in files)
+                    stats["bytes"] += sum(len(data) for archive_files in files for data in archive_files.values())
+                    if job is not None:
+                        elapsed = time.perf_counter() - start
+                        job.update(0.9 * stats["files"] / total,
+                                   f"Imported {stats['files']} of {total} files, {stats['bytes'] / elapsed / 1e6:.1f} MB/s")
             
-            # Rebuild cache
-            self.cache_library.rebuild(output_file)
+            listener = progress_listener(job, 0.9, 0.1, cancellable=False) if job is not None else None
+            self._update_indices([index_id], listener)
+            for commit_listener in self.commit_listeners:
+                commit_listener()
             
-            return {
-                "status": "success",
-                "message": f"Cache rebuilt to {output_path}"
-            }
+            stats["seconds"] = round(time.perf_counter() - start, 3)
+            stats["mb_per_second"] = round(stats["bytes"] / stats["seconds"] / 1e6, 2) if stats["seconds"] else None
+            return {"status": "success", "message": f"Imported {stats['files']} files into index {index_id}", **stats}
+        except JobCancelled:
+            raise
+        except Exception as e:
+            count_error("import_tree", e)
+            return {"status": "error", "message": f"Failed to import {path}: {str(e)}"}
+    
+    @reads
+    def _index_exists(self, index_id: int) -> bool:
+        return bool(self.cache_library.exists(index_id))
+    
+    @staticmethod
+    def _import_plan(path: str) -> List[Tuple[int, List[Tuple[int, str]]]]:
+        """[(archive_id, [(file_id, file path)])] of the numerically named directories and files under path"""
+        def numeric(name):
+            stem = name.split('.', 1)[0]
+            return int(stem) if stem.isdigit() else None
+        
+        plan = []
+        for archive_entry in os.scandir(path):
+            archive_id = numeric(archive_entry.name)
+            if archive_id is None or not archive_entry.is_dir():
+                continue
+            files = [(numeric(entry.name), entry.path) for entry in os.scandir(archive_entry.path)
+                     if entry.is_file() and numeric(entry.name) is not None]
+            if files:
+                plan.append((archive_id, sorted(files)))
+        return sorted(plan)
+    
+    @staticmethod
+    def _read_import_files(paths: List[Tuple[int, str]]) -> Dict[int, bytes]:
+        files = {}
+        for file_id, path in paths:
+            with open(path, 'rb') as f:
+                files[file_id] = f.read()
+        return files
+    
+    @reads
+    def _import_bases(self, index_id: int, archive_ids: List[int]) -> Dict[int, tuple]:
+        """archive_id -> (file cache token, current files, compression type); files are None when the
+        library has to compress the archive itself (317 caches, encrypted or unreadable archives)"""
+        index = self.cache_library.index(index_id)
+        is317 = bool(self.cache_library.is317())
+        bases = {}
+        for archive_id in archive_ids:
+            token = self.file_cache.token(index_id, archive_id)
+            archive = index.archive(archive_id) if not is317 else None
+            if is317:
+                bases[archive_id] = (token, None, None)
+            elif archive is None:
+                bases[archive_id] = (token, {}, COMPRESSION_GZIP)
+            elif archive.getXtea() is not None and any(key != 0 for key in archive.getXtea()):
+                bases[archive_id] = (token, None, None)
+            else:
+                files = {int(file.id): file.data for file in archive.files()}
+                if any(data is None for data in files.values()):
+                    bases[archive_id] = (token, None, None)
+                else:
+                    bases[archive_id] = (token, {file_id: java_to_bytes(data) for file_id, data in files.items()},
+                                         int(archive.compressionType.ordinal()))
+        return bases
+    
+    @staticmethod
+    def _compress_import(current: Optional[Dict[int, bytes]], compression: Optional[int], files: Dict[int, bytes]) -> Optional[bytes]:
+        if current is None:
+            return None
+        merged = dict(current)
+        merged.update(files)
+        return encode_container(encode_archive(merged), compression)
+    
+    @writes
+    def _import_archives(self, index_id: int, archive_ids: List[int], files: List[Dict[int, bytes]],
+                         bases: Dict[int, tuple], containers: List[Optional[bytes]]) -> int:
+        precompressed = 0
+        for archive_id, archive_files, container in zip(archive_ids, files, containers):
+            # A write since _import_bases read the archive makes the container stale
+            unchanged = self.file_cache.token(index_id, archive_id) == bases[archive_id][0]
+            self._apply_writes([StagedWrite(index_id, archive_id, file_id, data) for file_id, data in archive_files.items()])
+            if container is not None and unchanged:
+                archive = self.cache_library.index(index_id).archive(archive_id, True)
+                if archive is not None and archive.flagged():
+                    archive.setPrecompressed(bytes_to_java(container))
+                    precompressed += 1
+        return precompressed
+    
+    def rebuild_cache(self, output_path: str, incremental: bool = False):
+        """Rebuild/defragment the cache.
+
+        With incremental, only the indices whose reference table CRC changed since the last rebuild
+        to output_path are copied; the first rebuild to a directory is always a full one.
+        """
+        try:
+            if self.cache_library is None:
+                return {"status": "error", "message": "Cache not initialized"}
+            
+            return {"status": "success", **self._rebuild(output_path, incremental)}
         except Exception as e:
+            count_error("rebuild_cache", e)
             return {"status": "error", "message": f"Failed to rebuild cache: {str(e)}"}
     
-    def close(self):
-        """Close the cache library and shutdown JVM"""
+    def start_rebuild(self, output_path: str, incremental: bool = False):
+        """Start a background job running rebuild_cache.
+
+        Cancelling the job stops the rebuild at its next progress report and leaves output_path half
+        written; the next incremental rebuild to it copies the unfinished indices again. Rebuilds in
+        place can not be cancelled.
+        """
         try:
-            if self.cache_library is not None:
-                self.cache_library.close()
-                self.cache_library = None
+            if self.cache_library is None:
+                return {"status": "error", "message": "Cache not initialized"}
+            if incremental and self._same_path(output_path, self.path):
+                return {"status": "error", "message": "Incremental rebuilds need an output directory other than the cache"}
             
-            if self._jvm_started and jpype.isJVMStarted():
-                jpype.shutdownJVM()
-                self._jvm_started = False
+            mode = "Incremental rebuild" if incremental else "Rebuild"
+            job = self.jobs.submit("rebuild", self._run_rebuild, output_path, incremental,
+                                   description=f"{mode} of {self.path} to {output_path}")
+            return {"status": "success", "message": f"Rebuild job {job.id} started", "job_id": job.id}
+        except Exception as e:
+            count_error("start_rebuild", e)
+            return {"status": "error", "message": f"Failed to start rebuild: {str(e)}"}
+    
+    def _run_rebuild(self, job, output_path: str, incremental: bool):
+        result = self._rebuild(output_path, incremental, job)
+        if self._same_path(output_path, self.path):
+            for commit_listener in self.commit_listeners:
+                commit_listener()
+        return result
+    
+    @staticmethod
+    def _same_path(a: str, b: str) -> bool:
+        return os.path.realpath(a) == os.path.realpath(b)
+    
+    def _rebuild(self, output_path: str, incremental: bool, job=None) -> dict:
+        from java.io import File
+        
+        # Rebuilding only reads the current cache, so only writes wait for it unless it is rebuilt in place.
+        # A freeze instead of the read lock, as a write waiting for the read lock holds back every read
+        in_place = self._same_path(output_path, self.path)
+        if incremental and in_place:
+            raise ValueError("Incremental rebuilds need an output directory other than the cache")
+        manifest_path = os.path.join(output_path, REBUILD_MANIFEST_FILE_NAME)
+        start = time.perf_counter()
+        attach_jvm_thread()
+        with (self.lock.write() if in_place else self.lock.freeze()):
+            checksums = {index_id: crc for index_id, (crc, _) in enumerate(self._index_checksums()) if crc}
+            index_ids = None
+            if incremental and not self.cache_library.is317():
+                previous = self._load_rebuild_manifest(output_path)
+                if previous is not None:
+                    index_ids = sorted(index_id for index_id, crc in checksums.items() if previous.get(index_id) != crc)
+            if index_ids == []:
+                return {"message": f"Cache at {output_path} is up to date", "incremental": True, "indices": [],
+                        "seconds": round(time.perf_counter() - start, 3)}
             
-            return {"status": "success", "message": "Cache library closed"}
+            listener = progress_listener(job, cancellable=not in_place) if job is not None else None
+            with jvm_call("rebuild"):
+                self.cache_library.rebuild(File(output_path), listener,
+                                           jpype.JArray(jpype.JInt)(index_ids) if index_ids is not None else None)
+            if index_ids is not None:
+                differences = compare_caches(self.path, output_path, index_ids)
+                if differences:
+                    # The next rebuild to output_path is a full one
+                    os.remove(manifest_path)
+                    raise RuntimeError(f"Incremental rebuild to {output_path} differs from the cache: "
+                                       + "; ".join(differences[:10]))
+            if in_place:
+                # Rebuilding in place rewrites every archive
+                self.commits += 1
+                self.file_cache.clear()
+                self.names.clear()
+                self._open_sector_map()
+            else:
+                with open(manifest_path, "w") as f:
+                    json.dump({"source": os.path.realpath(self.path),
+                               "indices": {str(index_id): crc for index_id, crc in checksums.items()}}, f)
+            rebuilt = index_ids if index_ids is not None else [int(index_id) for index_id in self.cache_library.indexIds()]
+        return {"message": f"Cache rebuilt to {output_path}", "incremental": index_ids is not None,
+                "indices": rebuilt, "seconds": round(time.perf_counter() - start, 3)}
+    
+    def _load_rebuild_manifest(self, output_path: str) -> Optional[Dict[int, int]]:
+        """Reference table CRCs per index of the last rebuild of this cache to output_path, if any"""
+        if not all(os.path.exists(os.path.join(output_path, f"{CACHE_FILE_NAME}.{extension}")) for extension in ("dat2", "idx255")):
+            return None
+        try:
+            with open(os.path.join(output_path, REBUILD_MANIFEST_FILE_NAME)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("source") != os.path.realpath(self.path):
+            return None
+        return {int(index_id): crc for index_id, crc in manifest.get("indices", {}).items()}
+    
+    @writes
+    def reload(self):
+        """Re-read the cache from disk, e.g. after another process committed changes"""
+        try:
+            if self.cache_library is None:
+                return {"status": "error", "message": "Cache not initialized"}
+            
+            self.cache_library.reload()
+            if self.reader is not None:
+                self.reader.reload()
+            self.commits += 1
+            self.file_cache.clear()
+            self.names.clear()
+            self._open_sector_map()
+            
+            return {"status": "success", "message": f"Cache reloaded from {self.path}"}
         except Exception as e:
+            count_error("reload", e)
+            return {"status": "error", "message": f"Failed to reload cache: {str(e)}"}
+    
+    def start_warm_up(self, indices: Optional[List[int]] = None, archives: Optional[Dict[int, List[int]]] = None,
+                      use_hot_set: bool = False, chunk_size: int = 256):
+        """Start a background job that reads and decodes archives ahead of requests.
+
+        Warms all archives of indices, the archive ids per index in archives, and/or the hot set
+        saved by save_hot_set. The job works in chunks of chunk_size archives and only holds the
+        read lock for one chunk at a time, so writers are not starved.
+        """
+        try:
+            if self.cache_library is None:
+                return {"status": "error", "message": "Cache not initialized"}
+            
+            plan: Dict[int, Optional[List[int]]] = {}
+            if use_hot_set:
+                path = self.hot_set_path()
+                if not os.path.exists(path):
+                    return {"status": "error", "message": f"No hot set recorded at {path}"}
+                plan.update(HotSet.load(path))
+            for index_id, archive_ids in (archives or {}).items():
+                plan[int(index_id)] = sorted(set(plan.get(int(index_id)) or []) | {int(archive_id) for archive_id in archive_ids})
+            for index_id in indices or []:
+                plan[int(index_id)] = None
+            if not plan:
+                return {"status": "error", "message": "Nothing to warm up, pass indices, archives or use_hot_set"}
+            
+            description = f"Warm up indices {sorted(plan)}"
+            job = self.jobs.submit("warm", self._warm_up, plan, chunk_size, description=description)
+            return {"status": "success", "message": f"Warm-up job {job.id} started", "job_id": job.id}
+        except Exception as e:
+            count_error("start_warm_up", e)
+            return {"status": "error", "message": f"Failed to start warm-up: {str(e)}"}
+    
+    def _warm_up(self, job, plan: Dict[int, Optional[List[int]]], chunk_size: int):
+        work = []
+        for index_id, archive_ids in sorted(plan.items()):
+            existing = self._archive_ids(index_id)
+            if archive_ids is None:
+                archive_ids = existing
+            else:
+                # Hot sets may name archives that have since been removed
+                existing = set(existing)
+                archive_ids = [archive_id for archive_id in archive_ids if archive_id in existing]
+            if archive_ids:
+                work.append((index_id, archive_ids))
+        total = sum(len(archive_ids) for _, archive_ids in work)
+        done = 0
+        for index_id, archive_ids in work:
+            for offset in range(0, len(archive_ids), chunk_size):
+                chunk = archive_ids[offset:offset + chunk_size]
+                self._cache_archives(job, index_id, chunk, done / total, len(chunk) / total)
+                done += len(chunk)
+        return {"indices": [index_id for index_id, _ in work], "archives": done}
+    
+    @reads
+    def _archive_ids(self, index_id: int) -> List[int]:
+        if self.reader is not None and self.reader.exists(index_id):
+            table = self.reader.reference_table(index_id)
+            return table.archive_ids() if table is not None else []
+        if self.cache_library is None or not self.cache_library.exists(index_id):
+            return []
+        return memoryview(self.cache_library.index(index_id).archiveIds()).tolist()
+    
+    @reads
+    def _cache_archives(self, job, index_id: int, archive_ids: List[int], start: float, share: float):
+        if self.cache_library is None:
+            raise RuntimeError("Cache not initialized")
+        if self.reader is not None and self.reader.exists(index_id):
+            # Reads are served from the mmap reader and never reach the library's archive cache,
+            # so fault the archives' sectors into the page cache instead
+            for archive_id in archive_ids:
+                self.reader.touch(index_id, archive_id)
+            job.update(start + share, f"Read {len(archive_ids)} archives of index {index_id}")
+            return
+        listener = progress_listener(job, start, share)
+        self.cache_library.index(index_id).cache(jpype.JArray(jpype.JInt)(archive_ids), listener)
+    
+    def job_status(self, job_id: str):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return {"status": "error", "message": f"Job {job_id} not found"}
+        return {"status": "success", **job.info()}
+    
+    def cancel_job(self, job_id: str):
+        job = self.jobs.cancel(job_id)
+        if job is None:
+            return {"status": "error", "message": f"Job {job_id} not found"}
+        return {"status": "success", "message": f"Job {job_id} cancellation requested", **job.info()}
+    
+    def hot_set_path(self) -> str:
+        return os.path.join(self.path, "hot_set.json")
+    
+    def save_hot_set(self, limit: Optional[int] = None):
+        """Save the most read archives next to the cache, for start_warm_up(use_hot_set=True)"""
+        try:
+            if self.path is None:
+                return {"status": "error", "message": "Cache not initialized"}
+            count = self.hot_set.save(self.hot_set_path(), limit)
+            return {"status": "success", "message": f"Saved {count} archives to {self.hot_set_path()}", "archives": count}
+        except Exception as e:
+            count_error("save_hot_set", e)
+            return {"status": "error", "message": f"Failed to save hot set: {str(e)}"}
+    
+    def readiness(self):
+        """Whether a cache is initialized, and which of its indices have been loaded.
+
+        Deliberately takes no lock, so it answers while a long write is in progress.
+        """
+        try:
+            if self.cache_library is None:
+                return {"status": "error", "ready": False, "message": "Cache not initialized"}
+            
+            attach_jvm_thread()
+            cache_library = self.cache_library
+            index_ids = memoryview(cache_library.indexIds()).tolist()
+            result = {
+                "status": "success",
+                "ready": True,
+                "lazy": bool(cache_library.getLazy()),
+                "indices": index_ids,
+                "loaded_indices": [index_id for index_id in index_ids if cache_library.loaded(index_id)]
+            }
+            reader = self.reader
+            if reader is not None:
+                result["reader_loaded_indices"] = reader.loaded_index_ids()
+                result["snapshot"] = {
+                    "loaded": reader.snapshot is not None,
+                    "hits": reader.snapshot_hits,
+                    "misses": reader.snapshot_misses
+                }
+            return result
+        except Exception as e:
+            count_error("readiness", e)
+            return {"status": "error", "ready": False, "message": f"Failed to check readiness: {str(e)}"}
+    
+    def cache_stats(self):
+        """Counters of the decoded file cache, the lock, transactions and batched index updates"""
+        return {
+            "status": "success",
+            "file_cache": self.file_cache.stats(),
+            "lock": self.lock.stats(),
+            "names": self.names.stats(),
+            "hot_set": {"archives": len(self.hot_set)},
+            "jobs": [job.info() for job in self.jobs.running()],
+            "transactions": self.transactions.stats(),
+            "index_updates": self.committer.stats(),
+            "sectors": self.sector_map.stats() if self.sector_map is not None else None
+        }
+
+    def jvm_stats(self):
+        """Heap usage and garbage collector counters of the JVM, or None if it is not running"""
+        if not jpype.isJVMStarted():
+            return None
+        attach_jvm_thread()
+        from java.lang.management import ManagementFactory
+
+        heap = ManagementFactory.getMemoryMXBean().getHeapMemoryUsage()
+        return {
+            "heap": {"used": int(heap.getUsed()), "committed": int(heap.getCommitted()), "max": int(heap.getMax())},
+            "gc": [{"name": str(gc.getName()),
+                    "collections": max(int(gc.getCollectionCount()), 0),
+                    "seconds": max(int(gc.getCollectionTime()), 0) / 1000.0}
+                   for gc in ManagementFactory.getGarbageCollectorMXBeans()]
+        }
+
+    def close(self):
+        """Close the cache library and shutdown JVM.
+
+        Background jobs are cancelled and waited for first, as they may hold the read lock or use
+        the reader and the JVM.
+        """
+        try:
+            self.jobs.shutdown(wait=True)
+            attach_jvm_thread()
+            with self.lock.write():
+                return self._close()
+        except Exception as e:
+            count_error("close", e)
             return {"status": "error", "message": f"Failed to close cache library: {str(e)}"}
+    
+    def _close(self):
+        if self.path is not None and len(self.hot_set):
+            try:
+                # Kept for warming up the next run with start_warm_up(use_hot_set=True)
+                self.hot_set.save(self.hot_set_path())
+            except OSError:
+                pass
+        if self.sector_map is not None:
+            try:
+                # Saves the next start a scan, as long as nothing else changes the cache files
+                self.sector_map.save(self.sector_map_path(), self.path)
+            except OSError:
+                pass
+            self.sector_map = None
+        
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        
+        if self.cache_library is not None:
+            self.cache_library.close()
+            self.cache_library = None
+        self.file_cache.clear()
+        self.names.clear()
+        self.transactions.clear()
+        
+        if self._jvm_started and jpype.isJVMStarted():
+            jpype.shutdownJVM()
+            self._jvm_started = False
+        
+        return {"status": "success", "message": "Cache library closed"}
 
 
 # Example usage
@@ -0,0 +1,368 @@
+"""
+RuneScape Cache Format Helpers
+This module implements the on-disk structures of dat2/idx caches (sectors, containers,
+reference tables and multi-file archives) in pure Python, mirroring the Kotlin library.
+"""
+
+import bz2
+import gzip
+import lzma
+import struct
+import zlib
+from typing import Dict, List, Optional, Sequence
+
+
+CACHE_FILE_NAME = "main_file_cache"
+
+INDEX_SIZE = 6
+SECTOR_SIZE = 520
+SECTOR_HEADER_SIZE_SMALL = 8
+SECTOR_DATA_SIZE_SMALL = 512
+SECTOR_HEADER_SIZE_BIG = 10
+SECTOR_DATA_SIZE_BIG = 510
+
+COMPRESSION_NONE = 0
+COMPRESSION_BZIP2 = 1
+COMPRESSION_GZIP = 2
+COMPRESSION_LZMA = 3
+
+FLAG_NAME = 0x1
+FLAG_WHIRLPOOL = 0x2
+FLAG_LENGTHS = 0x4
+FLAG_CHECKSUMS = 0x8
+
+WHIRLPOOL_SIZE = 64
+
+_XTEA_DELTA = 0x9E3779B9
+_XTEA_ROUNDS = 32
+
+
+class CacheFormatError(Exception):
+    """Raised when on-disk cache data cannot be decoded"""
+
+
+def java_string_hash(name: str) -> int:
+    """Return Java's String.hashCode() for name, as used by ReferenceTable.toHash"""
+    h = 0
+    for char in name:
+        h = (31 * h + ord(char)) & 0xFFFFFFFF
+    return h - 0x100000000 if h & 0x80000000 else h
+
+
+def to_signed(value: int) -> int:
+    """Interpret an unsigned 32-bit value as a signed Java int"""
+    value &= 0xFFFFFFFF
+    return value - 0x100000000 if value & 0x80000000 else value
+
+
+def crc32(data) -> int:
+    """CRC32 as computed by the library's generateCrc (signed Java int)"""
+    return to_signed(zlib.crc32(data))
+
+
+def has_xtea(keys: Optional[Sequence[int]]) -> bool:
+    """Whether keys is a non-empty, non-zero XTEA key set"""
+    return keys is not None and any(k != 0 for k in keys)
+
+
+def xtea_decrypt(data, keys: Sequence[int], start: int, end: int) -> bytearray:
+    """Decrypt the whole 8-byte blocks of data[start:end] with the given XTEA keys"""
+    out = bytearray(data)
+    k = [key & 0xFFFFFFFF for key in keys]
+    blocks = (end - start) // 8
+    for block in range(blocks):
+        offset = start + block * 8
+        v0, v1 = struct.unpack_from(">II", out, offset)
+        total = (_XTEA_DELTA * _XTEA_ROUNDS) & 0xFFFFFFFF
+        for _ in range(_XTEA_ROUNDS):
+            v1 = (v1 - ((((v0 << 4) ^ (v0 >> 5)) + v0) ^ (total + k[(total >> 11) & 3]))) & 0xFFFFFFFF
+            total = (total - _XTEA_DELTA) & 0xFFFFFFFF
+            v0 = (v0 - ((((v1 << 4) ^ (v1 >> 5)) + v1) ^ (total + k[total & 3]))) & 0xFFFFFFFF
+        struct.pack_into(">II", out, offset, v0, v1)
+    return out
+
+
+def xtea_encrypt(data, keys: Sequence[int], start: int, end: int) -> bytearray:
+    """Encrypt the whole 8-byte blocks of data[start:end] with the given XTEA keys"""
+    out = bytearray(data)
+    k = [key & 0xFFFFFFFF for key in keys]
+    blocks = (end - start) // 8
+    for block in range(blocks):
+        offset = start + block * 8
+        v0, v1 = struct.unpack_from(">II", out, offset)
+        total = 0
+        for _ in range(_XTEA_ROUNDS):
+            v0 = (v0 + ((((v1 << 4) ^ (v1 >> 5)) + v1) ^ (total + k[total & 3]))) & 0xFFFFFFFF
+            total = (total + _XTEA_DELTA) & 0xFFFFFFFF
+            v1 = (v1 + ((((v0 << 4) ^ (v0 >> 5)) + v0) ^ (total + k[(total >> 11) & 3]))) & 0xFFFFFFFF
+        struct.pack_into(">II", out, offset, v0, v1)
+    return out
+
+
+def decode_container(data, xtea: Optional[Sequence[int]] = None) -> bytes:
+    """Decompress a stored archive container (compression header, payload, optional revision)"""
+    if len(data) < 5:
+        raise CacheFormatError("Container is too short")
+    compression, compressed_size = struct.unpack_from(">Bi", data, 0)
+    header_size = 5 if compression == COMPRESSION_NONE else 9
+    if compressed_size < 0 or header_size + compressed_size > len(data):
+        raise CacheFormatError(f"Invalid container length {compressed_size}")
+    if has_xtea(xtea):
+        data = xtea_decrypt(data, xtea, 5, header_size + compressed_size)
+    if compression == COMPRESSION_NONE:
+        return bytes(data[5:5 + compressed_size])
+    decompressed_size = struct.unpack_from(">i", data, 5)[0]
+    payload = memoryview(data)[9:9 + compressed_size]
+    if compression == COMPRESSION_GZIP:
+        if payload[0] != 0x1F or payload[1] != 0x8B:
+            raise CacheFormatError("Invalid GZIP header")
+        result = zlib.decompressobj(-zlib.MAX_WBITS).decompress(payload[10:], decompressed_size)
+    elif compression == COMPRESSION_BZIP2:
+        result = bz2.decompress(b"BZh1" + payload)
+    elif compression == COMPRESSION_LZMA:
+        header = bytes(payload[:5]) + struct.pack("<q", decompressed_size)
+        result = lzma.LZMADecompressor(format=lzma.FORMAT_ALONE).decompress(header + payload[5:])
+    else:
+        raise CacheFormatError(f"Unknown compression type {compression}")
+    if len(result) != decompressed_size:
+        raise CacheFormatError(f"Decompressed {len(result)} bytes, expected {decompressed_size}")
+    return result
+
+
+# LZMA settings of the library's LZMACompressor
+_LZMA_FILTERS = [{"id": lzma.FILTER_LZMA1, "dict_size": 8 << 20, "lc": 3, "lp": 0, "pb": 2}]
+
+
+def encode_container(data, compression: int = COMPRESSION_GZIP, revision: Optional[int] = None,
+                     xtea: Optional[Sequence[int]] = None) -> bytes:
+    """Compress data into a container (see ByteArray.compress in the Kotlin library)"""
+    if compression == COMPRESSION_NONE:
+        header = struct.pack(">Bi", compression, len(data))
+        payload = bytes(data)
+    else:
+        if compression == COMPRESSION_GZIP:
+            payload = gzip.compress(data, compresslevel=6, mtime=0)
+        elif compression == COMPRESSION_BZIP2:
+            # Stored without the "BZh1" stream header
+            payload = bz2.compress(data, 1)[4:]
+        elif compression == COMPRESSION_LZMA:
+            # Stored as the 5 property bytes and the stream, without the .lzma size field
+            compressed = lzma.compress(data, format=lzma.FORMAT_ALONE, filters=_LZMA_FILTERS)
+            payload = compressed[:5] + compressed[13:]
+        else:
+            raise CacheFormatError(f"Unknown compression type {compression}")
+        header = struct.pack(">Bii", compression, len(payload), len(data))
+    container = header + payload
+    if has_xtea(xtea):
+        container = bytes(xtea_encrypt(container, xtea, 5, len(container)))
+    trailer = struct.pack(">H", revision & 0xFFFF) if revision is not None else b""
+    return container + trailer
+
+
+def container_size(data) -> int:
+    """Length of a stored container without its optional revision trailer"""
+    compression, compressed_size = struct.unpack_from(">Bi", data, 0)
+    header_size = 5 if compression == COMPRESSION_NONE else 9
+    return header_size + compressed_size
+
+
+def container_revision(data) -> Optional[int]:
+    """Return the 2-byte revision trailer of a container, if present"""
+    if len(data) - container_size(data) >= 2:
+        return struct.unpack_from(">H", data, len(data) - 2)[0]
+    return None
+
+
+def reference_table_revision(data) -> int:
+    """Revision in the header of a decompressed reference table (0 for formats before 6)"""
+    if len(data) >= 5 and data[0] >= 6:
+        return struct.unpack_from(">i", data, 1)[0]
+    return 0
+
+
+class ArchiveEntry:
+    """Reference table metadata of a single archive"""
+
+    __slots__ = ("id", "name_hash", "crc", "revision", "length", "uncompressed_length", "file_ids", "file_name_hashes")
+
+    def __init__(self, archive_id: int):
+        self.id = archive_id
+        self.name_hash = 0
+        self.crc = 0
+        self.revision = 0
+        # Only stored in tables with FLAG_LENGTHS, 0 otherwise
+        self.length = 0
+        self.uncompressed_length = 0
+        self.file_ids: List[int] = []
+        self.file_name_hashes: List[int] = []
+
+
+class ReferenceTable:
+    """Decoded reference table of an index, as stored in idx255"""
+
+    def __init__(self, index_id: int):
+        self.index_id = index_id
+        self.version = 0
+        self.revision = 0
+        self.mask = 0
+        self.archives: Dict[int, ArchiveEntry] = {}
+
+    @property
+    def named(self) -> bool:
+        return self.mask & FLAG_NAME != 0
+
+    def archive_ids(self) -> List[int]:
+        return list(self.archives.keys())
+
+    @classmethod
+    def decode(cls, index_id: int, data) -> "ReferenceTable":
+        """Parse a decompressed reference table (see ReferenceTable.read in the Kotlin library)"""
+        table = cls(index_id)
+        buf = memoryview(data)
+        pos = 0
+
+        def u8():
+            nonlocal pos
+            value = buf[pos]
+            pos += 1
+            return value
+
+        def u16():
+            nonlocal pos
+            value = struct.unpack_from(">H", buf, pos)[0]
+            pos += 2
+            return value
+
+        def i32():
+            nonlocal pos
+            value = struct.unpack_from(">i", buf, pos)[0]
+            pos += 4
+            return value
+
+        def big_smart():
+            if buf[pos] & 0x80:
+                return i32() & 0x7FFFFFFF
+            return u16()
+
+        table.version = u8()
+        if table.version < 5 or table.version > 7:
+            raise CacheFormatError(f"Unknown version: {table.version}")
+        table.revision = i32() if table.version >= 6 else 0
+        table.mask = u8()
+        read_id = big_smart if table.version >= 7 else u16
+
+        entries: List[ArchiveEntry] = []
+        archive_id = 0
+        for _ in range(read_id()):
+            archive_id += read_id()
+            entries.append(ArchiveEntry(archive_id))
+        if table.mask & FLAG_NAME:
+            for entry in entries:
+                entry.name_hash = i32()
+        for entry in entries:
+            entry.crc = i32()
+        if table.mask & FLAG_CHECKSUMS:
+            pos += 4 * len(entries)
+        if table.mask & FLAG_WHIRLPOOL:
+            pos += WHIRLPOOL_SIZE * len(entries)
+        if table.mask & FLAG_LENGTHS:
+            for entry in entries:
+                entry.length = i32()
+                entry.uncompressed_length = i32()
+        for entry in entries:
+            entry.revision = i32()
+        file_counts = [read_id() for _ in entries]
+        for entry, count in zip(entries, file_counts):
+            file_id = 0
+            for _ in range(count):
+                file_id += read_id()
+                entry.file_ids.append(file_id)
+        if table.mask & FLAG_NAME:
+            for entry, count in zip(entries, file_counts):
+                entry.file_name_hashes = [i32() for _ in range(count)]
+
+        for entry in entries:
+            table.archives.setdefault(entry.id, entry)
+        return table
+
+    def encode(self) -> bytes:
+        """Serialize the table for idx255, the inverse of decode for the name flag and versions 5 to 7"""
+        entries = [self.archives[archive_id] for archive_id in sorted(self.archives)]
+        version = self.version or 6
+        if version < 7 and any(entry.id > 0xFFFF or len(entry.file_ids) > 0xFFFF for entry in entries):
+            version = 7
+        mask = self.mask & FLAG_NAME
+
+        def ids(values):
+            if version >= 7:
+                return b"".join(struct.pack(">H", value) if value < 0x8000 else struct.pack(">I", value | 0x80000000)
+                                for value in values)
+            return struct.pack(f">{len(values)}H", *values)
+
+        def deltas(values):
+            return [value - previous for value, previous in zip(values, [0] + values[:-1])]
+
+        out = [struct.pack(">B", version)]
+        if version >= 6:
+            out.append(struct.pack(">i", self.revision))
+        out.append(struct.pack(">B", mask))
+        out.append(ids([len(entries)]) + ids(deltas([entry.id for entry in entries])))
+        if mask & FLAG_NAME:
+            out.append(struct.pack(f">{len(entries)}i", *(entry.name_hash for entry in entries)))
+        out.append(struct.pack(f">{len(entries)}i", *(entry.crc for entry in entries)))
+        out.append(struct.pack(f">{len(entries)}i", *(entry.revision for entry in entries)))
+        out.append(ids([len(entry.file_ids) for entry in entries]))
+        for entry in entries:
+            out.append(ids(deltas(list(entry.file_ids))))
+        if mask & FLAG_NAME:
+            for entry in entries:
+                hashes = entry.file_name_hashes or [0] * len(entry.file_ids)
+                out.append(struct.pack(f">{len(hashes)}i", *hashes))
+        return b"".join(out)
+
+
+def split_archive(data, file_ids: Sequence[int]) -> Dict[int, bytes]:
+    """Split a decompressed archive into its files (see Archive.read in the Kotlin library)"""
+    if len(file_ids) == 1:
+        return {file_ids[0]: bytes(data)}
+    if not file_ids:
+        return {}
+    buf = memoryview(data)
+    count = len(file_ids)
+    chunks = buf[-1]
+    sizes_offset = len(buf) - 1 - chunks * count * 4
+    if sizes_offset < 0:
+        raise CacheFormatError("Invalid archive chunk table")
+
+    chunk_sizes: List[List[int]] = []
+    totals = [0] * count
+    pos = sizes_offset
+    for _ in range(chunks):
+        size = 0
+        row = []
+        for i in range(count):
+            size += struct.unpack_from(">i", buf, pos)[0]
+            pos += 4
+            row.append(size)
+            totals[i] += size
+        chunk_sizes.append(row)
+
+    files = [bytearray(total) for total in totals]
+    written = [0] * count
+    offset = 0
+    for row in chunk_sizes:
+        for i, size in enumerate(row):
+            files[i][written[i]:written[i] + size] = buf[offset:offset + size]
+            written[i] += size
+            offset += size
+    return {file_id: bytes(files[i]) for i, file_id in enumerate(file_ids)}
+
+
+def encode_archive(files: Dict[int, bytes]) -> bytes:
+    """Join files into an archive in file id order, as one chunk (see Archive.write in the Kotlin library)"""
+    file_ids = sorted(files)
+    if len(file_ids) == 1:
+        return bytes(files[file_ids[0]])
+    sizes = [len(files[file_id]) for file_id in file_ids]
+    deltas = [size - previous for size, previous in zip(sizes, [0] + sizes[:-1])]
+    return b"".join(files[file_id] for file_id in file_ids) + struct.pack(f">{len(deltas)}i", *deltas) + b"\x01"
@@ -0,0 +1,313 @@
+"""
+Memory-mapped Cache Reader
+This module provides a read-only, thread-safe reader for dat2/idx caches that bypasses the JVM.
+Sector chains are followed directly on mmap views of main_file_cache.dat2 and the idx files.
+"""
+
+import mmap
+import os
+import struct
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from cache_format import (
+    CACHE_FILE_NAME,
+    INDEX_SIZE,
+    SECTOR_SIZE,
+    SECTOR_HEADER_SIZE_SMALL,
+    SECTOR_DATA_SIZE_SMALL,
+    SECTOR_HEADER_SIZE_BIG,
+    SECTOR_DATA_SIZE_BIG,
+    ReferenceTable,
+    crc32,
+    decode_container,
+    split_archive,
+)
+from table_snapshot import TableSnapshot
+from tracing import span
+
+
+class _MappedFile:
+    """A read-only mmap of a file that is re-mapped when the file grows"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._lock = threading.Lock()
+        self.view = self._map()
+
+    def _map(self) -> memoryview:
+        size = os.fstat(self._file.fileno()).st_size
+        if size == 0:
+            return memoryview(b"")
+        return memoryview(mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def ensure(self, length: int) -> memoryview:
+        """Return a view covering at least length bytes, re-mapping if the file has grown"""
+        view = self.view
+        if len(view) >= length:
+            return view
+        with self._lock:
+            if len(self.view) < length:
+                # Readers may still hold slices of the old map, so it is left to the GC
+                self.view = self._map()
+            return self.view
+
+    def refresh(self) -> memoryview:
+        with self._lock:
+            self.view = self._map()
+            return self.view
+
+    def close(self):
+        self._file.close()
+
+
+class CacheReader:
+    """Read-only reader for dat2/idx caches backed by memory maps"""
+
+    def __init__(self, path: str, snapshot: Optional[TableSnapshot] = None):
+        self.path = path
+        # Reference tables whose idx255 container CRC still matches are taken from the snapshot
+        self.snapshot = snapshot
+        self.snapshot_hits = 0
+        self.snapshot_misses = 0
+        main_path = os.path.join(path, f"{CACHE_FILE_NAME}.dat2")
+        index255_path = os.path.join(path, f"{CACHE_FILE_NAME}.idx255")
+        if not os.path.exists(main_path) or not os.path.exists(index255_path):
+            raise FileNotFoundError(f"No dat2/idx255 cache found at {path}")
+        self._main = _MappedFile(main_path)
+        self._indices: Dict[int, _MappedFile] = {255: _MappedFile(index255_path)}
+        # index id -> (idx255 entry, table, container crc)
+        self._tables: Dict[int, Tuple[bytes, ReferenceTable, int]] = {}
+        self._lock = threading.Lock()
+        index_count = len(self._indices[255].view) // INDEX_SIZE
+        for index_id in range(index_count):
+            index_path = os.path.join(path, f"{CACHE_FILE_NAME}.idx{index_id}")
+            if os.path.exists(index_path):
+                self._indices[index_id] = _MappedFile(index_path)
+
+    def index_ids(self) -> List[int]:
+        """Ids of the indices present on disk (excluding 255)"""
+        return sorted(i for i in self._indices if i != 255)
+
+    def exists(self, index_id: int) -> bool:
+        return index_id in self._indices
+
+    def loaded_index_ids(self) -> List[int]:
+        """Ids of the indices whose reference tables have been decoded"""
+        with self._lock:
+            return sorted(self._tables)
+
+    def _index_entry(self, index_id: int, archive_id: int) -> Optional[Tuple[int, int]]:
+        mapped = self._indices.get(index_id)
+        if mapped is None or archive_id < 0:
+            return None
+        end = archive_id * INDEX_SIZE + INDEX_SIZE
+        view = mapped.ensure(end)
+        if len(view) < end:
+            return None
+        entry = view[end - INDEX_SIZE:end]
+        size = int.from_bytes(entry[0:3], "big")
+        sector = int.from_bytes(entry[3:6], "big")
+        return size, sector
+
+    def read_sector_chain(self, index_id: int, archive_id: int) -> Optional[List[memoryview]]:
+        """Return the stored container of an archive as a list of zero-copy slices"""
+        entry = self._index_entry(index_id, archive_id)
+        if entry is None:
+            return None
+        size, sector = entry
+        if size <= 0 or sector <= 0:
+            return None
+        big = archive_id > 65535
+        header_size = SECTOR_HEADER_SIZE_BIG if big else SECTOR_HEADER_SIZE_SMALL
+        data_size = SECTOR_DATA_SIZE_BIG if big else SECTOR_DATA_SIZE_SMALL
+        header_format = ">iH" if big else ">HH"
+        main = self._main.view
+        chunks: List[memoryview] = []
+        read = 0
+        chunk = 0
+        while read < size:
+            if sector == 0:
+                return None
+            start = sector * SECTOR_SIZE
+            remaining = min(size - read, data_size)
+            if start + header_size + remaining > len(main):
+                main = self._main.ensure(start + header_size + remaining)
+                if start + header_size + remaining > len(main):
+                    return None
+            sector_id, sector_chunk = struct.unpack_from(header_format, main, start)
+            next_sector = int.from_bytes(main[start + header_size - 4:start + header_size - 1], "big")
+            sector_index = main[start + header_size - 1]
+            if sector_id != archive_id or sector_chunk != chunk or sector_index != index_id:
+                return None
+            chunks.append(main[start + header_size:start + header_size + remaining])
+            read += remaining
+            sector = next_sector
+            chunk += 1
+        return chunks
+
+    def touch(self, index_id: int, archive_id: int) -> int:
+        """Fault the sectors of an archive into the page cache and return its stored size"""
+        size = 0
+        for chunk in self.read_sector_chain(index_id, archive_id) or ():
+            # The chain walk read every header; the last byte brings in a sector that crosses a page
+            if chunk and chunk[-1] >= 0:
+                size += len(chunk)
+        return size
+
+    def sector_positions(self, index_id: int, archive_id: int) -> List[int]:
+        """The sectors of an archive's chain in order, up to the first one that does not belong to it"""
+        entry = self._index_entry(index_id, archive_id)
+        if entry is None:
+            return []
+        size, sector = entry
+        big = archive_id > 65535
+        header_size = SECTOR_HEADER_SIZE_BIG if big else SECTOR_HEADER_SIZE_SMALL
+        data_size = SECTOR_DATA_SIZE_BIG if big else SECTOR_DATA_SIZE_SMALL
+        header_format = ">iH" if big else ">HH"
+        main = self._main.view
+        positions = []
+        for chunk in range((size + data_size - 1) // data_size):
+            start = sector * SECTOR_SIZE
+            if start + header_size > len(main):
+                main = self._main.ensure(start + header_size)
+            if sector <= 0 or start + header_size > len(main):
+                break
+            sector_id, sector_chunk = struct.unpack_from(header_format, main, start)
+            if sector_id != archive_id or sector_chunk != chunk or main[start + header_size - 1] != index_id:
+                break
+            positions.append(sector)
+            sector = int.from_bytes(main[start + header_size - 4:start + header_size - 1], "big")
+        return positions
+
+    def entry_count(self, index_id: int) -> int:
+        """Number of archive entries in the idx file of an index"""
+        mapped = self._indices.get(index_id)
+        return len(mapped.refresh()) // INDEX_SIZE if mapped is not None else 0
+
+    def read_container(self, index_id: int, archive_id: int):
+        """Return the stored container bytes; a single-sector archive is returned as a view"""
+        chunks = self.read_sector_chain(index_id, archive_id)
+        if chunks is None:
+            return None
+        if len(chunks) == 1:
+            return chunks[0]
+        return b"".join(chunks)
+
+    def reference_table(self, index_id: int) -> Optional[ReferenceTable]:
+        """Return the decoded reference table of an index, re-reading it when idx255 changes"""
+        if index_id == 255 or not self.exists(index_id):
+            return None
+        entry = self._indices[255].ensure(index_id * INDEX_SIZE + INDEX_SIZE)
+        key = bytes(entry[index_id * INDEX_SIZE:index_id * INDEX_SIZE + INDEX_SIZE])
+        cached = self._tables.get(index_id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        container = self.read_container(255, index_id)
+        if container is None:
+            return None
+        crc = crc32(container)
+        table = None
+        if self.snapshot is not None and self.snapshot.crc(index_id) == crc:
+            table = self.snapshot.table(index_id)
+        with self._lock:
+            if table is not None:
+                self.snapshot_hits += 1
+            else:
+                self.snapshot_misses += 1
+        if table is None:
+            table = ReferenceTable.decode(index_id, decode_container(container))
+        with self._lock:
+            self._tables[index_id] = (key, table, crc)
+        return table
+
+    def snapshot_tables(self) -> Dict[int, Tuple[int, ReferenceTable]]:
+        """The reference tables of all indices keyed by index id, with their container CRCs"""
+        tables = {}
+        for index_id in self.index_ids():
+            table = self.reference_table(index_id)
+            cached = self._tables.get(index_id)
+            if table is not None and cached is not None:
+                tables[index_id] = (cached[2], table)
+        return tables
+
+    def snapshot_stale(self) -> bool:
+        """Whether the snapshot is missing a reference table or stores an outdated one"""
+        if self.snapshot is None:
+            return True
+        tables = self.snapshot_tables()
+        return any(self.snapshot.crc(index_id) != crc for index_id, (crc, _) in tables.items())
+
+    def archive_files(self, index_id: int, archive_id: int, xtea: Optional[Sequence[int]] = None) -> Optional[Dict[int, bytes]]:
+        """Decode an archive and return its files keyed by file id"""
+        table = self.reference_table(index_id)
+        if table is None:
+            return None
+        entry = table.archives.get(archive_id)
+        if entry is None:
+            return None
+        with span("sector_read"):
+            container = self.read_container(index_id, archive_id)
+        if container is None:
+            return None
+        with span("decompress", bytes=len(container)):
+            data = decode_container(container, xtea)
+        with span("split"):
+            return split_archive(data, entry.file_ids)
+
+    def data(self, index_id: int, archive_id: int, file_id: int = 0, xtea: Optional[Sequence[int]] = None) -> Optional[bytes]:
+        """Return the data of a single file, like CacheLibrary.data"""
+        files = self.archive_files(index_id, archive_id, xtea)
+        if files is None:
+            return None
+        return files.get(file_id)
+
+    def reload(self):
+        """Re-map all files and drop decoded reference tables"""
+        self._main.refresh()
+        for mapped in self._indices.values():
+            mapped.refresh()
+        with self._lock:
+            self._tables.clear()
+
+    def close(self):
+        self._main.close()
+        for mapped in self._indices.values():
+            mapped.close()
+        self._indices.clear()
+        self._tables.clear()
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+
+def compare_caches(source: str, target: str, index_ids: Optional[Iterable[int]] = None) -> List[str]:
+    """Differences between the archives of the caches at source and target, empty when they hold the same.
+
+    The reference table of every index of source is compared, and the stored container of every
+    archive in the tables of index_ids, all indices when None. Archives source can not read are
+    skipped, like a rebuild skips them.
+    """
+    selected = set(index_ids) if index_ids is not None else None
+    differences = []
+    a, b = CacheReader(source), CacheReader(target)
+    try:
+        for index_id in a.index_ids():
+            if not b.exists(index_id):
+                differences.append(f"Index {index_id} is missing")
+                continue
+            table = a.read_container(255, index_id)
+            if table is not None and table != b.read_container(255, index_id):
+                differences.append(f"Reference table of index {index_id} differs")
+            if selected is not None and index_id not in selected:
+                continue
+            reference_table = a.reference_table(index_id)
+            for archive_id in reference_table.archive_ids() if reference_table is not None else []:
+                container = a.read_container(index_id, archive_id)
+                if container is not None and container != b.read_container(index_id, archive_id):
+                    differences.append(f"Archive {archive_id} of index {index_id} differs")
+    finally:
+        a.close()
+        b.close()
+    return differences
@@ -0,0 +1,135 @@
+"""
+Decoded File Cache
+This module provides a thread-safe, byte-budgeted LRU cache of decoded file payloads
+with optional TTL and per-archive invalidation.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+
+# (index_id, archive_id, file_id, xtea)
+FileKey = Tuple[int, int, int, Optional[Tuple[int, ...]]]
+
+
+class FileCache:
+    """LRU cache of decoded files keyed by (index_id, archive_id, file_id, xtea)"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: Optional[float] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[FileKey, tuple]" = OrderedDict()
+        self._archives: Dict[Tuple[int, int], Set[FileKey]] = {}
+        # Bumped on invalidation so reads that raced with a write are not cached
+        self._generations: Dict[Tuple[int, int], int] = {}
+        self._epoch = 0
+        # Generations restart at 0 in every process, so versions also carry this random id
+        self.instance = os.urandom(4).hex()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(index_id: int, archive_id: int, file_id: int, xtea=None) -> FileKey:
+        return index_id, archive_id, file_id, tuple(xtea) if xtea is not None else None
+
+    def token(self, index_id: int, archive_id: int) -> tuple:
+        """Capture the archive's generation before reading it, to be passed to put"""
+        return self._epoch, self._generations.get((index_id, archive_id), 0)
+
+    def version(self, token: tuple) -> str:
+        """A token as a string that differs after clear(), in other processes and after a restart"""
+        return f"{self.instance}-{token[0]}-{token[1]}"
+
+    def get(self, key: FileKey) -> Optional[tuple]:
+        """Return the cached (data, crc, revision) for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[3] is not None and entry[3] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[:3]
+
+    def put(self, key: FileKey, data: bytes, crc: Optional[int] = None, revision: Optional[int] = None, token: Optional[tuple] = None):
+        size = len(data)
+        if self.max_bytes <= 0 or size > self.max_bytes:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if token is not None and token != (self._epoch, self._generations.get(key[:2], 0)):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (data, crc, revision, expires)
+            self._archives.setdefault(key[:2], set()).add(key)
+            self._size += size
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: FileKey):
+        entry = self._entries.pop(key)
+        self._size -= len(entry[0])
+        keys = self._archives.get(key[:2])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._archives[key[:2]]
+
+    def _bump(self, index_id: int, archive_id: int):
+        self._generations[(index_id, archive_id)] = self._generations.get((index_id, archive_id), 0) + 1
+
+    def invalidate_file(self, index_id: int, archive_id: int, file_id: int):
+        """Drop a file under every xtea it was cached with"""
+        with self._lock:
+            self._bump(index_id, archive_id)
+            for key in list(self._archives.get((index_id, archive_id), ())):
+                if key[2] == file_id:
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def invalidate_archive(self, index_id: int, archive_id: int):
+        """Drop every cached file of an archive"""
+        with self._lock:
+            self._bump(index_id, archive_id)
+            for key in list(self._archives.get((index_id, archive_id), ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._archives.clear()
+            self._generations.clear()
+            self._epoch += 1
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
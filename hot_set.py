@@ -0,0 +1,64 @@
+"""
+Hot Set
+This module records which archives are read, so the most requested ones can be warmed up
+again after a restart.
+"""
+
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+class HotSet:
+    """Read counts per (index_id, archive_id), bounded to max_archives distinct archives"""
+
+    def __init__(self, max_archives: int = 1000000):
+        self.max_archives = max_archives
+        self._counts: Dict[Tuple[int, int], int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, index_id: int, archive_id: int):
+        key = (index_id, archive_id)
+        # Counts are only used for ranking, so the unlocked increment racing is acceptable
+        count = self._counts.get(key)
+        if count is not None:
+            self._counts[key] = count + 1
+        elif len(self._counts) < self.max_archives:
+            with self._lock:
+                self._counts[key] = self._counts.get(key, 0) + 1
+
+    def top(self, limit: Optional[int] = None) -> Dict[int, List[int]]:
+        """The most read archives as {index_id: [archive_id, ...]}"""
+        with self._lock:
+            ranked = sorted(self._counts.items(), key=lambda item: item[1], reverse=True)
+        if limit is not None:
+            ranked = ranked[:limit]
+        archives: Dict[int, List[int]] = {}
+        for (index_id, archive_id), _ in ranked:
+            archives.setdefault(index_id, []).append(archive_id)
+        for archive_ids in archives.values():
+            archive_ids.sort()
+        return archives
+
+    def save(self, path: str, limit: Optional[int] = None) -> int:
+        """Write the hot set to path as JSON and return the number of archives written"""
+        archives = self.top(limit)
+        temporary = path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump({"archives": {str(index_id): ids for index_id, ids in archives.items()}}, f)
+        os.replace(temporary, path)
+        return sum(len(ids) for ids in archives.values())
+
+    @staticmethod
+    def load(path: str) -> Dict[int, List[int]]:
+        with open(path) as f:
+            data = json.load(f)
+        return {int(index_id): [int(archive_id) for archive_id in ids] for index_id, ids in data.get("archives", {}).items()}
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
@@ -0,0 +1,157 @@
+"""
+Background Jobs
+This module runs long cache operations (warm-up, rebuilds) on a small thread pool and keeps
+their progress so clients can poll for it and cancel them.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once it has been asked to stop"""
+
+
+class Job:
+    """State and progress of one background job"""
+
+    def __init__(self, kind: str, description: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.description = description
+        self.state = "pending"
+        self.progress = 0.0
+        self.message = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+    def update(self, progress: float, message: Optional[str] = None):
+        """Report progress in [0, 1]; raises JobCancelled if the job was cancelled"""
+        with self._lock:
+            self.progress = min(max(progress, 0.0), 1.0)
+            if message is not None:
+                self.message = message
+        self.check_cancelled()
+
+    @property
+    def done(self) -> bool:
+        return self.state in ("succeeded", "failed", "cancelled")
+
+    def info(self) -> dict:
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "kind": self.kind,
+                "description": self.description,
+                "state": self.state,
+                "progress": self.progress,
+                "message": self.message,
+                "result": self.result,
+                "error": self.error,
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished
+            }
+
+
+class JobManager:
+    """Runs jobs on a bounded thread pool and remembers the most recent finished ones"""
+
+    def __init__(self, max_workers: int = 2, keep_finished: int = 100,
+                 thread_initializer: Optional[Callable[[], None]] = None):
+        self.max_workers = max_workers
+        self.keep_finished = keep_finished
+        self.thread_initializer = thread_initializer
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, kind: str, function: Callable, *args, description: Optional[str] = None) -> Job:
+        """Run function(job, *args) in the background; its return value becomes job.result"""
+        job = Job(kind, description)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="cache-job",
+                                                    initializer=self.thread_initializer)
+            self._jobs[job.id] = job
+            self._prune()
+            self._executor.submit(self._run, job, function, args)
+        return job
+
+    def _run(self, job: Job, function: Callable, args: tuple):
+        job.started = time.time()
+        job.state = "running"
+        try:
+            job.check_cancelled()
+            job.result = function(job, *args)
+            job.progress = 1.0
+            job.state = "succeeded"
+        except JobCancelled:
+            job.state = "cancelled"
+        except Exception as e:
+            if job.cancelled:
+                # Cancellation raised through foreign code may surface as another exception type
+                job.state = "cancelled"
+            else:
+                job.error = str(e)
+                job.state = "failed"
+        finally:
+            job.finished = time.time()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(len(finished) - self.keep_finished, 0)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self, kind: Optional[str] = None) -> List[Job]:
+        with self._lock:
+            return [job for job in self._jobs.values() if kind is None or job.kind == kind]
+
+    def running(self, kind: Optional[str] = None) -> List[Job]:
+        return [job for job in self.jobs(kind) if not job.done]
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def shutdown(self, wait: bool = True):
+        """Cancel every job; with wait, return once the running ones stopped"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+            executor = self._executor
+            self._executor = None
+        for job in jobs:
+            job.cancel()
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+        for job in jobs:
+            if job.state == "pending" and job.started is None:
+                # Dropped from the queue before it ran
+                job.state = "cancelled"
+                job.finished = time.time()
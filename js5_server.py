@@ -0,0 +1,393 @@
+"""
+JS5 File Server
+Serves archive containers to game clients and update tools over the JS5 update protocol, reading
+them through CacheLibraryAPI. Each connection may have many requests outstanding; urgent requests
+are always answered before prefetch requests, and containers are read on a thread pool in batches
+so the event loop never blocks on the JVM or the disk.
+
+Protocol:
+    handshake   client sends opcode 15 and its revision (u32); the server answers one status
+                byte, 0 (ok) or 6 (out of date)
+    requests    4 bytes each: opcode u8, then index u8 and archive u16 for 0 (prefetch) and
+                1 (urgent); 4 sets the XOR encryption key to the next byte, 7 closes the
+                connection and other opcodes (logged in/out, ...) are ignored
+    responses   index u8, archive u16, then the stored container without its revision trailer,
+                with 0x80 set on the compression byte of prefetch responses; every 512 bytes of
+                a response are followed by a 0xFF marker. JS5 has no error response: a request
+                for a container that does not exist closes the connection
+    (255, 255)  the checksum table: an uncompressed container holding the reference table
+                CRC and revision (i32 each) of every index
+
+Usage:
+    python js5_server.py serve --cache-path /app/cache [--port 43594] [--revision 1]
+    python js5_server.py fetch 255:255 2:10 [--host 127.0.0.1] [--output /tmp/containers] [--timeout 30]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+from cache_api import CacheLibraryAPI, attach_jvm_thread
+from cache_format import COMPRESSION_NONE, container_size, crc32
+
+
+HANDSHAKE_OPCODE = 15
+
+STATUS_OK = 0
+STATUS_OUT_OF_DATE = 6
+
+OPCODE_PREFETCH = 0
+OPCODE_URGENT = 1
+OPCODE_ENCRYPTION_KEY = 4
+OPCODE_DISCONNECT = 7
+
+BLOCK_SIZE = 512
+BLOCK_MARKER = b"\xff"
+PREFETCH_FLAG = 0x80
+
+REQUEST = struct.Struct(">BBH")
+RESPONSE_HEADER = struct.Struct(">BHBi")
+
+# translate() tables applying each XOR encryption key
+XOR_TABLES = [bytes(value ^ key for value in range(256)) for key in range(256)]
+
+logger = logging.getLogger("js5")
+
+
+def encode_response(index_id: int, archive_id: int, container: bytes, urgent: bool) -> bytes:
+    """Frame a container as a JS5 response, inserting a block marker every 512 bytes"""
+    compression = container[0] if urgent else container[0] | PREFETCH_FLAG
+    body = struct.pack(">BHB", index_id, archive_id, compression) + container[1:]
+    if len(body) <= BLOCK_SIZE:
+        return body
+    blocks = [body[:BLOCK_SIZE]]
+    for offset in range(BLOCK_SIZE, len(body), BLOCK_SIZE - 1):
+        blocks.append(BLOCK_MARKER)
+        blocks.append(body[offset:offset + BLOCK_SIZE - 1])
+    return b"".join(blocks)
+
+
+def encode_checksum_table(checksums: Sequence[Tuple[int, int]]) -> bytes:
+    """The (255, 255) container: (crc, revision) of every index, uncompressed"""
+    payload = b"".join(struct.pack(">ii", crc, revision) for crc, revision in checksums)
+    return struct.pack(">Bi", COMPRESSION_NONE, len(payload)) + payload
+
+
+def decode_checksum_table(container: bytes) -> List[Tuple[int, int]]:
+    payload = container[5:container_size(container)]
+    return [struct.unpack_from(">ii", payload, offset) for offset in range(0, len(payload) - 7, 8)]
+
+
+class JS5Connection:
+    """One client: a reader task queueing requests and a writer task answering them"""
+
+    def __init__(self, server: "JS5Server", reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.urgent: Deque[Tuple[int, int]] = deque()
+        self.prefetch: Deque[Tuple[int, int]] = deque()
+        self.key = 0
+        self.closed = False
+        self._wakeup = asyncio.Event()
+
+    async def run(self):
+        try:
+            if not await self.handshake():
+                return
+            writer_task = asyncio.ensure_future(self.write_responses())
+            # A failed write closes the transport, which also ends read_requests
+            writer_task.add_done_callback(lambda task: self.writer.close())
+            try:
+                await self.read_requests()
+            finally:
+                self.closed = True
+                self._wakeup.set()
+                await writer_task
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.writer.close()
+
+    async def handshake(self) -> bool:
+        opcode, revision = struct.unpack(">BI", await self.reader.readexactly(5))
+        if opcode != HANDSHAKE_OPCODE:
+            return False
+        if self.server.revision is not None and revision != self.server.revision:
+            self.writer.write(bytes([STATUS_OUT_OF_DATE]))
+            await self.writer.drain()
+            return False
+        self.writer.write(bytes([STATUS_OK]))
+        await self.writer.drain()
+        return True
+
+    async def read_requests(self):
+        while True:
+            try:
+                opcode, first, second = REQUEST.unpack(await self.reader.readexactly(REQUEST.size))
+            except (ConnectionError, asyncio.IncompleteReadError):
+                return
+            if opcode == OPCODE_URGENT or opcode == OPCODE_PREFETCH:
+                if len(self.urgent) + len(self.prefetch) >= self.server.max_queued:
+                    logger.warning("closing a connection with more than %d queued requests", self.server.max_queued)
+                    return
+                (self.urgent if opcode == OPCODE_URGENT else self.prefetch).append((first, second))
+                self.server.requests += 1
+                self._wakeup.set()
+            elif opcode == OPCODE_ENCRYPTION_KEY:
+                self.key = first
+            elif opcode == OPCODE_DISCONNECT:
+                return
+
+    def _next_batch(self) -> List[Tuple[int, int, bool]]:
+        batch = []
+        while self.urgent and len(batch) < self.server.batch_size:
+            batch.append(self.urgent.popleft() + (True,))
+        while self.prefetch and len(batch) < self.server.batch_size:
+            batch.append(self.prefetch.popleft() + (False,))
+        return batch
+
+    async def write_responses(self):
+        while not self.closed:
+            batch = self._next_batch()
+            if not batch:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            containers = await self.server.read_containers([(index_id, archive_id) for index_id, archive_id, _ in batch])
+            if self.closed:
+                return
+            for (index_id, archive_id, urgent), container in zip(batch, containers):
+                if container is None:
+                    # The client sees the connection close, instead of waiting for the response forever
+                    self.server.misses += 1
+                    logger.warning("no container for index %d, archive %d, closing the connection", index_id, archive_id)
+                    self.closed = True
+                    break
+                response = encode_response(index_id, archive_id, container, urgent)
+                if self.key:
+                    response = response.translate(XOR_TABLES[self.key])
+                self.writer.write(response)
+                self.server.bytes_sent += len(response)
+            # Applies backpressure: a slow client stops its own batches, not the server
+            await self.writer.drain()
+
+
+class JS5Server:
+    """Answers JS5 requests with containers read through a CacheLibraryAPI"""
+
+    def __init__(self, api: CacheLibraryAPI, revision: Optional[int] = None, max_workers: int = 8,
+                 max_queued: int = 1000, batch_size: int = 32, checksum_ttl: float = 1.0):
+        self.api = api
+        self.revision = revision
+        self.max_queued = max_queued
+        self.batch_size = batch_size
+        # The checksum table is requested once per client session; rebuild it at most this often
+        self.checksum_ttl = checksum_ttl
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="js5",
+                                           initializer=attach_jvm_thread)
+        self._checksum_table = None
+        self._checksum_time = 0.0
+        self._checksum_lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.misses = 0
+        self.bytes_sent = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            await JS5Connection(self, reader, writer).run()
+        finally:
+            self.connections -= 1
+
+    async def start(self, host: str, port: int):
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def read_containers(self, requests: List[Tuple[int, int]]) -> List[Optional[bytes]]:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._read_containers, requests)
+
+    def _read_containers(self, requests: List[Tuple[int, int]]) -> List[Optional[bytes]]:
+        containers = []
+        for index_id, archive_id in requests:
+            if index_id == 255 and archive_id == 255:
+                containers.append(self.checksum_table())
+                continue
+            result = self.api.get_raw_archive(index_id, archive_id)
+            if result["status"] != "success":
+                containers.append(None)
+                continue
+            data = result["data"]
+            containers.append(data[:container_size(data)])
+        return containers
+
+    def checksum_table(self) -> bytes:
+        with self._checksum_lock:
+            if self._checksum_table is None or time.monotonic() - self._checksum_time > self.checksum_ttl:
+                self._checksum_table = encode_checksum_table(self.api.index_checksums())
+                self._checksum_time = time.monotonic()
+            return self._checksum_table
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connections,
+            "requests": self.requests,
+            "misses": self.misses,
+            "bytes_sent": self.bytes_sent
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class JS5Client:
+    """Minimal JS5 client for testing: pipelines requests and matches responses by (index, archive)"""
+
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self._waiting: Dict[Tuple[int, int], Deque[asyncio.Future]] = {}
+        self._reader_task = None
+
+    async def connect(self, host: str, port: int, revision: int = 0):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.writer.write(struct.pack(">BI", HANDSHAKE_OPCODE, revision))
+        await self.writer.drain()
+        status = (await self.reader.readexactly(1))[0]
+        if status != STATUS_OK:
+            self.writer.close()
+            raise ConnectionError(f"JS5 handshake refused with status {status}")
+        self._reader_task = asyncio.ensure_future(self._read_responses())
+
+    def request(self, index_id: int, archive_id: int, urgent: bool = True) -> "asyncio.Future[bytes]":
+        """Send a request; the future resolves to the container as stored, without revision trailer"""
+        future = asyncio.get_running_loop().create_future()
+        if self._reader_task is not None and self._reader_task.done():
+            future.set_exception(ConnectionError("JS5 connection lost"))
+            return future
+        self._waiting.setdefault((index_id, archive_id), deque()).append(future)
+        self.writer.write(REQUEST.pack(OPCODE_URGENT if urgent else OPCODE_PREFETCH, index_id, archive_id))
+        return future
+
+    async def fetch(self, index_id: int, archive_id: int, urgent: bool = True, timeout: Optional[float] = 30.0) -> bytes:
+        """Request a container and wait for it, raising asyncio.TimeoutError after timeout seconds"""
+        future = self.request(index_id, archive_id, urgent)
+        await self.writer.drain()
+        return await asyncio.wait_for(future, timeout)
+
+    async def _read_responses(self):
+        try:
+            while True:
+                header = await self.reader.readexactly(RESPONSE_HEADER.size)
+                index_id, archive_id, compression, length = RESPONSE_HEADER.unpack(header)
+                compression &= ~PREFETCH_FLAG
+                remaining = length + (0 if compression == COMPRESSION_NONE else 4)
+                container = bytearray(header[3:])
+                container[0] = compression
+                block_left = BLOCK_SIZE - RESPONSE_HEADER.size
+                while remaining:
+                    if block_left == 0:
+                        if await self.reader.readexactly(1) != BLOCK_MARKER:
+                            raise ConnectionError("Missing JS5 block marker")
+                        block_left = BLOCK_SIZE - 1
+                    chunk = await self.reader.readexactly(min(remaining, block_left))
+                    container += chunk
+                    remaining -= len(chunk)
+                    block_left -= len(chunk)
+                waiting = self._waiting.get((index_id, archive_id))
+                if waiting:
+                    future = waiting.popleft()
+                    if not future.done():
+                        future.set_result(bytes(container))
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            for waiting in self._waiting.values():
+                for future in waiting:
+                    if not future.done():
+                        future.set_exception(ConnectionError(f"JS5 connection lost: {e}"))
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.write(REQUEST.pack(OPCODE_DISCONNECT, 0, 0))
+            self.writer.close()
+        if self._reader_task is not None:
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+
+
+async def serve(args):
+    api = CacheLibraryAPI()
+    api.start_jvm()
+    result = api.initialize_cache(args.cache_path, use_mmap_reader=args.mmap_reader, lazy=args.lazy)
+    if result["status"] != "success":
+        sys.exit(f"Failed to initialize cache: {result['message']}")
+    server = JS5Server(api, revision=args.revision, max_workers=args.threads)
+    listener = await server.start(args.host, args.port)
+    logger.info("serving JS5 on %s:%d", args.host, args.port)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+        api.close()
+
+
+async def fetch(args):
+    client = JS5Client()
+    await client.connect(args.host, args.port, args.revision or 0)
+    requests = [tuple(int(part) for part in request.split(':')) for request in args.requests]
+    futures = [client.request(index_id, archive_id, not args.prefetch) for index_id, archive_id in requests]
+    await client.writer.drain()
+    start = time.perf_counter()
+    for (index_id, archive_id), future in zip(requests, futures):
+        container = await asyncio.wait_for(future, args.timeout)
+        print(f"{index_id}:{archive_id} {len(container)} bytes, crc {crc32(container)}")
+        if index_id == 255 and archive_id == 255:
+            for checksum_index, (crc, revision) in enumerate(decode_checksum_table(container)):
+                print(f"  index {checksum_index}: crc {crc}, revision {revision}")
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+            with open(os.path.join(args.output, f"{index_id}-{archive_id}.dat"), "wb") as f:
+                f.write(container)
+    print(f"{len(requests)} containers in {time.perf_counter() - start:.3f}s")
+    await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help="Serve a cache over JS5")
+    serve_parser.add_argument('--cache-path', required=True)
+    serve_parser.add_argument('--host', default='0.0.0.0')
+    serve_parser.add_argument('--port', type=int, default=43594)
+    serve_parser.add_argument('--revision', type=int, help="Client revision to accept; any if omitted")
+    serve_parser.add_argument('--threads', type=int, default=8, help="Threads reading containers")
+    serve_parser.add_argument('--mmap-reader', action='store_true', help="Serve reads from memory-mapped files")
+    serve_parser.add_argument('--lazy', action='store_true', help="Load each index the first time it is used")
+    fetch_parser = commands.add_parser('fetch', help="Request containers from a JS5 server")
+    fetch_parser.add_argument('requests', nargs='+', help="index:archive pairs, 255:255 for the checksum table")
+    fetch_parser.add_argument('--host', default='127.0.0.1')
+    fetch_parser.add_argument('--port', type=int, default=43594)
+    fetch_parser.add_argument('--revision', type=int)
+    fetch_parser.add_argument('--prefetch', action='store_true', help="Send prefetch instead of urgent requests")
+    fetch_parser.add_argument('--output', help="Directory to write the containers to")
+    fetch_parser.add_argument('--timeout', type=float, default=30.0, help="Seconds to wait for each container")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    if args.command == 'serve':
+        if not os.path.exists(args.cache_path):
+            sys.exit(f"Cache path does not exist: {args.cache_path}")
+        asyncio.run(serve(args))
+    else:
+        asyncio.run(fetch(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""
+Metrics
+This module keeps request, JVM call and error metrics in process and renders them in the
+Prometheus text exposition format for the /metrics endpoint.
+
+Recording is a dictionary update under a short lock; gauges such as cache and JVM heap
+statistics are only collected when the endpoint is scraped.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds, from cached reads to index updates and rebuilds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing value per label combination"""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_labels(self.label_names, label_values)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Observations counted into cumulative buckets per label combination"""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum, count]
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bucket] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = sorted((label_values, (list(entry[0]), entry[1], entry[2])) for label_values, entry in self._values.items())
+        for label_values, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, label_values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, label_values)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, label_values)} {count}")
+        return lines
+
+
+# A collector returns (name, type, documentation, [(labels, value)]) for each gauge it reports
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, object], float]]]]]
+
+
+class Registry:
+    """Metrics rendered together by /metrics"""
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Collector] = []
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                # A failing collector must not hide the other metrics
+                ERRORS.inc("metrics", type(e).__name__)
+                continue
+            for name, metric_type, documentation, values in samples:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in values:
+                    lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter("cache_api_requests_total", "HTTP requests served", ["method", "route", "status"])
+REQUEST_SECONDS = REGISTRY.histogram("cache_api_request_duration_seconds", "HTTP request latency per route",
+                                     ["method", "route"])
+INDEX_REQUEST_SECONDS = REGISTRY.histogram("cache_api_index_request_duration_seconds",
+                                           "HTTP request latency per index", ["index"])
+REQUEST_BYTES = REGISTRY.counter("cache_api_request_bytes_total", "Request body bytes received", ["route"])
+RESPONSE_BYTES = REGISTRY.counter("cache_api_response_bytes_total", "Response body bytes sent", ["route"])
+JVM_CALL_SECONDS = REGISTRY.histogram("cache_api_jvm_call_duration_seconds", "Time spent inside cache library calls",
+                                      ["call"])
+ERRORS = REGISTRY.counter("cache_api_errors_total", "Errors returned by cache operations", ["operation", "type"])
+CONNECTIONS = REGISTRY.counter("cache_api_connections_total", "HTTP connections accepted by the production server")
+
+
+def index_label(index_id: int) -> str:
+    """The index label of a request; ids come from the URL, so those no cache can have share one series"""
+    return str(index_id) if 0 <= index_id <= 255 else "other"
+
+
+def observe_request(method: str, route: str, status: int, seconds: float, index_id: Optional[int] = None,
+                    bytes_in: Optional[int] = None, bytes_out: Optional[int] = None):
+    REQUESTS.inc(method, route, str(status))
+    REQUEST_SECONDS.observe(seconds, method, route)
+    if index_id is not None:
+        INDEX_REQUEST_SECONDS.observe(seconds, index_label(index_id))
+    if bytes_in:
+        REQUEST_BYTES.inc(route, amount=bytes_in)
+    if bytes_out:
+        RESPONSE_BYTES.inc(route, amount=bytes_out)
+
+
+def jvm_call(call: str):
+    """Context manager timing a call into the cache library"""
+    return JVM_CALL_SECONDS.time(call)
+
+
+def count_error(operation: str, error: BaseException):
+    ERRORS.inc(operation, type(error).__name__)
+
+
+def cache_collector(api) -> Collector:
+    """Gauges and counters of a CacheLibraryAPI: file cache, lock, transactions, free sectors and the JVM"""
+    def collect():
+        stats = api.cache_stats()
+        file_cache = stats["file_cache"]
+        yield ("cache_api_file_cache_bytes", "gauge", "Bytes held by the decoded file cache", [({}, file_cache["bytes"])])
+        yield ("cache_api_file_cache_entries", "gauge", "Files held by the decoded file cache", [({}, file_cache["entries"])])
+        yield ("cache_api_file_cache_lookups_total", "counter", "Decoded file cache lookups",
+               [({"result": "hit"}, file_cache["hits"]), ({"result": "miss"}, file_cache["misses"])])
+        yield ("cache_api_file_cache_evictions_total", "counter", "Decoded file cache evictions", [({}, file_cache["evictions"])])
+        lock = stats["lock"]
+        yield ("cache_api_lock_readers", "gauge", "Threads holding the read lock", [({}, lock["readers"])])
+        yield ("cache_api_lock_waiting_writers", "gauge", "Threads waiting for the write lock", [({}, lock["waiting_writers"])])
+        yield ("cache_api_running_jobs", "gauge", "Background jobs not finished yet", [({}, len(stats["jobs"]))])
+        yield ("cache_api_open_transactions", "gauge", "Open write transactions", [({}, stats["transactions"]["open"])])
+        updates = stats["index_updates"]
+        yield ("cache_api_index_update_requests_total", "counter", "Index updates requested", [({}, updates["requests"])])
+        yield ("cache_api_index_update_batches_total", "counter", "Index update batches run", [({}, updates["batches"])])
+        sectors = stats["sectors"]
+        if sectors is not None:
+            yield ("cache_api_free_sectors", "gauge", "Free sectors in the main cache file", [({}, sectors["free_sectors"])])
+            yield ("cache_api_wasted_bytes", "gauge", "Bytes of the main cache file in free sectors", [({}, sectors["wasted_bytes"])])
+            yield ("cache_api_fragmented_chains", "gauge", "Archives not stored in consecutive sectors",
+                   [({}, sectors["fragmented_chains"])])
+            yield ("cache_api_sectors_written_total", "counter", "Sectors of new chains by where they were placed",
+                   [({"placement": "reused"}, sectors["reused_sectors"]),
+                    ({"placement": "appended"}, sectors["appended_sectors"])])
+
+        jvm = api.jvm_stats()
+        if jvm is None:
+            return
+        heap = jvm["heap"]
+        yield ("jvm_memory_heap_bytes", "gauge", "JVM heap memory",
+               [({"area": area}, heap[area]) for area in ("used", "committed", "max")])
+        yield ("jvm_gc_collections_total", "counter", "JVM garbage collections",
+               [({"gc": gc["name"]}, gc["collections"]) for gc in jvm["gc"]])
+        yield ("jvm_gc_collection_seconds_total", "counter", "Time spent in JVM garbage collection",
+               [({"gc": gc["name"]}, gc["seconds"]) for gc in jvm["gc"]])
+    return collect
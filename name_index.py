@@ -0,0 +1,100 @@
+"""
+Archive Name Index
+This module provides a per-index lookup from archive name hashes to archive ids, so archives
+can be addressed by name without scanning the reference table on every request.
+"""
+
+import threading
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+
+class NameIndex:
+    """Maps (index_id, name_hash) to the lowest archive id with that name hash.
+
+    The table of an index is loaded once, on its first lookup, and is then kept up to date
+    with add and remove by the owner of the cache.
+    """
+
+    def __init__(self, loader: Callable[[int], Iterable[Tuple[int, int]]]):
+        # loader(index_id) yields (name_hash, archive_id) for every archive of the index
+        self.loader = loader
+        self._ids: Dict[int, Dict[int, int]] = {}
+        self._hashes: Dict[int, Dict[int, int]] = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.builds = 0
+
+    def archive_id(self, index_id: int, name_hash: int) -> Optional[int]:
+        self.lookups += 1
+        ids = self._ids.get(index_id)
+        if ids is None:
+            ids = self._build(index_id)
+        return ids.get(name_hash)
+
+    def _build(self, index_id: int) -> Dict[int, int]:
+        ids = {}
+        hashes = {}
+        for name_hash, archive_id in self.loader(index_id):
+            hashes[archive_id] = name_hash
+            current = ids.get(name_hash)
+            if current is None or archive_id < current:
+                ids[name_hash] = archive_id
+        with self._lock:
+            self._ids[index_id] = ids
+            self._hashes[index_id] = hashes
+            self.builds += 1
+        return ids
+
+    def add(self, index_id: int, name_hash: int, archive_id: int):
+        """Record that archive_id of index_id is (now) named name_hash"""
+        with self._lock:
+            ids = self._ids.get(index_id)
+            if ids is None:
+                # Not loaded yet, the loader will see the new archive
+                return
+            hashes = self._hashes[index_id]
+            previous = hashes.get(archive_id)
+            if previous is not None and previous != name_hash and ids.get(previous) == archive_id:
+                self._drop(index_id)
+                return
+            hashes[archive_id] = name_hash
+            current = ids.get(name_hash)
+            if current is None or archive_id < current:
+                ids[name_hash] = archive_id
+
+    def remove(self, index_id: int, archive_id: int):
+        """Forget archive_id of index_id"""
+        with self._lock:
+            hashes = self._hashes.get(index_id)
+            if hashes is None:
+                return
+            name_hash = hashes.pop(archive_id, None)
+            ids = self._ids[index_id]
+            if name_hash is None or ids.get(name_hash) != archive_id:
+                return
+            del ids[name_hash]
+            if any(other == name_hash for other in hashes.values()):
+                # Another archive shares the hash; reload the index rather than track collisions
+                self._drop(index_id)
+
+    def _drop(self, index_id: int):
+        self._ids.pop(index_id, None)
+        self._hashes.pop(index_id, None)
+
+    def invalidate(self, index_id: int):
+        with self._lock:
+            self._drop(index_id)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._hashes.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "indices": sorted(self._ids),
+                "names": sum(len(ids) for ids in self._ids.values()),
+                "lookups": self.lookups,
+                "builds": self.builds
+            }
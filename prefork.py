@@ -0,0 +1,257 @@
+"""
+Pre-fork Launcher
+Runs the cache API as N read-only worker processes accepting connections on one shared socket,
+plus a single writer process. Readers forward every mutating request to the writer, and after
+the writer commits changes to disk (update/rebuild) all readers reload the cache.
+
+Usage: python prefork.py --cache-path /app/cache --workers 4 [--mmap-reader]
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+
+# POST routes that only read the cache and may be served by any reader
+READ_ONLY_ROUTES = {'/data/batch'}
+
+# Transactions, imports and rebuild jobs live in the writer process, so these are forwarded whatever the method
+WRITER_PREFIXES = ('/txn', '/import', '/rebuild')
+
+# Routes managed by the launcher that workers refuse to serve
+LAUNCHER_ROUTES = {'/initialize', '/shutdown'}
+
+# Per-process state that a single worker cannot serve for all of them; use --warm-* instead
+LAUNCHER_PREFIXES = ('/warm', '/hot_set')
+
+# Successful requests to these routes write to disk and trigger a reload of the readers
+COMMIT_PREFIXES = ('/update/',)
+COMMIT_ROUTES = {'/rebuild'}
+
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+                      'te', 'trailers', 'transfer-encoding', 'upgrade'}
+
+logger = logging.getLogger("prefork")
+
+
+def is_mutation(environ) -> bool:
+    if environ.get('PATH_INFO', '').startswith(WRITER_PREFIXES):
+        return True
+    if environ['REQUEST_METHOD'] in ('GET', 'HEAD', 'OPTIONS'):
+        return False
+    return environ.get('PATH_INFO', '') not in READ_ONLY_ROUTES
+
+
+def json_response(start_response, status: str, body: dict):
+    payload = json.dumps(body).encode('utf-8')
+    start_response(status, [('Content-Type', 'application/json'), ('Content-Length', str(len(payload)))])
+    return [payload]
+
+
+class WriterProxy:
+    """WSGI middleware of a reader process that forwards mutations to the writer process"""
+
+    def __init__(self, app, writer_port: int, timeout: float = 600.0):
+        self.app = app
+        self.writer_port = writer_port
+        self.timeout = timeout
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path in LAUNCHER_ROUTES or path.startswith(LAUNCHER_PREFIXES):
+            return json_response(start_response, '409 Conflict', {
+                "status": "error",
+                "message": "The cache is managed by the prefork launcher"
+            })
+        if not is_mutation(environ):
+            return self.app(environ, start_response)
+        return self.forward(environ, start_response)
+
+    def forward(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if environ.get('QUERY_STRING'):
+            path += '?' + environ['QUERY_STRING']
+        headers = {}
+        for key, value in environ.items():
+            if key.startswith('HTTP_'):
+                name = key[5:].replace('_', '-').title()
+                if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() != 'host':
+                    headers[name] = value
+        if environ.get('CONTENT_TYPE'):
+            headers['Content-Type'] = environ['CONTENT_TYPE']
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = environ['wsgi.input'].read(length) if length else b''
+
+        connection = http.client.HTTPConnection('127.0.0.1', self.writer_port, timeout=self.timeout)
+        try:
+            connection.request(environ['REQUEST_METHOD'], path, body=body, headers=headers)
+            response = connection.getresponse()
+            response_headers = [(name, value) for name, value in response.getheaders()
+                                if name.lower() not in HOP_BY_HOP_HEADERS]
+            data = response.read()
+        except OSError as e:
+            return json_response(start_response, '502 Bad Gateway', {
+                "status": "error",
+                "message": f"Failed to reach the writer process: {str(e)}"
+            })
+        finally:
+            connection.close()
+        start_response(f'{response.status} {response.reason}', response_headers)
+        return [data]
+
+
+def run_worker(role: str, fd: int, args, writer_port: int):
+    """Entry point of a forked worker process; starts its own JVM"""
+    import api
+    from cache_api import attach_jvm_thread
+    from serving import serve
+
+    api.cache_api.start_jvm()
+    # Readers forward every write, only the writer allocates sectors
+    api.cache_api.track_free_sectors = role == 'writer'
+    result = api.cache_api.initialize_cache(args.cache_path, use_mmap_reader=args.mmap_reader and role == 'reader',
+                                            lazy=args.lazy)
+    if result["status"] != "success":
+        logger.error("%s %d failed to initialize: %s", role, os.getpid(), result["message"])
+        os._exit(1)
+    if role == 'reader' and (args.warm_indices or args.warm_hot_set):
+        indices = [int(index_id) for index_id in args.warm_indices.split(',')] if args.warm_indices else None
+        result = api.cache_api.start_warm_up(indices, use_hot_set=args.warm_hot_set)
+        if result["status"] != "success":
+            logger.warning("reader %d did not warm up: %s", os.getpid(), result["message"])
+
+    app = api.app
+    if role == 'writer':
+        # Transaction flushes and rebuild jobs write to disk outside of /update requests, e.g. on auto-flush
+        api.cache_api.commit_listeners.append(lambda: os.kill(os.getppid(), signal.SIGUSR1))
+
+        @app.after_request
+        def signal_commit(response):
+            from flask import request
+            if response.status_code == 200 and (request.path.startswith(COMMIT_PREFIXES) or request.path in COMMIT_ROUTES):
+                body = response.get_json(silent=True) or {}
+                if body.get("status") == "success":
+                    os.kill(os.getppid(), signal.SIGUSR1)
+            return response
+        wsgi_app = app.wsgi_app
+        host = '127.0.0.1'
+    else:
+        reload_requested = threading.Event()
+        signal.signal(signal.SIGUSR1, lambda signum, frame: reload_requested.set())
+
+        @app.before_request
+        def reload_if_requested():
+            if reload_requested.is_set():
+                reload_requested.clear()
+                api.cache_api.reload()
+        wsgi_app = WriterProxy(app.wsgi_app, writer_port)
+        host = args.host
+
+    app.wsgi_app = wsgi_app
+    serve(app, host, args.port, args.threads, thread_initializer=attach_jvm_thread, fd=fd,
+          keep_alive_timeout=args.keep_alive)
+    os._exit(0)
+
+
+class Launcher:
+    """Forks and supervises the writer and reader processes"""
+
+    def __init__(self, args):
+        self.args = args
+        self.listener = socket.create_server((args.host, args.port), backlog=1024)
+        self.listener.set_inheritable(True)
+        self.writer_listener = socket.create_server(('127.0.0.1', 0), backlog=128)
+        self.writer_listener.set_inheritable(True)
+        self.writer_port = self.writer_listener.getsockname()[1]
+        self.writer_pid = None
+        self.reader_pids = set()
+        self.running = True
+
+    def spawn(self, role: str) -> int:
+        listener = self.writer_listener if role == 'writer' else self.listener
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                run_worker(role, listener.fileno(), self.args, self.writer_port)
+            finally:
+                os._exit(1)
+        logger.info("Started %s process %d", role, pid)
+        return pid
+
+    def broadcast_reload(self, signum, frame):
+        for pid in list(self.reader_pids):
+            try:
+                os.kill(pid, signal.SIGUSR1)
+            except ProcessLookupError:
+                pass
+
+    def stop(self, signum, frame):
+        self.running = False
+        for pid in list(self.reader_pids) + [self.writer_pid]:
+            if pid is not None:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+    def run(self):
+        signal.signal(signal.SIGUSR1, self.broadcast_reload)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.writer_pid = self.spawn('writer')
+        for _ in range(self.args.workers):
+            self.reader_pids.add(self.spawn('reader'))
+        logger.info("Serving on %s:%d with %d readers", self.args.host, self.args.port, self.args.workers)
+
+        while self.running or self.reader_pids or self.writer_pid:
+            try:
+                pid, status = os.wait()
+            except InterruptedError:
+                continue
+            except ChildProcessError:
+                break
+            if pid == self.writer_pid:
+                self.writer_pid = None
+                if self.running:
+                    logger.warning("Writer %d exited with status %d, restarting", pid, status)
+                    time.sleep(1)
+                    self.writer_pid = self.spawn('writer')
+            elif pid in self.reader_pids:
+                self.reader_pids.discard(pid)
+                if self.running:
+                    logger.warning("Reader %d exited with status %d, restarting", pid, status)
+                    time.sleep(1)
+                    self.reader_pids.add(self.spawn('reader'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cache-path', required=True, help="Cache directory served by every process")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Number of reader processes")
+    parser.add_argument('--threads', type=int, default=8, help="Worker threads per process")
+    parser.add_argument('--keep-alive', type=float, default=5.0, help="Seconds an idle connection is kept open")
+    parser.add_argument('--mmap-reader', action='store_true', help="Serve reads from memory-mapped files")
+    parser.add_argument('--lazy', action='store_true', help="Load each index the first time it is used")
+    parser.add_argument('--warm-indices', help="Comma separated indices every reader warms up in the background")
+    parser.add_argument('--warm-hot-set', action='store_true', help="Warm up the hot set saved next to the cache")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    if not os.path.exists(args.cache_path):
+        sys.exit(f"Cache path does not exist: {args.cache_path}")
+    Launcher(args).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Reader/Writer Lock
+This module provides a writer-preferring reader/writer lock used to let cache reads run in
+parallel while mutations of the shared CacheLibrary run exclusively.
+"""
+
+import threading
+from contextlib import contextmanager
+
+
+class ReadWriteLock:
+    """Many concurrent readers or a single writer; waiting writers block new readers.
+
+    The writer may take the read lock and the write lock again, e.g. to call other methods that
+    read or write. The read lock is not reentrant: a thread holding it must not take it again,
+    as that deadlocks once a writer is waiting, and must not take the write lock.
+
+    freeze keeps writers out without taking the read lock, for long operations that only read,
+    like copying the cache. Readers continue while it is held, writers wait for it without
+    blocking new readers. A thread holding it must not take the write lock.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+        self._freezes = 0
+
+    def acquire_read(self):
+        with self._condition:
+            if self._writer == threading.get_ident():
+                # The writer may read what it is mutating
+                self._writer_depth += 1
+                return
+            while self._writer is not None or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._condition:
+            if self._writer == threading.get_ident():
+                self._writer_depth -= 1
+                return
+            self._readers -= 1
+            if self._readers == 0:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            # Writers held back by a freeze do not count as waiting, so readers continue meanwhile
+            while self._freezes:
+                self._condition.wait()
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        with self._condition:
+            self._writer_depth -= 1
+            if self._writer_depth == 0:
+                self._writer = None
+                self._condition.notify_all()
+
+    def acquire_freeze(self):
+        with self._condition:
+            while self._writer is not None or self._waiting_writers:
+                self._condition.wait()
+            self._freezes += 1
+
+    def release_freeze(self):
+        with self._condition:
+            self._freezes -= 1
+            if self._freezes == 0:
+                self._condition.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+    @contextmanager
+    def freeze(self):
+        self.acquire_freeze()
+        try:
+            yield
+        finally:
+            self.release_freeze()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "readers": self._readers,
+                "writer_active": self._writer is not None,
+                "waiting_writers": self._waiting_writers,
+                "freezes": self._freezes
+            }
@@ -0,0 +1,248 @@
+"""
+Free Sector Map
+This module tracks which sectors of main_file_cache.dat2 belong to an archive's sector chain and
+which are free, so writes can reuse the space of removed archives and shrunk chains instead of
+always appending to the file.
+
+The map is built by following the chain of every archive in the reference tables and of every
+reference table in idx255. Sectors that no chain reaches, like those of archives that were removed
+from their reference table, are free. It is kept up to date through the SectorAllocator of the
+cache library and saved next to the cache, where it is reused as long as the cache files have not
+changed since.
+
+Layout (little-endian):
+    header      magic "SFM1", sha1 fingerprint of the cache files, u32 sector count, u32 chain count
+    directory   per chain: u16 index id, i32 archive id, u32 sector count
+    sectors     i32 positions of all chains, in directory order
+"""
+
+import array
+import hashlib
+import os
+import re
+import struct
+import sys
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from cache_format import CACHE_FILE_NAME, SECTOR_SIZE
+
+
+SECTOR_MAP_FILE_NAME = "sector_map.bin"
+
+MAGIC = b"SFM1"
+HEADER = struct.Struct("<4s20sII")
+CHAIN = struct.Struct("<HiI")
+
+FREE = 1
+USED = 0
+
+_FREE_RUN = re.compile(b"\x01+")
+
+
+def cache_fingerprint(path: str) -> bytes:
+    """Digest of the names, sizes and modification times of the dat2 and idx files at path"""
+    digest = hashlib.sha1()
+    for name in sorted(os.listdir(path)):
+        if name == f"{CACHE_FILE_NAME}.dat2" or name.startswith(f"{CACHE_FILE_NAME}.idx"):
+            stat = os.stat(os.path.join(path, name))
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode("ascii"))
+    return digest.digest()
+
+
+def _chain_is_contiguous(chain) -> bool:
+    return all(chain[i + 1] == chain[i] + 1 for i in range(len(chain) - 1))
+
+
+class SectorMap:
+    """Free sectors of a cache and the sector chain of every archive.
+
+    allocate, written and release implement the cache library's SectorAllocator: allocate hands
+    out the first run of free sectors that fits a whole chain, so chains stay contiguous, written
+    records the sectors a chain was actually written to, freeing the ones it left, and release
+    frees the runs of a chain that could not be written.
+    """
+
+    def __init__(self, sector_count: int, chains: Dict[int, Dict[int, array.array]],
+                 fingerprint: Optional[bytes] = None):
+        self._chains = chains
+        # Digest of the cache files the map is known to match; None once the map changed
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+        self._free = bytearray([FREE]) * sector_count
+        if sector_count:
+            # Sector 0 is never used
+            self._free[0] = USED
+        self._free_count = self._free.count(FREE)
+        self._first_free = 0
+        self._fragmented = 0
+        for archives in chains.values():
+            for chain in archives.values():
+                self._use(chain)
+                self._fragmented += not _chain_is_contiguous(chain)
+        # No free sector comes before this one
+        self._first_free = max(self._free.find(FREE), 0)
+        self.reused = 0
+        self.appended = 0
+
+    @classmethod
+    def scan(cls, reader, job=None) -> "SectorMap":
+        """Follow every referenced chain of the cache open in reader, a CacheReader"""
+        fingerprint = cache_fingerprint(reader.path)
+        chains: Dict[int, Dict[int, array.array]] = {}
+        index_ids = reader.index_ids()
+        for done, index_id in enumerate(index_ids + [255]):
+            table = reader.reference_table(index_id) if index_id != 255 else None
+            if table is not None:
+                archive_ids: Iterable[int] = table.archives
+            else:
+                # Without a reference table every entry is kept
+                archive_ids = range(reader.entry_count(index_id))
+            archives = {}
+            for archive_id in archive_ids:
+                positions = reader.sector_positions(index_id, archive_id)
+                if positions:
+                    archives[archive_id] = array.array("i", positions)
+            chains[index_id] = archives
+            if job is not None:
+                job.update((done + 1) / (len(index_ids) + 1), f"Scanned index {index_id}")
+        main_size = os.path.getsize(os.path.join(reader.path, f"{CACHE_FILE_NAME}.dat2"))
+        return cls((main_size + SECTOR_SIZE - 1) // SECTOR_SIZE, chains, fingerprint)
+
+    @classmethod
+    def load(cls, path: str, cache_path: str) -> Optional["SectorMap"]:
+        """The map saved at path, or None if it is missing, unreadable or the cache changed since"""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            magic, fingerprint, sector_count, chain_count = HEADER.unpack_from(data, 0)
+            if magic != MAGIC or fingerprint != cache_fingerprint(cache_path):
+                return None
+            offset = HEADER.size + CHAIN.size * chain_count
+            chains: Dict[int, Dict[int, array.array]] = {}
+            for i in range(chain_count):
+                index_id, archive_id, length = CHAIN.unpack_from(data, HEADER.size + i * CHAIN.size)
+                chain = array.array("i")
+                chain.frombytes(data[offset:offset + 4 * length])
+                if sys.byteorder == "big":
+                    chain.byteswap()
+                offset += 4 * length
+                chains.setdefault(index_id, {})[archive_id] = chain
+        except (OSError, struct.error, ValueError):
+            return None
+        return cls(sector_count, chains, fingerprint)
+
+    def save(self, path: str, cache_path: str):
+        """Write the map to path atomically, for the cache files as they are now unless it is unchanged"""
+        with self._lock:
+            fingerprint = self.fingerprint or cache_fingerprint(cache_path)
+            directory = []
+            sectors = array.array("i")
+            for index_id, archives in sorted(self._chains.items()):
+                for archive_id, chain in sorted(archives.items()):
+                    directory.append(CHAIN.pack(index_id, archive_id, len(chain)))
+                    sectors.extend(chain)
+            sector_count = len(self._free)
+        if sys.byteorder == "big":
+            sectors.byteswap()
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(HEADER.pack(MAGIC, fingerprint, sector_count, len(directory)))
+            f.writelines(directory)
+            f.write(sectors.tobytes())
+        os.replace(temporary, path)
+        self.fingerprint = fingerprint
+
+    def _use(self, positions: Iterable[int]):
+        for position in positions:
+            if position >= len(self._free):
+                # Appended to the main file
+                gap = position - len(self._free)
+                if gap:
+                    self._first_free = min(self._first_free, len(self._free))
+                self._free.extend(bytes([FREE]) * gap + bytes([USED]))
+                self._free_count += gap
+            elif self._free[position] == FREE:
+                self._free[position] = USED
+                self._free_count -= 1
+
+    def allocate(self, count: int) -> int:
+        """Reserve the first run of count free sectors and return its first position, or 0 if there is none"""
+        if count <= 0:
+            return 0
+        with self._lock:
+            position = self._free.find(bytes([FREE]) * count, self._first_free)
+            if position < 0:
+                self.appended += count
+                return 0
+            self._free[position:position + count] = bytes(count)
+            self._free_count -= count
+            if position == self._first_free:
+                self._first_free = max(self._free.find(FREE, position + count), 0)
+            self.fingerprint = None
+            self.reused += count
+            return position
+
+    def written(self, index_id: int, archive_id: int, positions: List[int]):
+        """Record that an archive's chain now is positions, freeing the sectors it no longer uses"""
+        chain = array.array("i", positions)
+        with self._lock:
+            archives = self._chains.setdefault(index_id, {})
+            previous = archives.get(archive_id)
+            if previous is not None:
+                self._fragmented -= not _chain_is_contiguous(previous)
+                self._release(set(previous).difference(chain))
+            self._use(chain)
+            archives[archive_id] = chain
+            self._fragmented += not _chain_is_contiguous(chain)
+            self.fingerprint = None
+
+    def release(self, position: int, count: int):
+        """Free a run that allocate reserved for a chain that could not be written"""
+        with self._lock:
+            self._release(range(position, position + count))
+            self.reused -= count
+            self.fingerprint = None
+
+    def retain(self, index_id: int, archive_ids: Iterable[int]):
+        """Free the chains of an index's archives that are no longer in its reference table"""
+        keep = set(archive_ids)
+        with self._lock:
+            archives = self._chains.get(index_id, {})
+            for archive_id in [archive_id for archive_id in archives if archive_id not in keep]:
+                chain = archives.pop(archive_id)
+                self._fragmented -= not _chain_is_contiguous(chain)
+                self._release(chain)
+                self.fingerprint = None
+
+    def _release(self, positions: Iterable[int]):
+        for position in positions:
+            if 0 < position < len(self._free) and self._free[position] == USED:
+                self._free[position] = FREE
+                self._free_count += 1
+                self._first_free = min(self._first_free, position)
+
+    def stats(self) -> dict:
+        with self._lock:
+            runs = [match.end() - match.start() for match in _FREE_RUN.finditer(self._free)]
+            chains = sum(len(archives) for archives in self._chains.values())
+            sectors = len(self._free)
+            free = self._free_count
+            fragmented = self._fragmented
+        largest = max(runs, default=0)
+        return {
+            "sectors": sectors,
+            "used_sectors": sectors - free - (1 if sectors else 0),
+            "free_sectors": free,
+            "free_runs": len(runs),
+            "largest_free_run": largest,
+            "wasted_bytes": free * SECTOR_SIZE,
+            "chains": chains,
+            "fragmented_chains": fragmented,
+            # Share of chains that are not stored in consecutive sectors
+            "fragmentation": fragmented / chains if chains else 0.0,
+            # Share of the free space that a single contiguous write can not use
+            "free_space_fragmentation": 1 - largest / free if free else 0.0,
+            "reused_sectors": self.reused,
+            "appended_sectors": self.appended
+        }
@@ -0,0 +1,250 @@
+"""
+Production WSGI Server
+This module provides a thread-pooled WSGI server for the cache API. Requests are handled by a
+fixed pool of worker threads that are attached to the JVM once, when the thread starts.
+
+Connections are kept alive between requests. A worker thread stays with its connection while it
+waits for the next request, so an idle connection is closed after keep_alive_timeout seconds, or
+as soon as another connection is waiting for a worker while every worker is busy.
+"""
+
+import logging
+import selectors
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from werkzeug.exceptions import InternalServerError
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from werkzeug.wsgi import LimitedStream
+
+import metrics
+
+
+# Unread request bodies up to this size are discarded to keep the connection, larger ones close it
+MAX_DISCARD_BYTES = 64 * 1024
+# How often an idle connection checks whether other connections wait for a worker
+IDLE_POLL_SECONDS = 0.05
+
+
+class PooledWSGIRequestHandler(WSGIRequestHandler):
+    """Request handler that keeps HTTP/1.1 connections open between requests.
+
+    werkzeug's handler closes every connection after one response. This one limits wsgi.input to
+    the Content-Length and discards what the application left unread, so the next request line
+    can be read from the same connection. It closes the connection when the client asks for it,
+    the request body is chunked or too large to discard, the response has neither a length nor
+    chunked encoding, or the application failed after the response started.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.handled_requests = 0
+
+    def handle_one_request(self):
+        if self.handled_requests and not self._wait_for_request():
+            self.close_connection = True
+            return
+        super().handle_one_request()
+        self.handled_requests += 1
+
+    def _wait_for_request(self) -> bool:
+        """Wait until the client sends its next request, the connection idled out or is needed elsewhere"""
+        if self._request_buffered():
+            return True
+        deadline = time.monotonic() + self.server.keep_alive_timeout
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.connection, selectors.EVENT_READ)
+            while not self.server.workers_needed():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                if selector.select(min(remaining, IDLE_POLL_SECONDS)):
+                    return True
+        return False
+
+    def _request_buffered(self) -> bool:
+        """Whether the next request was already read into rfile, e.g. while discarding a request body"""
+        timeout = self.connection.gettimeout()
+        self.connection.setblocking(False)
+        try:
+            # Returns what is buffered, or what one non-blocking read gets when nothing is
+            return bool(self.rfile.peek(1))
+        finally:
+            self.connection.settimeout(timeout)
+
+    def run_wsgi(self):
+        if self.headers.get("Expect", "").lower().strip() == "100-continue":
+            self.wfile.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+        self.environ = environ = self.make_environ()
+        body = None
+        if environ.get("wsgi.input_terminated"):
+            # A chunked body can only be skipped by decoding it
+            self.close_connection = True
+        else:
+            try:
+                length = max(int(environ.get("CONTENT_LENGTH") or 0), 0)
+            except ValueError:
+                length = 0
+                self.close_connection = True
+            body = LimitedStream(self.rfile, length)
+            environ["wsgi.input"] = body
+            environ["wsgi.input_terminated"] = True
+
+        status_set: Optional[str] = None
+        headers_set: Optional[list] = None
+        headers_sent = False
+        chunk_response = False
+
+        def write(data: bytes):
+            nonlocal headers_sent, chunk_response
+            assert status_set is not None and headers_set is not None, "write() before start_response"
+            if not headers_sent:
+                headers_sent = True
+                code_str, _, msg = status_set.partition(" ")
+                code = int(code_str)
+                self.send_response(code, msg)
+                header_keys = set()
+                for key, value in headers_set:
+                    self.send_header(key, value)
+                    header_keys.add(key.lower())
+                if not ("content-length" in header_keys or environ["REQUEST_METHOD"] == "HEAD"
+                        or 100 <= code < 200 or code in (204, 304)):
+                    if self.request_version == "HTTP/1.1":
+                        chunk_response = True
+                        self.send_header("Transfer-Encoding", "chunked")
+                    else:
+                        # Only closing the connection ends the response
+                        self.close_connection = True
+                if body is not None and body.limit - body.tell() > MAX_DISCARD_BYTES:
+                    self.close_connection = True
+                if self.close_connection:
+                    self.send_header("Connection", "close")
+                elif self.request_version != "HTTP/1.1":
+                    self.send_header("Connection", "keep-alive")
+                self.end_headers()
+
+            assert isinstance(data, bytes), "applications must write bytes"
+            if data:
+                if chunk_response:
+                    self.wfile.write(f"{len(data):x}\r\n".encode("ascii"))
+                self.wfile.write(data)
+                if chunk_response:
+                    self.wfile.write(b"\r\n")
+            self.wfile.flush()
+
+        def start_response(status, headers, exc_info=None):
+            nonlocal status_set, headers_set
+            if exc_info:
+                try:
+                    if headers_sent:
+                        raise exc_info[1].with_traceback(exc_info[2])
+                finally:
+                    exc_info = None
+            elif headers_set:
+                raise AssertionError("Headers already set")
+            status_set = status
+            headers_set = headers
+            return write
+
+        def execute(app):
+            application_iter = app(environ, start_response)
+            try:
+                for data in application_iter:
+                    write(data)
+                if not headers_sent:
+                    write(b"")
+                if chunk_response:
+                    self.wfile.write(b"0\r\n\r\n")
+                    self.wfile.flush()
+            finally:
+                if hasattr(application_iter, "close"):
+                    application_iter.close()
+
+        try:
+            execute(self.server.app)
+            if not self.close_connection and body is not None:
+                body.exhaust()
+        except (ConnectionError, socket.timeout) as e:
+            self.close_connection = True
+            self.connection_dropped(e, environ)
+        except Exception:
+            if self.server.passthrough_errors:
+                raise
+            self.close_connection = True
+            self.server.log("error", "Error on request:\n%s", traceback.format_exc())
+            if not headers_sent:
+                status_set = None
+                headers_set = None
+                try:
+                    execute(InternalServerError())
+                except Exception:
+                    pass
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """A WSGI server that dispatches connections to a bounded thread pool"""
+
+    multithread = True
+
+    def __init__(self, host: str, port: int, app, threads: int = 8,
+                 thread_initializer: Optional[Callable[[], None]] = None, fd: Optional[int] = None,
+                 keep_alive_timeout: float = 5.0):
+        super().__init__(host, port, app, handler=PooledWSGIRequestHandler, fd=fd)
+        self.threads = threads
+        self.keep_alive_timeout = keep_alive_timeout
+        # Accepted connections that no worker thread has picked up yet
+        self.waiting_connections = 0
+        # Worker threads that handle a connection
+        self.busy_workers = 0
+        self._waiting_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="cache-api",
+                                           initializer=thread_initializer)
+
+    def process_request(self, request, client_address):
+        metrics.CONNECTIONS.inc()
+        with self._waiting_lock:
+            self.waiting_connections += 1
+        self.executor.submit(self._process_request_thread, request, client_address)
+
+    def workers_needed(self) -> bool:
+        """Whether a connection waits for a worker that is only freed by closing an idle connection"""
+        with self._waiting_lock:
+            return self.waiting_connections > 0 and self.busy_workers >= self.threads
+
+    def _process_request_thread(self, request, client_address):
+        with self._waiting_lock:
+            self.waiting_connections -= 1
+            self.busy_workers += 1
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self._waiting_lock:
+                self.busy_workers -= 1
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+
+def serve(app, host: str = "0.0.0.0", port: int = 5000, threads: int = 8,
+          thread_initializer: Optional[Callable[[], None]] = None, fd: Optional[int] = None,
+          keep_alive_timeout: float = 5.0):
+    """Serve app with a PooledWSGIServer until interrupted"""
+    server = PooledWSGIServer(host, port, app, threads, thread_initializer, fd, keep_alive_timeout)
+    logging.getLogger(__name__).info("Serving on http://%s:%d with %d threads", host, server.port, threads)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
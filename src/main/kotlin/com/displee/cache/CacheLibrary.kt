@@ -22,12 +22,22 @@ import java.io.IOException
 import java.io.RandomAccessFile
 import java.math.BigInteger
 import java.util.*
+import java.util.concurrent.atomic.AtomicReferenceArray
 
-open class CacheLibrary(val path: String, val clearDataAfterUpdate: Boolean = false, private val listener: ProgressListener? = null) {
+/**
+ * @param lazy when true, an index and its reference table are only loaded the first time [index] asks for it.
+ */
+open class CacheLibrary(val path: String, val clearDataAfterUpdate: Boolean = false, private val listener: ProgressListener? = null,
+                        val lazy: Boolean = false) {
 
     lateinit var mainFile: RandomAccessFile
 
-    internal val indices = arrayOfNulls<Index?>(100)
+    /**
+     * Loaded indices. Atomic, so an index that [loadIndex] loads on one thread is safely published to the
+     * threads that read it through [index] without taking the library's lock.
+     */
+    internal val indices = AtomicReferenceArray<Index?>(100)
+    private val unloadedIndices = AtomicReferenceArray<File?>(100)
     val compressors = Compressors()
     val whirlpool = Whirlpool()
     var index255: Index255? = null
@@ -35,8 +45,21 @@ open class CacheLibrary(val path: String, val clearDataAfterUpdate: Boolean = fa
 
     var closed = false
 
+    /**
+     * When set, new and grown sector chains are placed in the sectors it hands out instead of at the end of the main file.
+     */
+    @Volatile
+    var sectorAllocator: SectorAllocator? = null
+
     private val indexCount: Int
-        get() = indices.indexOf(null) - 1
+        get() {
+            for (i in 0 until indices.length()) {
+                if (indices[i] == null && unloadedIndices[i] == null) {
+                    return i - 1
+                }
+            }
+            return indices.length() - 1
+        }
 
     init {
         init()
@@ -56,7 +79,16 @@ open class CacheLibrary(val path: String, val clearDataAfterUpdate: Boolean = fa
      * Re-create indices and re-read reference tables.
      */
     fun reload() {
-        indices.fill(null)
+        mainFile.close()
+        index255?.close()
+        for (index in loadedIndices()) {
+            index.close()
+        }
+        for (i in 0 until indices.length()) {
+            indices[i] = null
+            unloadedIndices[i] = null
+        }
+        index255 = null
         init()
     }
 
@@ -87,6 +119,11 @@ open class CacheLibrary(val path: String, val clearDataAfterUpdate: Boolean = fa
                 listener?.notify(progress, "Could not load index $i, missing idx file.")
                 continue
             }
+            if (lazy) {
+                unloadedIndices[i] = file
+                listener?.notify(progress, "Found index $i.")
+                continue
+            }
             try {
                 indices[i] = Index(this, i, RandomAccessFile(file, "rw"))
                 listener?.notify(progress, "Loaded index $i.")
@@ -119,6 +156,11 @@ open class CacheLibrary(val path: String, val clearDataAfterUpdate: Boolean = fa
                 indices[i] = null
                 continue
             }
+            if (lazy) {
+                unloadedIndices[i] = file
+                listener?.notify(progress, "Found index $i.")
+                continue
+            }
             try {
                 indices[i] = Index317(this, i, RandomAccessFile(file, "rw"))
                 listener?.notify(progress, "Loaded index $i .")
@@ -136,6 +178,7 @@ open class CacheLibrary(val path: String, val clearDataAfterUpdate: Boolean = fa
                     writeReferenceTable: Boolean = true, id: Int = indexCount + 1): Index {
         val raf = RandomAccessFile(File(path, "$CACHE_FILE_NAME.idx$id"), "rw")
         val index = (if (is317()) Index317(this, id, raf) else Index(this, id, raf)).also { indices[id] = it }
+        unloadedIndices[id] = null
         if (!writeReferenceTable) {
             return index
         }
@@ -166,14 +209,68 @@ open class CacheLibrary(val path: String, val clearDataAfterUpdate: Boolean = fa
     }
 
     fun exists(id: Int): Boolean {
-        return indices.getOrNull(id) != null
+        // Unloaded first, an index is stored before its file is cleared
+        return unloadedIndex(id) != null || loadedIndex(id) != null
+    }
+
+    /**
+     * Whether the reference table of index [id] has been read. Always true for existing indices unless [lazy].
+     */
+    fun loaded(id: Int): Boolean {
+        return loadedIndex(id) != null
+    }
+
+    /**
+     * The ids of all existing indices, loaded or not.
+     */
+    fun indexIds(): IntArray {
+        return (0 until indices.length()).filter { exists(it) }.toIntArray()
     }
 
     fun index(id: Int): Index {
-        val index = indices.getOrNull(id)
+        val index = loadedIndex(id) ?: loadIndex(id)
         return checkNotNull(index) { "Index $id doesn't exist. Please use the {@link exists(int) exists} function to verify whether an index exists." }
     }
 
+    @Synchronized
+    private fun loadIndex(id: Int): Index? {
+        loadedIndex(id)?.let { return it }
+        val file = unloadedIndex(id) ?: return null
+        val raf = RandomAccessFile(file, "rw")
+        val index = try {
+            if (is317()) Index317(this, id, raf) else Index(this, id, raf)
+        } catch (e: Exception) {
+            raf.close()
+            throw e
+        }
+        indices[id] = index
+        unloadedIndices[id] = null
+        return index
+    }
+
+    private fun loadedIndex(id: Int): Index? {
+        return if (id in 0 until indices.length()) indices[id] else null
+    }
+
+    private fun unloadedIndex(id: Int): File? {
+        return if (id in 0 until unloadedIndices.length()) unloadedIndices[id] else null
+    }
+
+    private fun loadedIndices(): List<Index> {
+        return (0 until indices.length()).mapNotNull { indices[it] }
+    }
+
+    /**
+     * Load every index that has not been loaded yet.
+     */
+    fun loadIndices() {
+        for (i in 0 until unloadedIndices.length()) {
+            if (unloadedIndices[i] != null) {
+                loadIndex(i)
+            }
+        }
+    }
+
     @JvmOverloads
     fun put(index: Int, archive: Int, file: Int, data: ByteArray, xtea: IntArray? = null): com.displee.cache.index.archive.file.File {
         return index(index).add(archive, xtea = xtea).add(file, data)
@@ -233,6 +330,15 @@ open class CacheLibrary(val path: String, val clearDataAfterUpdate: Boolean = fa
         return data(index, archive, 0, xtea)
     }
 
+    /**
+     * Read several files of one archive at once, decoding the archive a single time.
+     */
+    @JvmOverloads
+    fun data(index: Int, archive: Int, files: IntArray, xtea: IntArray? = null): Array<ByteArray?> {
+        val currentArchive = index(index).archive(archive, xtea) ?: return arrayOfNulls(files.size)
+        return Array(files.size) { currentArchive.file(files[it])?.data }
+    }
+
     fun remove(index: Int, archive: Int, file: Int): com.displee.cache.index.archive.file.File? {
         return index(index).archive(archive)?.remove(file)
     }
@@ -258,10 +364,7 @@ open class CacheLibrary(val path: String, val clearDataAfterUpdate: Boolean = fa
     }
 
     fun update() {
-        for (index in indices) {
-            if (index == null) {
-                continue
-            }
+        for (index in loadedIndices()) {
             if (index.flaggedArchives().isEmpty() && !index.flagged()) {
                 continue
             }
@@ -275,7 +378,10 @@ open class CacheLibrary(val path: String, val clearDataAfterUpdate: Boolean = fa
             throw UnsupportedOperationException("317 not supported to remove indices yet.")
         }
         val id = indexCount
-        val index = indices.getOrNull(id) ?: return
+        if (!exists(id)) {
+            return
+        }
+        val index = index(id)
         index.close()
         val file = File(path, "$CACHE_FILE_NAME.idx$id")
         if (!file.exists() || !file.delete()) {
@@ -310,7 +416,17 @@ open class CacheLibrary(val path: String, val clearDataAfterUpdate: Boolean = fa
         return buffer.array()
     }
 
-    fun rebuild(directory: File) {
+    /**
+     * Write a defragmented copy of this cache to [directory].
+     *
+     * With [indexIds], only those indices are written; the other indices of a cache that was rebuilt to
+     * [directory] before are kept as they are. The rebuilt indices are cleared first, and their archives are
+     * written to the sectors their previous archives and reference tables used before the main file grows.
+     * The [listener] can abort the rebuild by throwing from [ProgressListener.notify].
+     */
+    @JvmOverloads
+    fun rebuild(directory: File, listener: ProgressListener? = null, indexIds: IntArray? = null) {
+        require(indexIds == null || !is317()) { "Incremental rebuilds are not supported for 317 caches." }
         File(directory.path).mkdirs()
         if (is317()) {
             File(directory.path, "$CACHE_FILE_NAME.dat").createNewFile()
@@ -318,35 +434,83 @@ open class CacheLibrary(val path: String, val clearDataAfterUpdate: Boolean = fa
             File(directory.path, "$CACHE_FILE_NAME.idx255").createNewFile()
             File(directory.path, "$CACHE_FILE_NAME.dat2").createNewFile()
         }
-        val indicesSize = indices.count { it != null }
-        val newLibrary = CacheLibrary(directory.path)
-        for (index in indices) {
-            if (index == null) {
-                continue
-            }
-            val id = index.id
-            print("\rBuilding index $id/$indicesSize...")
-            val archiveSector = index255?.readArchiveSector(id)
-            var writeReferenceTable = true
-            if (!is317() && archiveSector == null) { //some empty indices don't even have a reference table
-                writeReferenceTable = false //in that case, don't write it
-            }
-            val newIndex = newLibrary.createIndex(index, writeReferenceTable)
-            for (i in index.archiveIds()) { //only write referenced archives
-                val data = index.readArchiveSector(i)?.data ?: continue
-                newIndex.writeArchiveSector(i, data)
-            }
-            if (archiveSector != null) {
-                newLibrary.index255?.writeArchiveSector(id, archiveSector.data)
+        loadIndices()
+        val rebuilt = loadedIndices().filter { indexIds == null || it.id in indexIds }
+        val indicesSize = rebuilt.size
+        val archivesSize = rebuilt.sumOf { it.archiveIds().size }.coerceAtLeast(1)
+        var archivesDone = 0
+        val freed = if (indexIds != null) clearIndices(directory, rebuilt.map { it.id }) else null
+        // Lazy, so idx files of indices that are kept are never opened
+        val newLibrary = CacheLibrary(directory.path, lazy = true)
+        if (freed != null) {
+            newLibrary.sectorAllocator = FreeSectorAllocator(freed)
+        }
+        try {
+            for (index in rebuilt) {
+                val id = index.id
+                print("\rBuilding index $id/$indicesSize...")
+                listener?.notify(archivesDone.toDouble() / archivesSize, "Building index $id...")
+                val archiveSector = index255?.readArchiveSector(id)
+                var writeReferenceTable = true
+                if (!is317() && archiveSector == null) { //some empty indices don't even have a reference table
+                    writeReferenceTable = false //in that case, don't write it
+                }
+                val newIndex = newLibrary.createIndex(index, writeReferenceTable)
+                for (i in index.archiveIds()) { //only write referenced archives
+                    archivesDone++
+                    if (archivesDone % 256 == 0) {
+                        listener?.notify(archivesDone.toDouble() / archivesSize, "Building index $id...")
+                    }
+                    val data = index.readArchiveSector(i)?.data ?: continue
+                    check(newIndex.writeArchiveSector(i, data)) { "Unable to write archive $i of index $id to ${directory.path}." }
+                }
+                if (archiveSector != null) {
+                    val written = newLibrary.index255?.writeArchiveSector(id, archiveSector.data) ?: false
+                    check(written) { "Unable to write the reference table of index $id to ${directory.path}." }
+                }
             }
+        } finally {
+            newLibrary.close()
         }
-        newLibrary.close()
+        listener?.notify(1.0, "Finished building $indicesSize indices.")
         println("\rFinished building $indicesSize indices.")
     }
 
+    /**
+     * Empty the indices [ids] of the cache at [directory] for an incremental rebuild: their reference tables are
+     * removed from idx255 and their idx files truncated. Returns the sectors the chains of both used.
+     */
+    private fun clearIndices(directory: File, ids: List<Int>): BitSet {
+        val freed = BitSet()
+        val library = CacheLibrary(directory.path, lazy = true)
+        try {
+            val index255 = library.index255 ?: return freed
+            for (id in ids) {
+                index255.sectorPositions(id).forEach { freed.set(it) }
+                if (INDEX_SIZE * id + INDEX_SIZE <= index255.raf.length()) {
+                    index255.raf.seek(id.toLong() * INDEX_SIZE)
+                    index255.raf.write(ByteArray(INDEX_SIZE))
+                }
+                if (!library.exists(id)) {
+                    continue
+                }
+                // Loaded after its reference table was removed, so it has no archives to read
+                val index = library.index(id)
+                for (archive in 0 until (index.raf.length() / INDEX_SIZE).toInt()) {
+                    index.sectorPositions(archive).forEach { freed.set(it) }
+                }
+                index.raf.setLength(0)
+            }
+        } finally {
+            library.close()
+        }
+        return freed
+    }
+
     fun fixCrcs(update: Boolean) {
-        for(index in indices) {
-            if (index == null || index.archiveIds().isEmpty()) {
+        loadIndices()
+        for (index in loadedIndices()) {
+            if (index.archiveIds().isEmpty()) {
                 continue
             }
             index.fixCRCs(update)
@@ -359,21 +523,21 @@ open class CacheLibrary(val path: String, val clearDataAfterUpdate: Boolean = fa
         }
         mainFile.close()
         index255?.close()
-        for (index in indices) {
-            index?.close()
+        for (index in loadedIndices()) {
+            index.close()
         }
         closed = true
     }
 
     fun first(): Index? {
-        return indices[0]
+        return if (exists(0)) index(0) else null
     }
 
     fun last(): Index? {
-        if (indices.isEmpty()) {
+        if (indices.length() == 0) {
             return null
         }
-        return indices.getOrNull(indices.lastIndex)
+        return indices[indices.length() - 1]
     }
 
     fun is317(): Boolean {
@@ -390,7 +554,8 @@ open class CacheLibrary(val path: String, val clearDataAfterUpdate: Boolean = fa
     }
 
     fun indices(): Array<Index> {
-        return indices.filterNotNull().toTypedArray()
+        loadIndices()
+        return loadedIndices().toTypedArray()
     }
 
     companion object {
@@ -398,8 +563,9 @@ open class CacheLibrary(val path: String, val clearDataAfterUpdate: Boolean = fa
 
         @JvmStatic
         @JvmOverloads
-        fun create(path: String, clearDataAfterUpdate: Boolean = false, listener: ProgressListener? = null): CacheLibrary {
-            return CacheLibrary(path, clearDataAfterUpdate, listener)
+        fun create(path: String, clearDataAfterUpdate: Boolean = false, listener: ProgressListener? = null,
+                   lazy: Boolean = false): CacheLibrary {
+            return CacheLibrary(path, clearDataAfterUpdate, listener, lazy)
         }
     }
 
@@ -0,0 +1,53 @@
+package com.displee.cache
+
+import java.util.BitSet
+
+/**
+ * Chooses where new sector chains are written in the main file, see [CacheLibrary.sectorAllocator].
+ */
+interface SectorAllocator {
+
+    /**
+     * Reserve [count] consecutive free sectors and return the position of the first one, or 0 to append them to the main file.
+     */
+    fun allocate(count: Int): Int
+
+    /**
+     * Called after archive [archive] of index [index] has been written to the sectors [positions], in chain order.
+     */
+    fun written(index: Int, archive: Int, positions: IntArray)
+
+    /**
+     * Called when a chain could not be written, for each run of [count] sectors at [position] that [allocate] reserved for it.
+     */
+    fun release(position: Int, count: Int)
+
+}
+
+/**
+ * Hands out the sectors set in [free], first fit. Used by [CacheLibrary.rebuild] to write over the chains of the indices an
+ * incremental rebuild replaces.
+ */
+internal class FreeSectorAllocator(private val free: BitSet) : SectorAllocator {
+
+    override fun allocate(count: Int): Int {
+        var start = free.nextSetBit(1)
+        while (start >= 0) {
+            val end = free.nextClearBit(start)
+            if (end - start >= count) {
+                free.clear(start, start + count)
+                return start
+            }
+            start = free.nextSetBit(end)
+        }
+        return 0
+    }
+
+    override fun written(index: Int, archive: Int, positions: IntArray) {
+    }
+
+    override fun release(position: Int, count: Int) {
+        free.set(position, position + count)
+    }
+
+}
@@ -2,6 +2,7 @@ package com.displee.cache.index
 
 import com.displee.cache.CacheLibrary
 import com.displee.cache.ProgressListener
+import com.displee.cache.SectorAllocator
 import com.displee.cache.index.archive.Archive
 import com.displee.cache.index.archive.ArchiveSector
 import com.displee.compress.CompressionType
@@ -44,19 +45,34 @@ open class Index(origin: CacheLibrary, id: Int, val raf: RandomAccessFile) : Ref
         compressor = archiveSector.compressor
     }
 
-    fun cache() {
+    @JvmOverloads
+    fun cache(listener: ProgressListener? = null) {
         check(!closed) { "Index is closed." }
         if (cached) {
             return
         }
-        archives.values.forEach {
-            try {
-                archive(it.id, it.xtea, false)
-            } catch (t: Throwable) {
-                t.printStackTrace()
+        cache(archiveIds(), listener)
+        cached = true
+    }
+
+    /**
+     * Read and decode the given archives, so later lookups are served from memory.
+     * Exceptions thrown by the listener abort caching.
+     */
+    @JvmOverloads
+    fun cache(ids: IntArray, listener: ProgressListener? = null) {
+        check(!closed) { "Index is closed." }
+        ids.forEachIndexed { i, id ->
+            val archive = archives[id]
+            if (archive != null) {
+                try {
+                    archive(id, archive.xtea, false)
+                } catch (t: Throwable) {
+                    t.printStackTrace()
+                }
             }
+            listener?.notify((i + 1).toDouble() / ids.size, "Cached archive $id of index ${this.id}.")
         }
-        cached = true
     }
 
     fun unCache() {
@@ -78,7 +94,17 @@ open class Index(origin: CacheLibrary, id: Int, val raf: RandomAccessFile) : Ref
             }
             it.unFlag()
             listener?.notify((i / flaggedArchives.size) * 0.80, "Repacking archive ${it.id}...")
-            val compressed = it.write().compress(it.compressionType, it.compressor, it.xtea, it.revision)
+            val precompressed = it.precompressed
+            it.precompressed = null
+            val compressed = if (precompressed != null) {
+                val revision = it.revision
+                precompressed.copyOf(precompressed.size + 2).also { data ->
+                    data[precompressed.size] = (revision shr 8).toByte()
+                    data[precompressed.size + 1] = revision.toByte()
+                }
+            } else {
+                it.write().compress(it.compressionType, it.compressor, it.xtea, it.revision)
+            }
             it.crc = compressed.generateCrc(length = compressed.size - 2)
             it.whirlpool = compressed.generateWhirlpool(origin.whirlpool, length = compressed.size - 2)
             val written = writeArchiveSector(it.id, compressed)
@@ -157,64 +183,161 @@ open class Index(origin: CacheLibrary, id: Int, val raf: RandomAccessFile) : Ref
         }
     }
 
-    fun writeArchiveSector(id: Int, data: ByteArray): Boolean {
+    /**
+     * The positions of the sectors archive [id] is stored in, in chain order. Empty when it has no valid chain.
+     */
+    fun sectorPositions(id: Int): IntArray {
         check(!closed) { "Index is closed." }
         synchronized(origin.mainFile) {
-            return try {
-                var position: Int
-                var archive: Archive? = null
-                var archiveSector: ArchiveSector? = readArchiveSector(id)
-                if (this.id != 255) {
-                    archive = archive(id, null, true)
+            try {
+                if (raf.length() < INDEX_SIZE * id + INDEX_SIZE) {
+                    return IntArray(0)
                 }
-                var overWrite = this.id == 255 && archiveSector != null || archive?.new == false
                 val sectorData = ByteArray(SECTOR_SIZE)
+                raf.seek(id.toLong() * INDEX_SIZE)
+                raf.readFully(sectorData, 0, INDEX_SIZE)
                 val bigSector = id > 65535
-                if (overWrite) {
-                    if (INDEX_SIZE * id + INDEX_SIZE > raf.length()) {
-                        return false
-                    }
-                    raf.seek(id.toLong() * INDEX_SIZE)
-                    raf.read(sectorData, 0, INDEX_SIZE)
-                    val buffer = InputBuffer(sectorData)
-                    buffer.offset += 3
-                    position = buffer.read24BitInt()
-                    if (position <= 0 || position > origin.mainFile.length() / SECTOR_SIZE) {
-                        return false
+                val buffer = InputBuffer(sectorData)
+                val size = buffer.read24BitInt()
+                //only the headers are read, so the sector holds no data
+                val archiveSector = ArchiveSector(bigSector, 0, buffer.read24BitInt())
+                val sectorHeaderSize = if (bigSector) SECTOR_HEADER_SIZE_BIG else SECTOR_HEADER_SIZE_SMALL
+                val sectorDataSize = if (bigSector) SECTOR_DATA_SIZE_BIG else SECTOR_DATA_SIZE_SMALL
+                val sectorCount = origin.mainFile.length() / SECTOR_SIZE
+                if (size <= 0) {
+                    return IntArray(0)
+                }
+                val positions = IntArray((size + sectorDataSize - 1) / sectorDataSize)
+                for (chunk in positions.indices) {
+                    val position = archiveSector.position
+                    if (position <= 0 || position > sectorCount) {
+                        return IntArray(0)
                     }
-                } else {
-                    position = ((origin.mainFile.length() + (SECTOR_SIZE - 1)) / SECTOR_SIZE).toInt()
-                    if (position == 0) {
-                        position = 1
+                    origin.mainFile.seek(position.toLong() * SECTOR_SIZE)
+                    origin.mainFile.readFully(sectorData, 0, sectorHeaderSize)
+                    buffer.offset = 0
+                    archiveSector.read(buffer)
+                    if (!isIndexValid(archiveSector.index) || id != archiveSector.id || chunk != archiveSector.chunk) {
+                        return IntArray(0)
                     }
-                    archiveSector = ArchiveSector(bigSector, data.size, position, id, indexToWrite(this.id))
+                    positions[chunk] = position
+                    archiveSector.position = archiveSector.nextPosition
                 }
-                archiveSector ?: return false
-                val buffer = OutputBuffer(6)
-                buffer.write24BitInt(data.size)
-                buffer.write24BitInt(position)
-                raf.seek(id.toLong() * INDEX_SIZE)
-                raf.write(buffer.array(), 0, INDEX_SIZE)
-                var written = 0
-                var chunk = 0
-                val archiveHeaderSize = if (bigSector) SECTOR_HEADER_SIZE_BIG else SECTOR_HEADER_SIZE_SMALL
-                val archiveDataSize = if (bigSector) SECTOR_DATA_SIZE_BIG else SECTOR_DATA_SIZE_SMALL
-                while (written < data.size) {
-                    var currentPosition = 0
-                    if (overWrite) {
-                        origin.mainFile.seek(position.toLong() * SECTOR_SIZE)
-                        origin.mainFile.read(sectorData, 0, archiveHeaderSize)
-                        archiveSector.read(InputBuffer(sectorData))
-                        currentPosition = archiveSector.nextPosition
-                        if (archiveSector.id != id || archiveSector.chunk != chunk || !isIndexValid(archiveSector.index)) {
-                            return false
-                        }
-                        if (currentPosition < 0 || origin.mainFile.length() / SECTOR_SIZE < currentPosition) {
-                            return false
-                        }
-                    }
-                    if (currentPosition == 0) {
-                        overWrite = false
+                return positions
+            } catch (exception: Exception) {
+                return IntArray(0)
+            }
+        }
+    }
+
+    fun writeArchiveSector(id: Int, data: ByteArray): Boolean {
+        check(!closed) { "Index is closed." }
+        synchronized(origin.mainFile) {
+            val allocator = origin.sectorAllocator
+            //runs of [position, count] sectors the allocator reserved for the chain
+            val runs = ArrayList<IntArray>()
+            val positions = try {
+                writeSectorChain(id, data, allocator, runs)
+            } catch (t: Throwable) {
+                t.printStackTrace()
+                null
+            }
+            if (positions == null) {
+                //the chain was not written, so the sectors reserved for it are free again
+                for (run in runs) {
+                    allocator?.release(run[0], run[1])
+                }
+                return false
+            }
+            allocator?.written(this.id, id, positions)
+            return true
+        }
+    }
+
+    /**
+     * Write [data] as the sector chain of archive [id] and return the positions it was written to, in chain order, or null
+     * if it could not be written. The runs [allocator] reserved are added to [runs].
+     */
+    private fun writeSectorChain(id: Int, data: ByteArray, allocator: SectorAllocator?, runs: MutableList<IntArray>): IntArray? {
+        var position: Int
+        var archive: Archive? = null
+        var archiveSector: ArchiveSector? = readArchiveSector(id)
+        if (this.id != 255) {
+            archive = archive(id, null, true)
+        }
+        var overWrite = this.id == 255 && archiveSector != null || archive?.new == false
+        val sectorData = ByteArray(SECTOR_SIZE)
+        val bigSector = id > 65535
+        val archiveHeaderSize = if (bigSector) SECTOR_HEADER_SIZE_BIG else SECTOR_HEADER_SIZE_SMALL
+        val archiveDataSize = if (bigSector) SECTOR_DATA_SIZE_BIG else SECTOR_DATA_SIZE_SMALL
+        val sectorCount = (data.size + archiveDataSize - 1) / archiveDataSize
+        //sectors directly after position that the allocator reserved for this chain
+        var reserved = 0
+        //once the allocator has no room left, the rest of the chain is appended
+        var allocating = allocator
+        if (overWrite) {
+            if (INDEX_SIZE * id + INDEX_SIZE > raf.length()) {
+                return null
+            }
+            raf.seek(id.toLong() * INDEX_SIZE)
+            raf.read(sectorData, 0, INDEX_SIZE)
+            val buffer = InputBuffer(sectorData)
+            buffer.offset += 3
+            position = buffer.read24BitInt()
+            if (position <= 0 || position > origin.mainFile.length() / SECTOR_SIZE) {
+                return null
+            }
+        } else {
+            position = if (sectorCount > 0) allocating?.allocate(sectorCount) ?: 0 else 0
+            if (position > 0) {
+                runs.add(intArrayOf(position, sectorCount))
+                reserved = sectorCount - 1
+            } else {
+                allocating = null
+                position = ((origin.mainFile.length() + (SECTOR_SIZE - 1)) / SECTOR_SIZE).toInt()
+                if (position == 0) {
+                    position = 1
+                }
+            }
+            archiveSector = ArchiveSector(bigSector, data.size, position, id, indexToWrite(this.id))
+        }
+        archiveSector ?: return null
+        val buffer = OutputBuffer(6)
+        buffer.write24BitInt(data.size)
+        buffer.write24BitInt(position)
+        raf.seek(id.toLong() * INDEX_SIZE)
+        raf.write(buffer.array(), 0, INDEX_SIZE)
+        val positions = IntArray(sectorCount)
+        var written = 0
+        var chunk = 0
+        while (written < data.size) {
+            var currentPosition = 0
+            if (overWrite) {
+                origin.mainFile.seek(position.toLong() * SECTOR_SIZE)
+                origin.mainFile.read(sectorData, 0, archiveHeaderSize)
+                archiveSector.read(InputBuffer(sectorData))
+                currentPosition = archiveSector.nextPosition
+                if (archiveSector.id != id || archiveSector.chunk != chunk || !isIndexValid(archiveSector.index)) {
+                    return null
+                }
+                if (currentPosition < 0 || origin.mainFile.length() / SECTOR_SIZE < currentPosition) {
+                    return null
+                }
+            }
+            val last = data.size - written <= archiveDataSize
+            if (currentPosition == 0) {
+                overWrite = false
+                if (reserved > 0) {
+                    currentPosition = position + 1
+                    reserved--
+                } else if (!last) {
+                    val remaining = sectorCount - chunk - 1
+                    currentPosition = allocating?.allocate(remaining) ?: 0
+                    if (currentPosition > 0) {
+                        runs.add(intArrayOf(currentPosition, remaining))
+                        reserved = remaining - 1
+                    } else {
+                        allocating = null
                         currentPosition = ((origin.mainFile.length() + (SECTOR_SIZE - 1)) / SECTOR_SIZE).toInt()
                         if (currentPosition == 0) {
                             currentPosition++
@@ -223,28 +346,26 @@ open class Index(origin: CacheLibrary, id: Int, val raf: RandomAccessFile) : Ref
                             currentPosition++
                         }
                     }
-                    if (data.size - written <= archiveDataSize) {
-                        currentPosition = 0
-                    }
-                    archiveSector.chunk = chunk
-                    archiveSector.position = currentPosition
-                    origin.mainFile.seek(position.toLong() * SECTOR_SIZE)
-                    origin.mainFile.write(archiveSector.write(), 0, archiveHeaderSize)
-                    var length = data.size - written
-                    if (length > archiveDataSize) {
-                        length = archiveDataSize
-                    }
-                    origin.mainFile.write(data, written, length)
-                    written += length
-                    position = currentPosition
-                    chunk++
                 }
-                true
-            } catch (t: Throwable) {
-                t.printStackTrace()
-                false
             }
+            if (last) {
+                currentPosition = 0
+            }
+            archiveSector.chunk = chunk
+            archiveSector.position = currentPosition
+            origin.mainFile.seek(position.toLong() * SECTOR_SIZE)
+            origin.mainFile.write(archiveSector.write(), 0, archiveHeaderSize)
+            var length = data.size - written
+            if (length > archiveDataSize) {
+                length = archiveDataSize
+            }
+            origin.mainFile.write(data, written, length)
+            positions[chunk] = position
+            written += length
+            position = currentPosition
+            chunk++
         }
+        return positions
     }
 
     fun fixCRCs(update: Boolean) {
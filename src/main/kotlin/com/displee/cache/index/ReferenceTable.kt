@@ -269,6 +269,17 @@ open class ReferenceTable(protected val origin: CacheLibrary, val id: Int) : Com
         if (direct || archive.read || archive.new) {
             return archive
         }
+        // Concurrent readers of the same archive decode it once
+        synchronized(archive) {
+            if (archive.read || archive.new) {
+                return archive
+            }
+            return readArchive(archive, xtea)
+        }
+    }
+
+    private fun readArchive(archive: Archive, xtea: IntArray?): Archive {
+        val id = archive.id
         val sector = origin.index(this.id).readArchiveSector(id)
         if (sector == null) {
             archive.read = true
@@ -407,6 +418,13 @@ open class ReferenceTable(protected val origin: CacheLibrary, val id: Int) : Com
         return archives.keys.toIntArray()
     }
 
+    /**
+     * The name hashes of all archives, in the order of [archiveIds].
+     */
+    fun archiveNameHashes(): IntArray {
+        return archives.values.map { it.hashName }.toIntArray()
+    }
+
     fun archives(): Array<Archive> {
         return archives.values.toTypedArray()
     }
@@ -42,6 +42,12 @@ open class Archive(val id: Int, var hashName: Int = 0, xtea: IntArray? = null) :
     var new = false
     var autoUpdateRevision = true
 
+    /**
+     * The container of this archive compressed ahead of [com.displee.cache.index.Index.update], without its revision
+     * trailer. Used instead of compressing [write] on the next update and cleared whenever the archive changes.
+     */
+    var precompressed: ByteArray? = null
+
     constructor(id: Int) : this(id, 0)
 
     constructor(archive: Archive) : this(archive.id, archive.hashName) {
@@ -249,6 +255,7 @@ open class Archive(val id: Int, var hashName: Int = 0, xtea: IntArray? = null) :
 
     fun flag() {
         needUpdate = true
+        precompressed = null
     }
 
     fun flagged(): Boolean {
@@ -268,6 +275,7 @@ open class Archive(val id: Int, var hashName: Int = 0, xtea: IntArray? = null) :
         }
         read = false
         new = false
+        precompressed = null
     }
 
     /**
@@ -10,7 +10,8 @@ import java.util.zip.Inflater
 
 class GZIPCompressor : Compressor {
 
-    private var inflater: Inflater? = null
+    // Compressors are shared by every reader of a cache, so each thread inflates with its own Inflater
+    private val inflater: ThreadLocal<Inflater> = ThreadLocal.withInitial { Inflater(true) }
     private var gzipBuffer: ByteArray? = null
 
     override fun decompress(buffer: InputBuffer, compressedSize: Int, decompressedSize: Int): ByteArray {
@@ -23,7 +24,7 @@ class GZIPCompressor : Compressor {
         if (bytes[offset].toInt() != 31 || bytes[offset + 1].toInt() != -117) {
             return byteArrayOf()
         }
-        val inflater = this.inflater ?: Inflater(true).also { inflater = it }
+        val inflater = this.inflater.get()
         return try {
             inflater.setInput(bytes, offset + 10, bytes.size - (10 + offset + 8))
             val decompressed = ByteArray(decompressedSize)
@@ -49,6 +50,7 @@ class GZIPCompressor : Compressor {
         return compressed.toByteArray()
     }
 
+    @Synchronized
     fun deflate317(data: ByteArray?): ByteArray {
         var read = 0
         try {
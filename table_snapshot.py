@@ -0,0 +1,148 @@
+"""
+Reference Table Snapshot
+This module stores decoded reference tables in a compact binary file next to the cache, so a
+restarting process can load them with mmap instead of decompressing and parsing idx255 again.
+
+Each table is keyed by the CRC of its reference table container in idx255; a table whose
+container changed since the snapshot was written is decoded from the cache as usual.
+
+Layout (little-endian):
+    header      magic "RTS1", u32 table count
+    directory   per table: u16 index id, i32 container crc, u8 version, i32 revision, u8 mask,
+                u32 archive count, u32 file count, u64 offset of the table's columns
+    columns     per table, i32 arrays: archive ids, name hashes, crcs, revisions, lengths,
+                uncompressed lengths, file counts, file ids, file name hashes (named tables only)
+"""
+
+import array
+import mmap
+import os
+import struct
+import sys
+from typing import Dict, Optional, Tuple
+
+from cache_format import ArchiveEntry, CacheFormatError, ReferenceTable
+
+
+SNAPSHOT_FILE_NAME = "reference_tables.snapshot"
+
+MAGIC = b"RTS1"
+HEADER = struct.Struct("<4sI")
+DIRECTORY_ENTRY = struct.Struct("<HiBiBIIQ")
+
+
+def _column(values) -> bytes:
+    column = array.array("i", values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+
+def write_snapshot(path: str, tables: Dict[int, Tuple[int, ReferenceTable]]) -> int:
+    """Write {index_id: (container_crc, table)} to path atomically and return its size in bytes"""
+    directory = []
+    columns = []
+    offset = HEADER.size + DIRECTORY_ENTRY.size * len(tables)
+    for index_id, (crc, table) in sorted(tables.items()):
+        entries = list(table.archives.values())
+        file_ids = [file_id for entry in entries for file_id in entry.file_ids]
+        data = [
+            _column(entry.id for entry in entries),
+            _column(entry.name_hash for entry in entries),
+            _column(entry.crc for entry in entries),
+            _column(entry.revision for entry in entries),
+            _column(entry.length for entry in entries),
+            _column(entry.uncompressed_length for entry in entries),
+            _column(len(entry.file_ids) for entry in entries),
+            _column(file_ids)
+        ]
+        if table.named:
+            data.append(_column(name_hash for entry in entries
+                                for name_hash in (entry.file_name_hashes or [0] * len(entry.file_ids))))
+        directory.append(DIRECTORY_ENTRY.pack(index_id, crc, table.version, table.revision, table.mask,
+                                              len(entries), len(file_ids), offset))
+        columns.extend(data)
+        offset += sum(len(column) for column in data)
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(tables)))
+        f.writelines(directory)
+        f.writelines(columns)
+    os.replace(temporary, path)
+    return offset
+
+
+class TableSnapshot:
+    """A memory-mapped snapshot written by write_snapshot"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        magic, count = HEADER.unpack_from(self._view, 0)
+        if magic != MAGIC:
+            self.close()
+            raise CacheFormatError(f"{path} is not a reference table snapshot")
+        self._directory: Dict[int, tuple] = {}
+        for i in range(count):
+            entry = DIRECTORY_ENTRY.unpack_from(self._view, HEADER.size + i * DIRECTORY_ENTRY.size)
+            self._directory[entry[0]] = entry[1:]
+
+    def index_ids(self):
+        return sorted(self._directory)
+
+    def crc(self, index_id: int) -> Optional[int]:
+        """The container CRC the table of index_id was stored for, or None if it is not stored"""
+        entry = self._directory.get(index_id)
+        return entry[0] if entry is not None else None
+
+    def table(self, index_id: int) -> Optional[ReferenceTable]:
+        entry = self._directory.get(index_id)
+        if entry is None:
+            return None
+        _, version, revision, mask, archive_count, file_count, offset = entry
+        table = ReferenceTable(index_id)
+        table.version = version
+        table.revision = revision
+        table.mask = mask
+
+        def column(length):
+            nonlocal offset
+            values = array.array("i")
+            values.frombytes(self._view[offset:offset + 4 * length])
+            if sys.byteorder == "big":
+                values.byteswap()
+            offset += 4 * length
+            return values
+
+        ids = column(archive_count)
+        name_hashes = column(archive_count)
+        crcs = column(archive_count)
+        revisions = column(archive_count)
+        lengths = column(archive_count)
+        uncompressed_lengths = column(archive_count)
+        file_counts = column(archive_count)
+        file_ids = column(file_count).tolist()
+        file_name_hashes = column(file_count).tolist() if table.named else None
+
+        position = 0
+        for i in range(archive_count):
+            archive = ArchiveEntry(ids[i])
+            archive.name_hash = name_hashes[i]
+            archive.crc = crcs[i]
+            archive.revision = revisions[i]
+            archive.length = lengths[i]
+            archive.uncompressed_length = uncompressed_lengths[i]
+            end = position + file_counts[i]
+            archive.file_ids = file_ids[position:end]
+            if file_name_hashes is not None:
+                archive.file_name_hashes = file_name_hashes[position:end]
+            position = end
+            table.archives[archive.id] = archive
+        return table
+
+    def close(self):
+        self._view.release()
+        self._mmap.close()
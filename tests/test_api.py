@@ -0,0 +1,17 @@
+import pytest
+
+import api
+
+
+@pytest.mark.parametrize("body", [{"auto_flush_bytes": "lots"}, {"auto_flush_bytes": [1]}, {"auto_flush_seconds": "soon"}])
+def test_begin_transaction_rejects_invalid_auto_flush(body):
+    response = api.app.test_client().post("/txn", json=body)
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "error"
+
+
+@pytest.mark.parametrize("limit", ["many", [1], -1])
+def test_save_hot_set_rejects_invalid_limit(limit):
+    response = api.app.test_client().post("/hot_set", json={"limit": limit})
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "error"
@@ -0,0 +1,37 @@
+import pytest
+
+import api
+import tracing
+
+
+@pytest.fixture
+def tracer():
+    tracer = tracing.configure(slow_ms=1e9)
+    yield tracer
+    tracing.configure()
+
+
+def test_trace_finished_when_view_raises(tracer, monkeypatch):
+    def fail():
+        raise RuntimeError("stats failed")
+
+    monkeypatch.setattr(api.cache_api, "cache_stats", fail)
+    monkeypatch.setitem(api.app.config, "PROPAGATE_EXCEPTIONS", False)
+    finished = []
+    monkeypatch.setattr(tracer, "finish", finished.append)
+    response = api.app.test_client().get("/stats")
+    assert response.status_code == 500
+    assert len(finished) == 1
+    root = finished[0].root
+    assert root.error == "RuntimeError: stats failed"
+    assert root.end is not None
+    assert tracing.span("after") is tracing.NO_SPAN
+
+
+def test_trace_records_response(tracer, monkeypatch):
+    finished = []
+    monkeypatch.setattr(tracer, "finish", finished.append)
+    response = api.app.test_client().get("/health")
+    assert len(finished) == 1
+    assert finished[0].root.attributes["http.status_code"] == response.status_code
+    assert finished[0].root.error is None
@@ -0,0 +1,159 @@
+import asyncio
+import io
+import json
+import tarfile
+import time
+
+import pytest
+
+from api import BATCH_FRAME
+from asgi import CacheASGIApp, HTTPError
+import metrics
+
+
+class SlowExport:
+    """Exports three archives, the second one slower than the request timeout"""
+
+    def export_index(self, index_id, workers=4, xteas=None):
+        for archive_id in range(3):
+            time.sleep(0.3 if archive_id == 1 else 0)
+            yield {"status": "success", "archive_id": archive_id, "file_id": 0, "data": b"x" * 70000}
+
+
+class SlowBatch:
+    """Answers batches one file at a time, the second one slower than the request timeout"""
+
+    def __init__(self):
+        self.closed = False
+
+    def iter_many(self, requests):
+        try:
+            for number, (index_id, archive_id, file_id, xtea) in enumerate(requests):
+                time.sleep(0.3 if number == 1 else 0)
+                yield {"status": "success", "data": b"x", "crc": 0, "revision": 0,
+                       "index_id": index_id, "archive_id": archive_id, "file_id": file_id}
+        finally:
+            self.closed = True
+
+    def begin_transaction(self, auto_flush_bytes=None, auto_flush_seconds=None):
+        return {"status": "success", "auto_flush_bytes": auto_flush_bytes, "auto_flush_seconds": auto_flush_seconds}
+
+    def cache_stats(self):
+        raise RuntimeError("stats failed")
+
+
+def request(app, method, path, body=b"", headers=()):
+    """Run one request through the app, returning its status and body"""
+    async def run():
+        scope = {"type": "http", "method": method, "path": path, "query_string": b"",
+                 "headers": [(name.encode(), value.encode()) for name, value in headers]}
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        await app(scope, receive, send)
+        return sent
+
+    sent = asyncio.run(run())
+    assert sent[-1]["more_body"] is False
+    return sent[0]["status"], b"".join(message.get("body", b"") for message in sent[1:])
+
+
+def test_timed_out_call_keeps_its_slot():
+    async def run():
+        app = CacheASGIApp(SlowExport(), max_pending=1, request_timeout=0.1)
+        with pytest.raises(HTTPError) as timed_out:
+            await app.call(time.sleep, 0.3)
+        assert timed_out.value.status == 504
+        # The sleep still runs on the executor
+        with pytest.raises(HTTPError) as rejected:
+            await app.call(time.sleep, 0)
+        assert rejected.value.status == 503
+        await asyncio.sleep(0.35)
+        assert await app.call(len, b"ok") == 2
+
+    asyncio.run(run())
+
+
+def test_export_ends_with_trailer_after_timeout():
+    async def run():
+        app = CacheASGIApp(SlowExport(), request_timeout=0.1)
+        scope = {"type": "http", "method": "GET", "path": "/export/0", "query_string": b"", "headers": []}
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        await app(scope, receive, send)
+        return sent
+
+    sent = asyncio.run(run())
+    assert sent[0]["status"] == 200
+    assert sent[-1]["more_body"] is False
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    with tarfile.open(fileobj=io.BytesIO(body)) as tar:
+        names = tar.getnames()
+        errors = json.loads(tar.extractfile("0/errors.json").read())
+    assert names == ["0/0/0", "0/errors.json"]
+    assert errors[0]["message"] == "Export stopped: Request timed out"
+
+
+@pytest.mark.parametrize("output_format", ["binary", "ndjson"])
+def test_batch_ends_with_error_after_timeout(output_format):
+    api = SlowBatch()
+    app = CacheASGIApp(api, request_timeout=0.1)
+    body = json.dumps({"requests": [{"index": 2, "archive": archive_id} for archive_id in range(3)],
+                       "format": output_format}).encode()
+    status, sent = request(app, "POST", "/data/batch", body, [("content-type", "application/json")])
+    assert status == 200
+    if output_format == "binary":
+        frames = []
+        while sent:
+            header = BATCH_FRAME.unpack(sent[:BATCH_FRAME.size])
+            frames.append((header[:4], sent[BATCH_FRAME.size:BATCH_FRAME.size + header[4]]))
+            sent = sent[BATCH_FRAME.size + header[4]:]
+        assert frames == [((0, 2, 0, 0), b"x"), ((1, -1, -1, -1), b"Batch stopped: Request timed out")]
+    else:
+        lines = [json.loads(line) for line in sent.decode().splitlines()]
+        assert [line["status"] for line in lines] == ["success", "error"]
+        assert lines[1] == {"status": "error", "message": "Batch stopped: Request timed out",
+                            "index_id": None, "archive_id": None, "file_id": None}
+    # Closed once the timed out read returns
+    time.sleep(0.4)
+    assert api.closed
+
+
+def test_begin_transaction_rejects_invalid_auto_flush():
+    app = CacheASGIApp(SlowBatch())
+    headers = [("content-type", "application/json")]
+    status, body = request(app, "POST", "/txn", json.dumps({"auto_flush_bytes": "lots"}).encode(), headers)
+    assert status == 400 and json.loads(body)["status"] == "error"
+    status, body = request(app, "POST", "/txn", json.dumps({"auto_flush_seconds": [1]}).encode(), headers)
+    assert status == 400
+    status, body = request(app, "POST", "/txn", json.dumps({"auto_flush_bytes": "1024"}).encode(), headers)
+    assert status == 200 and json.loads(body)["auto_flush_bytes"] == 1024
+
+
+def test_unexpected_error_returns_500_and_is_counted():
+    app = CacheASGIApp(SlowBatch())
+    errors = metrics.ERRORS.value("asgi", "RuntimeError")
+    requests = metrics.REQUESTS.value("GET", "/stats", "500")
+    status, body = request(app, "GET", "/stats")
+    assert status == 500
+    assert json.loads(body) == {"status": "error", "message": "Internal server error: stats failed"}
+    assert metrics.ERRORS.value("asgi", "RuntimeError") == errors + 1
+    assert metrics.REQUESTS.value("GET", "/stats", "500") == requests + 1
+
+
+@pytest.mark.parametrize("limit", ["many", -1])
+def test_save_hot_set_rejects_invalid_limit(limit):
+    app = CacheASGIApp(SlowBatch())
+    status, body = request(app, "POST", "/hot_set", json.dumps({"limit": limit}).encode(), [("content-type", "application/json")])
+    assert status == 400 and json.loads(body)["status"] == "error"
@@ -0,0 +1,136 @@
+import random
+
+import pytest
+
+from cache_format import (COMPRESSION_BZIP2, COMPRESSION_GZIP, COMPRESSION_LZMA, COMPRESSION_NONE, FLAG_NAME,
+                          ArchiveEntry, CacheFormatError, ReferenceTable, container_revision, container_size,
+                          decode_container, encode_archive, encode_container, java_string_hash, split_archive,
+                          xtea_decrypt, xtea_encrypt)
+
+COMPRESSIONS = [COMPRESSION_NONE, COMPRESSION_BZIP2, COMPRESSION_GZIP, COMPRESSION_LZMA]
+KEYS = [0x12345678, -0x1234568, 42, -1]
+
+
+def payload(size, seed=0):
+    rng = random.Random(seed)
+    return rng.randbytes(size // 2) + b"abcd" * (size // 8) + bytes(size - size // 2 - 4 * (size // 8))
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+@pytest.mark.parametrize("size", [0, 1, 511, 4096])
+def test_container_round_trip(compression, size):
+    data = payload(size)
+    container = encode_container(data, compression)
+    assert container_size(container) == len(container)
+    assert container_revision(container) is None
+    assert decode_container(container) == data
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_container_revision_trailer(compression):
+    data = payload(1000)
+    container = encode_container(data, compression, revision=0x1_0005)
+    assert container_revision(container) == 5
+    assert container_size(container) == len(container) - 2
+    assert decode_container(container) == data
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_encrypted_container_round_trip(compression):
+    data = payload(2000, seed=1)
+    container = encode_container(data, compression, revision=3, xtea=KEYS)
+    assert decode_container(container, KEYS) == data
+    try:
+        assert decode_container(container) != data
+    except Exception:
+        # Compressed payloads usually fail to decompress without the keys
+        pass
+
+
+def test_xtea_round_trip_leaves_partial_block():
+    data = bytes(range(40))
+    encrypted = xtea_encrypt(data, KEYS, 5, len(data))
+    assert encrypted[:5] == data[:5]
+    # Only whole 8 byte blocks are encrypted, the 3 bytes after the last one are kept
+    assert encrypted[-3:] == data[-3:]
+    assert encrypted[5:37] != data[5:37]
+    assert bytes(xtea_decrypt(encrypted, KEYS, 5, len(data))) == data
+
+
+def test_invalid_containers():
+    with pytest.raises(CacheFormatError):
+        decode_container(b"\x02\x00")
+    with pytest.raises(CacheFormatError):
+        decode_container(b"\x02\x00\x00\x10\x00\x00\x00\x00\x10")
+    with pytest.raises(CacheFormatError):
+        decode_container(b"\x07\x00\x00\x00\x00\x00\x00\x00\x00")
+
+
+@pytest.mark.parametrize("file_ids", [[0], [3], [0, 1, 2], [1, 5, 9, 200]])
+def test_archive_round_trip(file_ids):
+    files = {file_id: payload(file_id * 37 % 300, seed=file_id) for file_id in file_ids}
+    assert split_archive(encode_archive(files), sorted(files)) == files
+
+
+def test_split_archive_with_several_chunks():
+    # Chunk sizes are stored as deltas: chunk 0 holds 2 and 1 bytes, chunk 1 holds 1 and 3 bytes
+    data = b"aa" + b"B" + b"A" + b"bbb"
+    table = b"".join(size.to_bytes(4, "big", signed=True) for size in (2, -1, 1, 2))
+    assert split_archive(data + table + b"\x02", [0, 1]) == {0: b"aaA", 1: b"Bbbb"}
+
+
+def test_split_archive_rejects_bad_chunk_table():
+    with pytest.raises(CacheFormatError):
+        split_archive(b"\x10", [0, 1])
+
+
+def table_with(version, named, archive_ids, files_per_archive=3):
+    table = ReferenceTable(7)
+    table.version = version
+    table.revision = 12 if version >= 6 else 0
+    table.mask = FLAG_NAME if named else 0
+    for archive_id in archive_ids:
+        entry = ArchiveEntry(archive_id)
+        entry.crc = java_string_hash(f"crc{archive_id}")
+        entry.revision = archive_id % 5
+        entry.file_ids = [file_id * 2 for file_id in range(files_per_archive)]
+        if named:
+            entry.name_hash = java_string_hash(f"archive{archive_id}")
+            entry.file_name_hashes = [java_string_hash(f"file{file_id}") for file_id in entry.file_ids]
+        table.archives[archive_id] = entry
+    return table
+
+
+@pytest.mark.parametrize("version", [5, 6, 7])
+@pytest.mark.parametrize("named", [False, True])
+def test_reference_table_round_trip(version, named):
+    archive_ids = [0, 1, 7, 300, 40000] + ([70000, 1 << 20] if version == 7 else [])
+    table = table_with(version, named, archive_ids)
+    decoded = ReferenceTable.decode(7, table.encode())
+    assert (decoded.version, decoded.revision, decoded.mask) == (version, table.revision, table.mask)
+    assert decoded.archive_ids() == archive_ids
+    for archive_id in archive_ids:
+        expected, actual = table.archives[archive_id], decoded.archives[archive_id]
+        assert (actual.crc, actual.revision, actual.file_ids) == (expected.crc, expected.revision, expected.file_ids)
+        if named:
+            assert actual.name_hash == expected.name_hash
+            assert actual.file_name_hashes == expected.file_name_hashes
+
+
+def test_reference_table_switches_to_version_7_for_big_ids():
+    table = table_with(6, False, [1, 70000])
+    decoded = ReferenceTable.decode(7, table.encode())
+    assert decoded.version == 7
+    assert decoded.archive_ids() == [1, 70000]
+
+
+def test_reference_table_rejects_unknown_version():
+    with pytest.raises(CacheFormatError):
+        ReferenceTable.decode(0, b"\x04\x00\x00")
+
+
+def test_java_string_hash():
+    assert java_string_hash("") == 0
+    assert java_string_hash("a") == 97
+    # "polygenelubricants".hashCode() == Integer.MIN_VALUE
+    assert java_string_hash("polygenelubricants") == -2 ** 31
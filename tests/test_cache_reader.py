@@ -0,0 +1,107 @@
+import pytest
+
+from cache_format import SECTOR_DATA_SIZE_SMALL, crc32
+from cache_reader import CacheReader
+from synthetic_cache import COMPRESSION_NAMES, file_requests, generate_cache
+from table_snapshot import SNAPSHOT_FILE_NAME, TableSnapshot, write_snapshot
+
+
+@pytest.fixture(scope="module")
+def cache(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("cache"))
+    manifest = generate_cache(path, indices=3, archives=40, files=4, max_size=3000, map_archives=8, seed=7)
+    return path, manifest
+
+
+@pytest.fixture
+def reader(cache):
+    reader = CacheReader(cache[0])
+    yield reader
+    reader.close()
+
+
+def test_reads_every_file(cache, reader):
+    path, manifest = cache
+    requests = file_requests(manifest)
+    assert len(requests) > 300
+    for index_id, archive_id, file_id, xtea in requests:
+        data = reader.data(index_id, archive_id, file_id, xtea)
+        assert data is not None, (index_id, archive_id, file_id)
+        assert len(data) == manifest["indices"][str(index_id)][str(archive_id)]["files"][str(file_id)]
+
+
+def test_reference_tables_match_containers(cache, reader):
+    path, manifest = cache
+    assert reader.index_ids() == [int(index_id) for index_id in manifest["indices"]]
+    for index_id, archives in manifest["indices"].items():
+        table = reader.reference_table(int(index_id))
+        assert table.archive_ids() == sorted(int(archive_id) for archive_id in archives)
+        for archive_id, entry in table.archives.items():
+            assert entry.file_ids == sorted(int(file_id) for file_id in archives[str(archive_id)]["files"])
+            # The CRC covers the container without its revision trailer
+            assert crc32(bytes(reader.read_container(int(index_id), archive_id))[:-2]) == entry.crc
+
+
+def test_sector_chains(cache, reader):
+    path, manifest = cache
+    seen = set()
+    for index_id in reader.index_ids() + [255]:
+        for archive_id in range(reader.entry_count(index_id)):
+            container = reader.read_container(index_id, archive_id)
+            positions = reader.sector_positions(index_id, archive_id)
+            assert len(positions) == -(-len(container) // SECTOR_DATA_SIZE_SMALL)
+            assert not seen.intersection(positions)
+            seen.update(positions)
+    assert 0 not in seen
+    assert reader.sector_positions(0, 10 ** 6) == []
+    assert reader.read_container(0, 10 ** 6) is None
+
+
+def test_missing_keys_do_not_decode_landscapes(cache, reader):
+    path, manifest = cache
+    map_index = manifest["map_index"]
+    with pytest.raises(Exception):
+        reader.archive_files(map_index, 1)
+
+
+def test_snapshot_round_trip(cache, tmp_path):
+    path, manifest = cache
+    reader = CacheReader(path)
+    tables = reader.snapshot_tables()
+    reader.close()
+    snapshot_path = str(tmp_path / SNAPSHOT_FILE_NAME)
+    write_snapshot(snapshot_path, tables)
+    snapshot = TableSnapshot(snapshot_path)
+    reader = CacheReader(path, snapshot)
+    try:
+        assert not reader.snapshot_stale()
+        for index_id, (crc, table) in tables.items():
+            loaded = snapshot.table(index_id)
+            assert snapshot.crc(index_id) == crc
+            assert loaded.archive_ids() == table.archive_ids()
+            assert [entry.file_ids for entry in loaded.archives.values()] == \
+                [entry.file_ids for entry in table.archives.values()]
+        assert reader.snapshot_hits == len(tables)
+        assert reader.snapshot_misses == 0
+    finally:
+        reader.close()
+        snapshot.close()
+
+
+@pytest.mark.parametrize("compression", sorted(COMPRESSION_NAMES))
+def test_single_compression_caches(tmp_path, compression):
+    manifest = generate_cache(str(tmp_path), indices=1, archives=10, files=3,
+                              compressions=[COMPRESSION_NAMES[compression]], seed=1)
+    reader = CacheReader(str(tmp_path))
+    try:
+        for index_id, archive_id, file_id, xtea in file_requests(manifest):
+            assert len(reader.data(index_id, archive_id, file_id, xtea)) == \
+                manifest["indices"][str(index_id)][str(archive_id)]["files"][str(file_id)]
+    finally:
+        reader.close()
+
+
+def test_touch_reads_the_stored_container(cache, reader):
+    for archive_id in range(reader.entry_count(0)):
+        assert reader.touch(0, archive_id) == len(reader.read_container(0, archive_id))
+    assert reader.touch(0, 10 ** 6) == 0
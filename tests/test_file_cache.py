@@ -0,0 +1,29 @@
+from file_cache import FileCache
+
+
+def test_version_changes_on_write_and_clear():
+    cache = FileCache()
+    first = cache.version(cache.token(2, 10))
+    cache.invalidate_archive(2, 10)
+    written = cache.version(cache.token(2, 10))
+    assert written != first
+    cache.clear()
+    # The generation is back at 0, the version must not repeat the first one
+    cleared = cache.version(cache.token(2, 10))
+    assert cache.token(2, 10)[1] == 0
+    assert cleared not in (first, written)
+
+
+def test_version_differs_between_instances():
+    assert FileCache().version((0, 0)) != FileCache().version((0, 0))
+
+
+def test_put_with_stale_token_is_dropped():
+    cache = FileCache()
+    key = FileCache.key(2, 10, 0)
+    token = cache.token(2, 10)
+    cache.invalidate_archive(2, 10)
+    cache.put(key, b"old", 1, 1, token)
+    assert cache.get(key) is None
+    cache.put(key, b"new", 1, 2, cache.token(2, 10))
+    assert cache.get(key) == (b"new", 1, 2)
@@ -0,0 +1,44 @@
+import threading
+import time
+
+from cache_api import CacheLibraryAPI
+from jobs import JobManager
+
+
+def spin(job, started: threading.Event):
+    started.set()
+    while True:
+        job.update(0.5)
+        time.sleep(0.01)
+
+
+def test_shutdown_waits_for_running_jobs():
+    jobs = JobManager(max_workers=1)
+    started = threading.Event()
+    running = jobs.submit("spin", spin, started)
+    queued = jobs.submit("spin", spin, threading.Event())
+    assert started.wait(2)
+    jobs.shutdown(wait=True)
+    assert running.state == "cancelled" and running.finished is not None
+    assert queued.state == "cancelled" and queued.started is None
+
+
+def test_close_cancels_jobs_holding_the_read_lock():
+    api = CacheLibraryAPI()
+    started = threading.Event()
+
+    def scan(job):
+        with api.lock.read():
+            spin(job, started)
+
+    job = api.jobs.submit("scan", scan)
+    assert started.wait(2)
+    result = {}
+    closer = threading.Thread(target=lambda: result.update(api.close()), daemon=True)
+    closer.start()
+    try:
+        closer.join(2)
+        assert result.get("status") == "success"
+        assert job.state == "cancelled"
+    finally:
+        job.cancel()
@@ -0,0 +1,118 @@
+import asyncio
+import random
+
+import pytest
+
+from cache_format import COMPRESSION_GZIP, COMPRESSION_NONE, encode_container
+from js5_server import (BLOCK_MARKER, BLOCK_SIZE, STATUS_OK, JS5Client, JS5Server, decode_checksum_table,
+                        encode_response)
+
+
+class FakeAPI:
+    """The two CacheLibraryAPI methods JS5Server reads through"""
+
+    def __init__(self, containers):
+        self.containers = containers
+
+    def get_raw_archive(self, index_id, archive_id):
+        container = self.containers.get((index_id, archive_id))
+        if container is None:
+            return {"status": "error", "message": "Archive not found"}
+        # Stored with a revision trailer, which is not sent
+        return {"status": "success", "data": container + b"\x00\x01"}
+
+    def index_checksums(self):
+        return [(123, 4), (-5, 6)]
+
+
+def containers():
+    rng = random.Random(1)
+    result = {}
+    for archive_id, size in enumerate([0, 1, 500, 503, 504, 505, 1100, 1534, 5000]):
+        data = rng.randbytes(size)
+        result[(2, archive_id)] = encode_container(data, COMPRESSION_NONE if archive_id % 2 else COMPRESSION_GZIP)
+    result[(3, 40000)] = encode_container(rng.randbytes(3000), COMPRESSION_NONE)
+    return result
+
+
+def run_server(api, test):
+    async def main():
+        server = JS5Server(api)
+        listener = await server.start("127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        client = JS5Client()
+        await client.connect("127.0.0.1", port)
+        try:
+            return await test(client, server)
+        finally:
+            await client.close()
+            listener.close()
+            await listener.wait_closed()
+            server.close()
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("size", [4, 512, 513, 1023, 1024, 1025, 4000])
+def test_response_blocks(size):
+    container = bytes([COMPRESSION_NONE]) + bytes(range(256)) * (size // 256 + 1)
+    container = container[:size - 3]
+    response = encode_response(1, 2, container, True)
+    body = response[:BLOCK_SIZE] + b"".join(response[offset + 1:offset + BLOCK_SIZE]
+                                            for offset in range(BLOCK_SIZE, len(response), BLOCK_SIZE))
+    assert all(response[offset:offset + 1] == BLOCK_MARKER for offset in range(BLOCK_SIZE, len(response), BLOCK_SIZE))
+    assert body == b"\x01\x00\x02" + container
+
+
+def test_round_trip():
+    stored = containers()
+
+    async def test(client, server):
+        futures = {key: client.request(*key, urgent=key[1] % 3 != 0) for key in stored}
+        futures[(255, 255)] = client.request(255, 255)
+        await client.writer.drain()
+        received = {key: await asyncio.wait_for(future, 5) for key, future in futures.items()}
+        return received, server.stats()
+
+    received, stats = run_server(FakeAPI(stored), test)
+    for key, container in stored.items():
+        assert received[key] == container, key
+    assert decode_checksum_table(received[(255, 255)]) == [(123, 4), (-5, 6)]
+    assert stats["requests"] == len(stored) + 1 and stats["misses"] == 0
+
+
+def test_missing_container_closes_the_connection():
+    stored = containers()
+
+    async def test(client, server):
+        found = client.request(2, 1)
+        with pytest.raises(ConnectionError):
+            await client.fetch(2, 999, timeout=5)
+        # Answered before the missing one
+        assert await found == stored[(2, 1)]
+        with pytest.raises(ConnectionError):
+            await client.fetch(2, 1, timeout=5)
+        return server.stats()
+
+    assert run_server(FakeAPI(stored), test)["misses"] == 1
+
+
+def test_fetch_times_out():
+    async def main():
+        async def handshake_only(reader, writer):
+            await reader.readexactly(5)
+            writer.write(bytes([STATUS_OK]))
+            await reader.read()
+            writer.close()
+
+        listener = await asyncio.start_server(handshake_only, "127.0.0.1", 0)
+        client = JS5Client()
+        await client.connect("127.0.0.1", listener.sockets[0].getsockname()[1])
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await client.fetch(2, 1, timeout=0.1)
+        finally:
+            await client.close()
+            listener.close()
+            await listener.wait_closed()
+
+    asyncio.run(main())
@@ -0,0 +1,14 @@
+import metrics
+
+
+def test_index_label_is_bounded():
+    registry = metrics.Registry()
+    histogram = registry.histogram("index_seconds", "Latency per index", ["index"])
+    for index_id in [0, 7, 255, 256, 99999999, -1]:
+        histogram.observe(0.001, metrics.index_label(index_id))
+    rendered = registry.render()
+    assert 'index="7"' in rendered
+    assert 'index="255"' in rendered
+    assert 'index="256"' not in rendered
+    assert 'index="99999999"' not in rendered
+    assert 'index="other",le="+Inf"} 3' in rendered
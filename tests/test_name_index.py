@@ -0,0 +1,107 @@
+import pytest
+
+from cache_format import java_string_hash
+from name_index import NameIndex
+
+
+class Table:
+    """Stands in for the reference tables: archive ids and name hashes per index, as CacheLibraryAPI changes them"""
+
+    def __init__(self, **names):
+        self.archives = {0: {int(archive_id[1:]): java_string_hash(name) for archive_id, name in names.items()}}
+        self.loads = 0
+
+    def load(self, index_id):
+        self.loads += 1
+        return [(name_hash, archive_id) for archive_id, name_hash in self.archives.get(index_id, {}).items()]
+
+    def add_archive(self, names: NameIndex, index_id, name):
+        # What add_archive and put_file_bytes_by_name do: add to the index, then tell the name index
+        archives = self.archives.setdefault(index_id, {})
+        archive_id = max(archives, default=-1) + 1
+        archives[archive_id] = java_string_hash(name)
+        names.add(index_id, archives[archive_id], archive_id)
+        return archive_id
+
+    def remove_archive_by_name(self, names: NameIndex, index_id, name):
+        archive_id = names.archive_id(index_id, java_string_hash(name))
+        if archive_id is not None:
+            del self.archives[index_id][archive_id]
+            names.remove(index_id, archive_id)
+        return archive_id
+
+
+@pytest.fixture
+def table():
+    return Table(a0="models", a1="sounds", a5="maps")
+
+
+def test_lookup_loads_an_index_once(table):
+    names = NameIndex(table.load)
+    assert names.archive_id(0, java_string_hash("sounds")) == 1
+    assert names.archive_id(0, java_string_hash("missing")) is None
+    assert names.archive_id(1, java_string_hash("sounds")) is None
+    assert table.loads == 2
+    assert names.stats() == {"indices": [0, 1], "names": 3, "lookups": 3, "builds": 2}
+
+
+def test_add_archive(table):
+    names = NameIndex(table.load)
+    assert names.archive_id(0, java_string_hash("maps")) == 5
+    archive_id = table.add_archive(names, 0, "textures")
+    assert archive_id == 6
+    assert names.archive_id(0, java_string_hash("textures")) == 6
+    assert table.loads == 1
+
+
+def test_add_archive_before_the_index_is_loaded(table):
+    names = NameIndex(table.load)
+    table.add_archive(names, 0, "textures")
+    assert names.stats()["indices"] == []
+    # The loader sees the new archive
+    assert names.archive_id(0, java_string_hash("textures")) == 6
+
+
+def test_put_by_name_adds_the_archive_once(table):
+    names = NameIndex(table.load)
+    # put_file_bytes_by_name adds the archive only when the name is not found
+    for _ in range(3):
+        if names.archive_id(0, java_string_hash("config")) is None:
+            table.add_archive(names, 0, "config")
+    assert sorted(table.archives[0]) == [0, 1, 5, 6]
+    assert names.archive_id(0, java_string_hash("config")) == 6
+
+
+def test_duplicate_name_resolves_to_lowest_id(table):
+    names = NameIndex(table.load)
+    names.archive_id(0, java_string_hash("models"))
+    table.add_archive(names, 0, "models")
+    assert names.archive_id(0, java_string_hash("models")) == 0
+
+
+def test_remove_archive_by_name(table):
+    names = NameIndex(table.load)
+    assert table.remove_archive_by_name(names, 0, "sounds") == 1
+    assert names.archive_id(0, java_string_hash("sounds")) is None
+    assert table.remove_archive_by_name(names, 0, "sounds") is None
+    assert names.archive_id(0, java_string_hash("models")) == 0
+    assert table.loads == 1
+
+
+def test_remove_reloads_when_another_archive_shares_the_name(table):
+    names = NameIndex(table.load)
+    table.add_archive(names, 0, "maps")
+    assert table.remove_archive_by_name(names, 0, "maps") == 5
+    # The other archive named maps is found after a reload
+    assert names.archive_id(0, java_string_hash("maps")) == 6
+    assert table.loads == 2
+
+
+def test_renamed_archive_reloads_the_index(table):
+    names = NameIndex(table.load)
+    names.archive_id(0, java_string_hash("models"))
+    table.archives[0][0] = java_string_hash("meshes")
+    names.add(0, java_string_hash("meshes"), 0)
+    assert names.stats()["indices"] == []
+    assert names.archive_id(0, java_string_hash("meshes")) == 0
+    assert names.archive_id(0, java_string_hash("models")) is None
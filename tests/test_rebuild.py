@@ -0,0 +1,67 @@
+import os
+import shutil
+
+import pytest
+
+from cache_format import CACHE_FILE_NAME
+from cache_reader import compare_caches
+from synthetic_cache import generate_cache
+
+JAR_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "build", "libs",
+                        "rs-cache-library-all.jar")
+
+
+@pytest.fixture(scope="module")
+def source(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("source"))
+    generate_cache(path, indices=3, archives=30, files=3, max_size=2000, seed=3)
+    return path
+
+
+def test_compare_caches(source, tmp_path):
+    same = str(tmp_path / "same")
+    shutil.copytree(source, same)
+    assert compare_caches(source, same) == []
+
+    other = str(tmp_path / "other")
+    generate_cache(other, indices=3, archives=30, files=3, max_size=2000, seed=4)
+    differences = compare_caches(source, other)
+    assert "Reference table of index 0 differs" in differences
+    assert "Archive 0 of index 0 differs" in differences
+    # Only the tables of the other indices are compared
+    assert not any(message.startswith("Archive") and "index 0" not in message
+                   for message in compare_caches(source, other, [0]))
+
+    os.remove(os.path.join(same, f"{CACHE_FILE_NAME}.idx2"))
+    assert compare_caches(source, same) == ["Index 2 is missing"]
+
+
+@pytest.mark.skipif(not os.path.exists(JAR_PATH), reason="cache library JAR not built")
+def test_incremental_rebuild_matches_full_rebuild(source, tmp_path):
+    from cache_api import CacheLibraryAPI
+
+    cache = str(tmp_path / "cache")
+    shutil.copytree(source, cache)
+    api = CacheLibraryAPI()
+    api.start_jvm(JAR_PATH)
+    assert api.initialize_cache(cache)["status"] == "success"
+    try:
+        incremental = str(tmp_path / "incremental")
+        assert api.rebuild_cache(incremental)["status"] == "success"
+        main_size = os.path.getsize(os.path.join(incremental, f"{CACHE_FILE_NAME}.dat2"))
+
+        for archive_id in range(30):
+            assert api.put_file_bytes(1, archive_id, 0, bytes([archive_id]) * 100)["status"] == "success"
+        assert api.update_index(1)["status"] == "success"
+        result = api.rebuild_cache(incremental, incremental=True)
+        assert result["status"] == "success", result
+        assert result["incremental"] and result["indices"] == [1]
+
+        full = str(tmp_path / "full")
+        assert api.rebuild_cache(full)["status"] == "success"
+        assert compare_caches(full, incremental) == []
+        assert compare_caches(cache, incremental) == []
+        # The smaller archives fit in the sectors of the ones they replace
+        assert os.path.getsize(os.path.join(incremental, f"{CACHE_FILE_NAME}.dat2")) <= main_size
+    finally:
+        api.close()
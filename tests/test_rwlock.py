@@ -0,0 +1,123 @@
+import threading
+import time
+
+from rwlock import ReadWriteLock
+
+
+def wait_until(condition, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def start(target) -> threading.Thread:
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_readers_share_the_lock():
+    lock = ReadWriteLock()
+    both_inside = threading.Barrier(2, timeout=2)
+
+    def read():
+        with lock.read():
+            both_inside.wait()
+
+    threads = [start(read), start(read)]
+    for thread in threads:
+        thread.join(2)
+    assert not both_inside.broken
+    assert lock.stats()["readers"] == 0
+
+
+def test_waiting_writer_blocks_new_readers():
+    lock = ReadWriteLock()
+    order = []
+    lock.acquire_read()
+
+    def write():
+        with lock.write():
+            order.append("write")
+
+    def read():
+        with lock.read():
+            order.append("read")
+
+    writer = start(write)
+    wait_until(lambda: lock.stats()["waiting_writers"] == 1)
+    reader = start(read)
+    time.sleep(0.05)
+    # The new reader queues behind the writer, which waits for the first reader
+    assert order == []
+    lock.release_read()
+    writer.join(2)
+    reader.join(2)
+    assert order == ["write", "read"]
+
+
+def test_writer_reenters_as_reader():
+    lock = ReadWriteLock()
+    with lock.write():
+        with lock.read():
+            assert lock.stats()["writer_active"]
+        assert lock.stats() == {"readers": 0, "writer_active": True, "waiting_writers": 0, "freezes": 0}
+    assert not lock.stats()["writer_active"]
+
+
+def test_nested_writes_hold_the_lock_until_the_outermost_release():
+    lock = ReadWriteLock()
+    entered = threading.Event()
+
+    def read():
+        with lock.read():
+            entered.set()
+
+    lock.acquire_write()
+    lock.acquire_write()
+    reader = start(read)
+    lock.release_write()
+    assert not entered.wait(0.05)
+    assert lock.stats()["writer_active"]
+    lock.release_write()
+    assert entered.wait(2)
+    reader.join(2)
+
+
+def test_freeze_holds_back_writers_but_not_readers():
+    lock = ReadWriteLock()
+    order = []
+
+    def write():
+        with lock.write():
+            order.append("write")
+
+    def read():
+        with lock.read():
+            order.append("read")
+
+    with lock.freeze():
+        writer = start(write)
+        time.sleep(0.05)
+        reader = start(read)
+        reader.join(2)
+        assert order == ["read"]
+        assert lock.stats()["waiting_writers"] == 0
+    writer.join(2)
+    assert order == ["read", "write"]
+
+
+def test_freeze_waits_for_the_writer():
+    lock = ReadWriteLock()
+    frozen = threading.Event()
+
+    def freeze():
+        with lock.freeze():
+            frozen.set()
+
+    with lock.write():
+        thread = start(freeze)
+        assert not frozen.wait(0.05)
+    assert frozen.wait(2)
+    thread.join(2)
@@ -0,0 +1,133 @@
+import array
+import os
+
+import pytest
+
+from cache_format import CACHE_FILE_NAME
+from cache_reader import CacheReader
+from sector_map import SectorMap
+from synthetic_cache import generate_cache
+
+
+def chains(**archives):
+    return {0: {int(archive_id[1:]): array.array("i", positions) for archive_id, positions in archives.items()}}
+
+
+@pytest.fixture
+def sector_map():
+    # Free: 3, 4, 6, 7, 8, 9
+    return SectorMap(10, chains(a1=[1, 2], a2=[5]))
+
+
+def test_allocate_first_fit(sector_map):
+    assert sector_map.stats()["free_sectors"] == 6
+    assert sector_map.allocate(2) == 3
+    assert sector_map.allocate(3) == 6
+    assert sector_map.allocate(5) == 0
+    assert sector_map.allocate(1) == 9
+    assert sector_map.allocate(1) == 0
+    stats = sector_map.stats()
+    assert stats["free_sectors"] == 0
+    assert stats["reused_sectors"] == 6
+    assert stats["appended_sectors"] == 6
+
+
+def test_written_shrinks_and_grows_chains(sector_map):
+    sector_map.written(0, 1, [1])
+    assert sector_map.allocate(1) == 2
+    # Appended past the end of the main file
+    sector_map.written(0, 3, [12, 13])
+    stats = sector_map.stats()
+    assert stats["sectors"] == 14
+    assert stats["free_runs"] == 2
+    assert stats["chains"] == 3
+    sector_map.written(0, 2, [7, 9])
+    assert sector_map.stats()["fragmented_chains"] == 1
+    assert sector_map.allocate(1) == 3
+
+
+def test_retain_frees_removed_archives(sector_map):
+    sector_map.retain(0, [2])
+    assert sector_map.stats()["chains"] == 1
+    assert sector_map.allocate(4) == 1
+    sector_map.retain(1, [])
+    assert sector_map.stats()["chains"] == 1
+
+
+def test_release_frees_reserved_run(sector_map):
+    assert sector_map.allocate(2) == 3
+    sector_map.release(3, 2)
+    stats = sector_map.stats()
+    assert stats["free_sectors"] == 6
+    assert stats["reused_sectors"] == 0
+    assert sector_map.allocate(2) == 3
+
+
+def test_scan_save_and_load(tmp_path):
+    cache = str(tmp_path / "cache")
+    generate_cache(cache, indices=2, archives=20, files=3, max_size=3000, seed=5)
+    reader = CacheReader(cache)
+    try:
+        scanned = SectorMap.scan(reader)
+    finally:
+        reader.close()
+    stats = scanned.stats()
+    # The synthetic cache stores every chain contiguously, one after the other
+    assert stats["free_sectors"] == 0
+    assert stats["fragmented_chains"] == 0
+    assert stats["chains"] == 2 * 20 + 2
+
+    path = str(tmp_path / "sector_map.bin")
+    scanned.save(path, cache)
+    loaded = SectorMap.load(path, cache)
+    assert loaded is not None
+    assert loaded.stats() == stats
+    assert loaded.fingerprint == scanned.fingerprint
+
+    # A changed map is saved for the cache files as they are then
+    scanned.retain(0, range(10))
+    assert scanned.fingerprint is None
+    scanned.save(path, cache)
+    loaded = SectorMap.load(path, cache)
+    assert loaded.stats()["chains"] == 10 + 20 + 2
+    assert loaded.allocate(1) == scanned.allocate(1)
+
+    with open(os.path.join(cache, f"{CACHE_FILE_NAME}.dat2"), "ab") as f:
+        f.write(b"\0")
+    assert SectorMap.load(path, cache) is None
+    with open(path, "wb") as f:
+        f.write(b"SFM1")
+    assert SectorMap.load(path, cache) is None
+    assert SectorMap.load(str(tmp_path / "missing.bin"), cache) is None
+
+
+def test_scan_is_repeated_after_a_write(tmp_path):
+    from cache_api import CacheLibraryAPI
+
+    cache = str(tmp_path / "cache")
+    generate_cache(cache, indices=1, archives=10, files=2, max_size=1000, seed=6)
+    api = CacheLibraryAPI()
+    api.path = cache
+    api.cache_library = library = object()
+    attached = []
+    api._attach_sector_map = attached.append
+
+    class Job:
+        messages = []
+
+        def update(self, progress, message=None):
+            self.messages.append(message)
+            if len(self.messages) == 1:
+                # A write committed while the first scan runs
+                with api.lock.write():
+                    api.commits += 1
+
+    job = Job()
+    result = api._scan_sector_map(job, library)
+    assert result["attached"] and result["chains"] == 10 + 1
+    assert len(attached) == 1
+    assert "The cache changed during the scan, scanning again" in job.messages
+    assert SectorMap.load(api.sector_map_path(), cache) is not None
+
+    api.cache_library = object()
+    assert api._scan_sector_map(job, library) == {"attached": False}
@@ -0,0 +1,116 @@
+import http.client
+import socket
+import threading
+import time
+
+import pytest
+import requests
+from flask import Flask, Response, request
+
+from serving import MAX_DISCARD_BYTES, PooledWSGIServer
+
+
+@pytest.fixture
+def server():
+    app = Flask(__name__)
+
+    @app.route("/port")
+    def port():
+        return str(request.environ["REMOTE_PORT"])
+
+    @app.route("/ignore", methods=["POST"])
+    def ignore():
+        return "ignored"
+
+    @app.route("/length", methods=["POST"])
+    def length():
+        return str(len(request.get_data()))
+
+    @app.route("/stream")
+    def stream():
+        return Response(b"x" * 10 for _ in range(5))
+
+    @app.route("/fail")
+    def fail():
+        raise ValueError("fail")
+
+    server = PooledWSGIServer("127.0.0.1", 0, app, threads=2, keep_alive_timeout=0.5)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.port}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_connection_is_reused(server):
+    session = requests.Session()
+    ports = {session.get(server + "/port").text for _ in range(5)}
+    assert session.post(server + "/ignore", data=b"a" * 1000).text == "ignored"
+    assert session.post(server + "/length", data=b"a" * 1000).text == "1000"
+    assert session.get(server + "/stream").text == "x" * 50
+    assert session.get(server + "/fail").status_code == 500
+    ports.add(session.get(server + "/port").text)
+    assert len(ports) == 1
+
+
+def test_large_unread_body_closes(server):
+    response = requests.post(server + "/ignore", data=b"a" * (MAX_DISCARD_BYTES + 1))
+    assert response.headers["Connection"] == "close"
+
+
+def test_idle_connection_is_closed(server):
+    connection = http.client.HTTPConnection(server[len("http://"):])
+    connection.request("GET", "/port")
+    connection.getresponse().read()
+    time.sleep(1)
+    with pytest.raises((http.client.RemoteDisconnected, ConnectionError)):
+        connection.request("GET", "/port")
+        connection.getresponse()
+
+
+def test_http_1_0_closes(server):
+    host, port = server[len("http://"):].split(":")
+    with socket.create_connection((host, int(port))) as connection:
+        connection.sendall(b"GET /port HTTP/1.0\r\n\r\n")
+        response = b""
+        while True:
+            data = connection.recv(4096)
+            if not data:
+                break
+            response += data
+    assert response.startswith(b"HTTP/1.1 200")
+    assert b"Connection: close" in response
+
+
+def test_waiting_connection_takes_idle_worker(server):
+    first, second = requests.Session(), requests.Session()
+    first.get(server + "/port")
+    second.get(server + "/port")
+    # Both workers hold an idle connection, the third one must not wait for the keep-alive timeout
+    start = time.monotonic()
+    requests.get(server + "/port")
+    assert time.monotonic() - start < 0.4
+
+
+
+def test_idle_connection_is_kept_while_workers_are_free():
+    app = Flask(__name__)
+
+    @app.route("/port")
+    def port():
+        return str(request.environ["REMOTE_PORT"])
+
+    server = PooledWSGIServer("127.0.0.1", 0, app, threads=2, keep_alive_timeout=2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        session = requests.Session()
+        url = f"http://127.0.0.1:{server.port}/port"
+        port = session.get(url).text
+        # A connection that was just accepted, while the second worker is free to take it
+        server.waiting_connections += 1
+        time.sleep(0.2)
+        assert session.get(url).text == port
+        server.waiting_connections -= 1
+    finally:
+        server.shutdown()
+        server.server_close()
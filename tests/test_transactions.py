@@ -0,0 +1,138 @@
+import threading
+import time
+
+import pytest
+
+from transactions import GroupCommitter, StagedWrite, TransactionError, TransactionManager
+
+
+def put(index_id: int, size: int) -> StagedWrite:
+    return StagedWrite(index_id, 0, 0, b"x" * size)
+
+
+class BlockingUpdate:
+    """Records the index ids of each update; the first one waits for release, later ones fail when asked to"""
+
+    def __init__(self, error: Exception = None):
+        self.calls = []
+        self.error = error
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, index_ids):
+        self.calls.append(set(index_ids))
+        if len(self.calls) == 1:
+            self.entered.set()
+            assert self.release.wait(2)
+        elif self.error is not None:
+            raise self.error
+
+
+def commit_all(committer, count):
+    """Commit [i] for every i from its own thread, returning the threads and their errors by i"""
+    errors = {}
+
+    def commit(index_id):
+        try:
+            committer.commit([index_id])
+        except Exception as e:
+            errors[index_id] = e
+
+    threads = [threading.Thread(target=commit, args=(index_id,), daemon=True) for index_id in range(1, count + 1)]
+    for thread in threads:
+        thread.start()
+    return threads, errors
+
+
+def wait_for_requests(committer, requests):
+    deadline = time.monotonic() + 2
+    while committer.stats()["requests"] < requests:
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_concurrent_commits_are_merged():
+    update = BlockingUpdate()
+    committer = GroupCommitter(update)
+    leader = threading.Thread(target=committer.commit, args=([0],), daemon=True)
+    leader.start()
+    assert update.entered.wait(2)
+    threads, errors = commit_all(committer, 8)
+    wait_for_requests(committer, 9)
+    update.release.set()
+    for thread in [leader, *threads]:
+        thread.join(2)
+    assert errors == {}
+    # Everything queued behind the first update is written by one more
+    assert update.calls == [{0}, set(range(1, 9))]
+    assert committer.stats() == {"requests": 9, "batches": 2}
+
+
+def test_error_reaches_every_waiter_of_the_batch():
+    update = BlockingUpdate(RuntimeError("update failed"))
+    committer = GroupCommitter(update)
+    leader = threading.Thread(target=committer.commit, args=([0],), daemon=True)
+    leader.start()
+    assert update.entered.wait(2)
+    threads, errors = commit_all(committer, 5)
+    wait_for_requests(committer, 6)
+    update.release.set()
+    for thread in [leader, *threads]:
+        thread.join(2)
+    assert sorted(errors) == [1, 2, 3, 4, 5]
+    assert all(str(error) == "update failed" for error in errors.values())
+    # A later batch that succeeds does not see the error
+    update.error = None
+    committer.commit([1])
+    assert update.calls[-1] == {1}
+
+
+def test_stage_and_drain():
+    manager = TransactionManager()
+    transaction = manager.begin()
+    assert manager.get(transaction.id) is transaction
+    assert not transaction.stage(put(1, 10), lambda: None)
+    assert not transaction.stage(StagedWrite(1, 2, None), lambda: None)
+    info = transaction.info()
+    assert info["staged_writes"] == 2 and info["staged_bytes"] == 10
+    writes = transaction.drain()
+    assert [write.file_id for write in writes] == [0, None]
+    assert transaction.info()["staged_bytes"] == 0
+
+    manager.finish(transaction, "committed")
+    with pytest.raises(TransactionError):
+        transaction.stage(put(1, 1), lambda: None)
+    with pytest.raises(TransactionError):
+        manager.get(transaction.id)
+    assert manager.stats()["committed"] == 1
+
+
+def test_auto_flush_by_bytes():
+    transaction = TransactionManager().begin(auto_flush_bytes=100)
+    assert not transaction.stage(put(1, 60), lambda: None)
+    assert transaction.stage(put(1, 40), lambda: None)
+    transaction.drain()
+    # The count starts again after a flush
+    assert not transaction.stage(put(1, 60), lambda: None)
+
+
+def test_auto_flush_by_time():
+    transaction = TransactionManager().begin(auto_flush_seconds=0.05)
+    flushed = threading.Event()
+    assert not transaction.stage(put(1, 10), flushed.set)
+    assert flushed.wait(2)
+
+    # Draining before the deadline cancels the timer
+    flushed.clear()
+    transaction.stage(put(1, 10), flushed.set)
+    transaction.drain()
+    assert not flushed.wait(0.15)
+
+
+def test_idle_transactions_expire():
+    manager = TransactionManager(idle_timeout=0)
+    transaction = manager.begin()
+    transaction.last_activity -= 1
+    manager.expire()
+    assert transaction.state == "expired"
+    assert manager.stats()["expired"] == 1
@@ -0,0 +1,68 @@
+import importlib.util
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+from flask import Flask, Response, request
+from werkzeug.serving import make_server
+
+import metrics
+from load_test import scrape_counters
+from serving import PooledWSGIServer
+
+WEBAPP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "webapp", "app.py")
+
+
+def start(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def proxy():
+    upstream = Flask("upstream")
+
+    @upstream.route("/data/<int:index_id>/<int:archive_id>/<int:file_id>")
+    def data(index_id, archive_id, file_id):
+        return b"x" * file_id * 1000
+
+    @upstream.route("/metrics")
+    def metrics_endpoint():
+        return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+    @upstream.after_request
+    def observe(response):
+        metrics.observe_request(request.method, request.path, response.status_code, 0.0)
+        return response
+
+    api = start(PooledWSGIServer("127.0.0.1", 0, upstream, threads=8))
+    spec = importlib.util.spec_from_file_location("webapp_app", WEBAPP)
+    webapp = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(webapp)
+    webapp.API_BASE_URL = f"http://127.0.0.1:{api.port}"
+    server = start(make_server("127.0.0.1", 0, webapp.app, threaded=True))
+    yield f"http://127.0.0.1:{server.port}", webapp.API_BASE_URL + "/metrics"
+    server.shutdown()
+    api.shutdown()
+    api.server_close()
+
+
+def test_proxy_reuses_api_connections(proxy):
+    url, metrics_url = proxy
+    names = ("cache_api_connections_total", "cache_api_requests_total")
+    before = scrape_counters(metrics_url, names)
+
+    def client(number):
+        with requests.Session() as session:
+            for i in range(25):
+                file_id = (number * 25 + i) % 70
+                assert len(session.get(f"{url}/api/data/0/0/{file_id}").content) == file_id * 1000
+
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(client, range(4)))
+    after = scrape_counters(metrics_url, names)
+    # One scrape is counted as well
+    assert after["cache_api_requests_total"] - before["cache_api_requests_total"] == 101
+    assert after["cache_api_connections_total"] - before["cache_api_connections_total"] <= 5
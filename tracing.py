@@ -0,0 +1,263 @@
+"""
+Request Tracing
+This module records timed spans for the phases of a request (parsing, the file cache, the JVM
+or mmap read, decompression, base64 encoding, serialization) when tracing is enabled.
+
+Finished traces slower than a threshold are logged with their span breakdown, and every trace
+can be appended to a file as OTLP/JSON, one ExportTraceServiceRequest per line, the format the
+OpenTelemetry collector's file receiver and exporter use. Tracing is off unless configure() is
+called; span() then returns a shared no-op context manager.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import List, Optional
+
+
+logger = logging.getLogger("tracing")
+
+# OTLP span kinds and status codes
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+def _attribute_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # OTLP/JSON encodes 64-bit integers as strings
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _attributes(attributes: dict) -> List[dict]:
+    return [{"key": key, "value": _attribute_value(value)} for key, value in attributes.items() if value is not None]
+
+
+class Span:
+    """One timed phase of a trace"""
+
+    __slots__ = ("trace", "name", "span_id", "parent", "kind", "attributes", "start", "end", "error", "_tokens")
+
+    def __init__(self, trace: "Trace", name: str, parent: Optional["Span"], kind: int = SPAN_KIND_INTERNAL,
+                 attributes: Optional[dict] = None):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent = parent
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.start = time.perf_counter_ns()
+        self.end = None
+        self.error = None
+        self._tokens = None
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.perf_counter_ns()) - self.start) / 1e6
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self._tokens = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter_ns()
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self._tokens)
+        self.trace.add(self)
+        return False
+
+    def otlp(self) -> dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.trace.unix_nanos(self.start)),
+            "endTimeUnixNano": str(self.trace.unix_nanos(self.end)),
+            "attributes": _attributes(self.attributes),
+            "status": {"code": STATUS_ERROR, "message": self.error} if self.error else {"code": STATUS_OK}
+        }
+        if self.parent is not None:
+            span["parentSpanId"] = self.parent.span_id
+        return span
+
+
+class _NoSpan:
+    """Returned by span() when no trace is active"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key: str, value):
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+class Trace:
+    """The spans of one request, rooted at a server span"""
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: Optional[dict] = None):
+        self.tracer = tracer
+        self.trace_id = os.urandom(16).hex()
+        # perf_counter gives the durations, the wall clock only anchors them for export
+        self._unix_start = time.time_ns()
+        self.root = Span(self, name, None, SPAN_KIND_SERVER, attributes)
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+        self._tokens = None
+
+    def unix_nanos(self, perf_counter_ns: int) -> int:
+        return self._unix_start + perf_counter_ns - self.root.start
+
+    def add(self, span: Span):
+        # Spans may finish on executor threads the request context was copied to
+        with self._lock:
+            self.spans.append(span)
+
+    def breakdown(self) -> str:
+        """The spans below the root in start order, each named by its path such as read_file/decompress"""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        parts = []
+        for span in spans:
+            if span is self.root:
+                continue
+            path = [span.name]
+            parent = span.parent
+            while parent is not None and parent is not self.root:
+                path.append(parent.name)
+                parent = parent.parent
+            parts.append(f"{'/'.join(reversed(path))} {span.duration_ms:.2f} ms")
+        return ", ".join(parts)
+
+
+class Tracer:
+    """Finishes traces: logs slow ones and appends all of them to an OTLP/JSON file"""
+
+    def __init__(self, slow_ms: Optional[float] = None, export_path: Optional[str] = None,
+                 service_name: str = "cache-api"):
+        self.slow_ms = slow_ms
+        self.export_path = export_path
+        self.service_name = service_name
+        self.finished = 0
+        self.slow = 0
+        self._file = open(export_path, "a", encoding="utf-8") if export_path else None
+        self._lock = threading.Lock()
+
+    def finish(self, trace: Trace):
+        duration_ms = trace.root.duration_ms
+        slow = self.slow_ms is not None and duration_ms >= self.slow_ms
+        with self._lock:
+            self.finished += 1
+            if slow:
+                self.slow += 1
+        if slow:
+            logger.warning("slow request %s took %.2f ms (trace %s): %s",
+                           trace.root.name, duration_ms, trace.trace_id, trace.breakdown())
+        if self._file is not None:
+            self.export(trace)
+
+    def export(self, trace: Trace):
+        with trace._lock:
+            spans = [span.otlp() for span in trace.spans]
+        line = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": _attributes({"service.name": self.service_name, "process.pid": os.getpid()})},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}]
+        }]}, separators=(",", ":"))
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + "\n")
+                self._file.flush()
+
+    def stats(self) -> dict:
+        return {"slow_ms": self.slow_ms, "export_path": self.export_path, "finished": self.finished, "slow": self.slow}
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_tracer: Optional[Tracer] = None
+
+
+def configure(slow_ms: Optional[float] = None, export_path: Optional[str] = None) -> Optional[Tracer]:
+    """Enable tracing, or disable it when neither a slow threshold nor an export path is given"""
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = Tracer(slow_ms, export_path) if slow_ms is not None or export_path else None
+    return _tracer
+
+
+def configure_from_environ() -> Optional[Tracer]:
+    """Configure tracing from TRACE_SLOW_MS and TRACE_FILE"""
+    slow_ms = os.environ.get("TRACE_SLOW_MS")
+    return configure(float(slow_ms) if slow_ms else None, os.environ.get("TRACE_FILE") or None)
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def stats() -> Optional[dict]:
+    tracer = _tracer
+    return tracer.stats() if tracer is not None else None
+
+
+def start_trace(name: str, **attributes) -> Optional[Trace]:
+    """Start a trace for the current request and make it current; None when tracing is off"""
+    tracer = _tracer
+    if tracer is None:
+        return None
+    trace = Trace(tracer, name, attributes)
+    trace._tokens = (_current_trace.set(trace), _current_span.set(trace.root))
+    return trace
+
+
+def finish_trace(trace: Optional[Trace], **attributes):
+    """End the root span of trace, which must be the current one, and hand it to the tracer"""
+    if trace is None:
+        return
+    trace.root.attributes.update(attributes)
+    trace.root.end = time.perf_counter_ns()
+    trace.add(trace.root)
+    trace_token, span_token = trace._tokens
+    try:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+    except ValueError:
+        # Finished from another context than the one it was started in
+        _current_span.set(None)
+        _current_trace.set(None)
+    trace.tracer.finish(trace)
+
+
+def span(name: str, **attributes):
+    """A context manager timing a phase of the current trace, a no-op outside of one"""
+    trace = _current_trace.get()
+    if trace is None:
+        return NO_SPAN
+    return Span(trace, name, _current_span.get(), attributes=attributes)
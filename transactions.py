@@ -0,0 +1,223 @@
+"""
+Write Transactions
+This module stages puts and removes in memory until a transaction is committed, and batches
+the Index.update calls of concurrent commits so each touched index is rewritten once.
+"""
+
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+
+class TransactionError(Exception):
+    """Raised for operations on unknown or finished transactions"""
+
+
+class StagedWrite:
+    """A put (data is not None) or remove (data is None, file_id None removes the archive)"""
+
+    __slots__ = ("index_id", "archive_id", "file_id", "data", "xtea")
+
+    def __init__(self, index_id: int, archive_id: int, file_id: Optional[int], data: Optional[bytes] = None,
+                 xtea: Optional[List[int]] = None):
+        self.index_id = index_id
+        self.archive_id = archive_id
+        self.file_id = file_id
+        self.data = data
+        self.xtea = xtea
+
+
+class Transaction:
+    """Writes staged by one client, flushed on commit or when an auto-flush limit is reached"""
+
+    def __init__(self, transaction_id: str, auto_flush_bytes: Optional[int] = None,
+                 auto_flush_seconds: Optional[float] = None):
+        self.id = transaction_id
+        self.auto_flush_bytes = auto_flush_bytes
+        self.auto_flush_seconds = auto_flush_seconds
+        self.created = time.time()
+        self.last_activity = time.monotonic()
+        self.state = "open"
+        self.flushes = 0
+        self.flushed_writes = 0
+        self._writes: List[StagedWrite] = []
+        self._staged_bytes = 0
+        self._lock = threading.Lock()
+        # Held while a batch is applied so flushes of one transaction keep their order
+        self.flush_lock = threading.Lock()
+        self._timer = None
+
+    def stage(self, write: StagedWrite, on_timeout: Callable[[], None]) -> bool:
+        """Stage write and return True when the transaction should be flushed now"""
+        with self._lock:
+            if self.state != "open":
+                raise TransactionError(f"Transaction {self.id} is {self.state}")
+            self._writes.append(write)
+            if write.data is not None:
+                self._staged_bytes += len(write.data)
+            self.last_activity = time.monotonic()
+            if self.auto_flush_seconds is not None and self._timer is None:
+                self._timer = threading.Timer(self.auto_flush_seconds, on_timeout)
+                self._timer.daemon = True
+                self._timer.start()
+            return self.auto_flush_bytes is not None and self._staged_bytes >= self.auto_flush_bytes
+
+    def drain(self) -> List[StagedWrite]:
+        """Take all staged writes, to be applied by the caller"""
+        with self._lock:
+            writes = self._writes
+            self._writes = []
+            self._staged_bytes = 0
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            return writes
+
+    def finish(self, state: str):
+        with self._lock:
+            self.state = state
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def info(self) -> dict:
+        with self._lock:
+            return {
+                "transaction_id": self.id,
+                "state": self.state,
+                "staged_writes": len(self._writes),
+                "staged_bytes": self._staged_bytes,
+                "flushes": self.flushes,
+                "flushed_writes": self.flushed_writes,
+                "auto_flush_bytes": self.auto_flush_bytes,
+                "auto_flush_seconds": self.auto_flush_seconds
+            }
+
+
+class TransactionManager:
+    """Open transactions by id; transactions idle for longer than idle_timeout are aborted"""
+
+    def __init__(self, idle_timeout: Optional[float] = 3600.0):
+        self.idle_timeout = idle_timeout
+        self._transactions: Dict[str, Transaction] = {}
+        self._lock = threading.Lock()
+        self.committed = 0
+        self.aborted = 0
+        self.failed = 0
+        self.expired = 0
+
+    def begin(self, auto_flush_bytes: Optional[int] = None, auto_flush_seconds: Optional[float] = None) -> Transaction:
+        self.expire()
+        transaction = Transaction(uuid.uuid4().hex, auto_flush_bytes, auto_flush_seconds)
+        with self._lock:
+            self._transactions[transaction.id] = transaction
+        return transaction
+
+    def get(self, transaction_id: str) -> Transaction:
+        with self._lock:
+            transaction = self._transactions.get(transaction_id)
+        if transaction is None:
+            raise TransactionError(f"Transaction {transaction_id} not found")
+        return transaction
+
+    def finish(self, transaction: Transaction, state: str):
+        """Close transaction and forget it"""
+        transaction.finish(state)
+        with self._lock:
+            if self._transactions.pop(transaction.id, None) is not None:
+                if state == "committed":
+                    self.committed += 1
+                elif state == "aborted":
+                    self.aborted += 1
+                elif state == "failed":
+                    self.failed += 1
+                else:
+                    self.expired += 1
+
+    def expire(self):
+        if self.idle_timeout is None:
+            return
+        deadline = time.monotonic() - self.idle_timeout
+        with self._lock:
+            idle = [transaction for transaction in self._transactions.values() if transaction.last_activity < deadline]
+        for transaction in idle:
+            self.finish(transaction, "expired")
+
+    def clear(self):
+        with self._lock:
+            transactions = list(self._transactions.values())
+        for transaction in transactions:
+            self.finish(transaction, "aborted")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "open": len(self._transactions),
+                "committed": self.committed,
+                "aborted": self.aborted,
+                "failed": self.failed,
+                "expired": self.expired
+            }
+
+
+class GroupCommitter:
+    """Runs commit_function for the union of keys requested by concurrent callers.
+
+    While one caller (the leader) commits a batch, later callers queue their keys; when the
+    batch is done the next caller commits everything queued in the meantime in one call.
+    """
+
+    def __init__(self, commit_function: Callable[[Set[int]], None]):
+        self.commit_function = commit_function
+        self._condition = threading.Condition()
+        self._pending: Set[int] = set()
+        self._collecting = 0
+        self._completed = -1
+        self._committing = False
+        self._errors: Dict[int, Exception] = {}
+        self.batches = 0
+        self.requests = 0
+
+    def commit(self, keys: Iterable[int]):
+        """Block until keys have been committed; re-raises the error of the batch that included them"""
+        with self._condition:
+            self._pending.update(keys)
+            self.requests += 1
+            batch = self._collecting
+            while self._completed < batch:
+                if not self._committing:
+                    self._committing = True
+                    keys = self._pending
+                    self._pending = set()
+                    batch = self._collecting
+                    self._collecting += 1
+                    break
+                self._condition.wait()
+            else:
+                error = self._errors.get(batch)
+                if error is not None:
+                    raise error
+                return
+
+        error = None
+        try:
+            self.commit_function(keys)
+        except Exception as e:
+            error = e
+        with self._condition:
+            self.batches += 1
+            self._completed = batch
+            self._committing = False
+            if error is not None:
+                self._errors[batch] = error
+            # Only waiters of the most recent batches can still ask for their error
+            for old in [old for old in self._errors if old < batch - 16]:
+                del self._errors[old]
+            self._condition.notify_all()
+        if error is not None:
+            raise error
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {"requests": self.requests, "batches": self.batches}
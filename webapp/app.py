@@ -2,7 +2,7 @@
 Modern RuneScape Cache API Test Web Application
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
 import requests
 import base64
 import os
@@ -10,7 +10,51 @@ import os
 app = Flask(__name__)
 
 # API endpoint configuration
-API_BASE_URL = "http://cache-api:5000"  # Updated for Docker networking
+API_BASE_URL = os.environ.get('CACHE_API_URL', "http://cache-api:5000")  # Docker networking by default
+
+# Keep-alive connections to the cache API, shared by all request threads
+POOL_SIZE = int(os.environ.get('CACHE_API_POOL_SIZE', 32))
+CONNECT_TIMEOUT = float(os.environ.get('CACHE_API_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.environ.get('CACHE_API_READ_TIMEOUT', 30))
+# Initializing, updating and rebuilding a large cache take longer than serving a file
+LONG_TIMEOUT = float(os.environ.get('CACHE_API_LONG_TIMEOUT', 600))
+CHUNK_SIZE = 64 * 1024
+
+session = requests.Session()
+session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, pool_block=True))
+session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, pool_block=True))
+
+# Sent on to the cache API; the conditional headers let its 304s reach the browser
+FORWARDED_REQUEST_HEADERS = ('Accept', 'Accept-Encoding', 'Content-Type', 'If-None-Match', 'If-Modified-Since')
+# Hop-by-hop headers describe the upstream connection, not the response
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailer',
+                      'transfer-encoding', 'upgrade'}
+
+def proxy(method, path, timeout=READ_TIMEOUT):
+    """Forward the current request to the cache API and stream its response back unchanged"""
+    headers = {name: request.headers[name] for name in FORWARDED_REQUEST_HEADERS if name in request.headers}
+    url = f"{API_BASE_URL}{path}"
+    if request.query_string:
+        url += "?" + request.query_string.decode("latin-1")
+    try:
+        upstream = session.request(method, url, data=request.get_data() or None, headers=headers,
+                                   timeout=(CONNECT_TIMEOUT, timeout), stream=True)
+    except requests.exceptions.RequestException as e:
+        return jsonify({"status": "error", "message": f"Failed to connect to cache API: {str(e)}"}), 500
+    
+    def body():
+        # Raw bytes, so a compressed or base64 body is neither decoded nor re-encoded
+        try:
+            yield from upstream.raw.stream(CHUNK_SIZE, decode_content=False)
+        finally:
+            upstream.close()
+    
+    response_headers = [(name, value) for name, value in upstream.headers.items()
+                        if name.lower() not in HOP_BY_HOP_HEADERS]
+    response = Response(body(), status=upstream.status_code, headers=response_headers)
+    # Closing the response returns the connection to the pool even if the client went away early
+    response.call_on_close(upstream.close)
+    return response
 
 @app.route('/')
 def index():
@@ -20,101 +64,67 @@ def index():
 @app.route('/api/initialize', methods=['POST'])
 def api_initialize():
     """Proxy endpoint to initialize the cache"""
-    try:
-        response = requests.post(f"{API_BASE_URL}/initialize", json=request.json, timeout=30)
-        return jsonify(response.json()), response.status_code
-    except requests.exceptions.RequestException as e:
-        return jsonify({"status": "error", "message": f"Failed to connect to cache API: {str(e)}"}), 500
+    return proxy('POST', "/initialize", timeout=LONG_TIMEOUT)
 
 @app.route('/api/data/<int:index_id>/<int:archive_id>/<int:file_id>', methods=['GET'])
 def api_get_file_data(index_id, archive_id, file_id):
     """Proxy endpoint to get file data"""
-    try:
-        response = requests.get(f"{API_BASE_URL}/data/{index_id}/{archive_id}/{file_id}", timeout=30)
-        return jsonify(response.json()), response.status_code
-    except requests.exceptions.RequestException as e:
-        return jsonify({"status": "error", "message": f"Failed to connect to cache API: {str(e)}"}), 500
+    return proxy('GET', f"/data/{index_id}/{archive_id}/{file_id}")
 
 @app.route('/api/data/<int:index_id>/<int:archive_id>', methods=['GET'])
 def api_get_archive_data(index_id, archive_id):
     """Proxy endpoint to get archive data"""
-    try:
-        response = requests.get(f"{API_BASE_URL}/data/{index_id}/{archive_id}", timeout=30)
-        return jsonify(response.json()), response.status_code
-    except requests.exceptions.RequestException as e:
-        return jsonify({"status": "error", "message": f"Failed to connect to cache API: {str(e)}"}), 500
+    return proxy('GET', f"/data/{index_id}/{archive_id}")
 
 @app.route('/api/put/<int:index_id>/<int:archive_id>/<int:file_id>', methods=['POST'])
 def api_put_file_data(index_id, archive_id, file_id):
     """Proxy endpoint to put file data"""
-    try:
-        response = requests.post(f"{API_BASE_URL}/put/{index_id}/{archive_id}/{file_id}", json=request.json, timeout=30)
-        return jsonify(response.json()), response.status_code
-    except requests.exceptions.RequestException as e:
-        return jsonify({"status": "error", "message": f"Failed to connect to cache API: {str(e)}"}), 500
+    return proxy('POST', f"/put/{index_id}/{archive_id}/{file_id}")
 
 @app.route('/api/put/<int:index_id>/<int:archive_id>', methods=['POST'])
 def api_put_archive_data(index_id, archive_id):
     """Proxy endpoint to put archive data"""
-    try:
-        response = requests.post(f"{API_BASE_URL}/put/{index_id}/{archive_id}", json=request.json, timeout=30)
-        return jsonify(response.json()), response.status_code
-    except requests.exceptions.RequestException as e:
-        return jsonify({"status": "error", "message": f"Failed to connect to cache API: {str(e)}"}), 500
+    return proxy('POST', f"/put/{index_id}/{archive_id}")
 
 @app.route('/api/remove/<int:index_id>/<int:archive_id>/<int:file_id>', methods=['DELETE'])
 def api_remove_file(index_id, archive_id, file_id):
     """Proxy endpoint to remove a file"""
-    try:
-        response = requests.delete(f"{API_BASE_URL}/remove/{index_id}/{archive_id}/{file_id}", timeout=30)
-        return jsonify(response.json()), response.status_code
-    except requests.exceptions.RequestException as e:
-        return jsonify({"status": "error", "message": f"Failed to connect to cache API: {str(e)}"}), 500
+    return proxy('DELETE', f"/remove/{index_id}/{archive_id}/{file_id}")
 
 @app.route('/api/remove/<int:index_id>/<int:archive_id>', methods=['DELETE'])
 def api_remove_archive(index_id, archive_id):
     """Proxy endpoint to remove an archive"""
-    try:
-        response = requests.delete(f"{API_BASE_URL}/remove/{index_id}/{archive_id}", timeout=30)
-        return jsonify(response.json()), response.status_code
-    except requests.exceptions.RequestException as e:
-        return jsonify({"status": "error", "message": f"Failed to connect to cache API: {str(e)}"}), 500
+    return proxy('DELETE', f"/remove/{index_id}/{archive_id}")
 
 @app.route('/api/update/<int:index_id>', methods=['POST'])
 def api_update_index(index_id):
     """Proxy endpoint to update an index"""
-    try:
-        response = requests.post(f"{API_BASE_URL}/update/{index_id}", timeout=30)
-        return jsonify(response.json()), response.status_code
-    except requests.exceptions.RequestException as e:
-        return jsonify({"status": "error", "message": f"Failed to connect to cache API: {str(e)}"}), 500
+    return proxy('POST', f"/update/{index_id}", timeout=LONG_TIMEOUT)
 
 @app.route('/api/add_archive/<int:index_id>', methods=['POST'])
 def api_add_archive(index_id):
     """Proxy endpoint to add an archive"""
-    try:
-        response = requests.post(f"{API_BASE_URL}/add_archive/{index_id}", json=request.json, timeout=30)
-        return jsonify(response.json()), response.status_code
-    except requests.exceptions.RequestException as e:
-        return jsonify({"status": "error", "message": f"Failed to connect to cache API: {str(e)}"}), 500
+    return proxy('POST', f"/add_archive/{index_id}")
 
 @app.route('/api/rebuild', methods=['POST'])
 def api_rebuild_cache():
     """Proxy endpoint to rebuild the cache"""
-    try:
-        response = requests.post(f"{API_BASE_URL}/rebuild", json=request.json, timeout=30)
-        return jsonify(response.json()), response.status_code
-    except requests.exceptions.RequestException as e:
-        return jsonify({"status": "error", "message": f"Failed to connect to cache API: {str(e)}"}), 500
+    return proxy('POST', "/rebuild", timeout=LONG_TIMEOUT)
+
+@app.route('/api/rebuild/<job_id>', methods=['GET'])
+def api_rebuild_status(job_id):
+    """Proxy endpoint to get the progress of a rebuild job"""
+    return proxy('GET', f"/rebuild/{job_id}")
+
+@app.route('/api/rebuild/<job_id>/cancel', methods=['POST'])
+def api_cancel_rebuild(job_id):
+    """Proxy endpoint to stop a rebuild job"""
+    return proxy('POST', f"/rebuild/{job_id}/cancel")
 
 @app.route('/api/health', methods=['GET'])
 def api_health_check():
     """Proxy endpoint to check API health"""
-    try:
-        response = requests.get(f"{API_BASE_URL}/health", timeout=10)
-        return jsonify(response.json()), response.status_code
-    except requests.exceptions.RequestException as e:
-        return jsonify({"status": "error", "message": f"Failed to connect to cache API: {str(e)}"}), 500
+    return proxy('GET', "/health", timeout=10)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True)